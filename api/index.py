@@ -11,6 +11,9 @@ try:
     from django.core.wsgi import get_wsgi_application
     
     application = get_wsgi_application()
+    
+    from chatbot.warmup import start_warm_up
+    start_warm_up()
 except Exception as e:
     import traceback
     error_details = traceback.format_exc()
@@ -1,179 +1,405 @@
 # agent_utils.py
 # Shared utilities for both agents
 
+import math
 import os
-from dotenv import load_dotenv
-from groq import Groq
+import re
+import time
+import threading
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .conversation_store import get_conversation_store
+from .keywords import matched_categories
+from .llm_cassette import apply_cassette_mode
+from .metrics import MODEL_CALLS, MODEL_FALLBACKS, MODEL_FIRST_TOKEN_SECONDS, MODEL_STREAM_SECONDS, MODEL_TOKENS
+from .model_router import Deadline, DeadlineExceeded, ModelRouter
+from .risk_assessment import NextStep, RiskAssessment, RiskLevel, format_risk_trailer
+from .tracing import add_stage, tag_trace
 
 # ===========================
-# LOAD ENV + GROQ INIT
+# LOAD ENV + LLM BACKEND
 # ===========================
 
-load_dotenv()
-client = None
-try:
-    api_key = os.getenv("GROQ_API_KEY")
-    if not api_key:
-        print("🔴 FATAL ERROR: GROQ_API_KEY not found in .env file.")
-    else:
-        client = Groq(api_key=api_key)
-        print(f"✅ Groq client initialized successfully.")
-except Exception as e:
-    print(f"🔴 FATAL ERROR during Groq initialization: {e}")
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_llm_backend():
+    """
+    Get the configured LLM backend (settings.CHATBOT_LLM_BACKEND), creating it on first use
+    
+    With CHATBOT_LLM_CASSETTE set, traffic is recorded to or replayed from a cassette.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                # The .env file holds the backend's API key; read it only once a backend is needed
+                from dotenv import load_dotenv
+                load_dotenv()
+                _backend = apply_cassette_mode(import_string(settings.CHATBOT_LLM_BACKEND))
+    return _backend
+
+def set_llm_backend(backend):
+    """Replace the process-wide LLM backend (e.g. with a StubBackend for load tests)"""
+    global _backend
+    _backend = backend
 
 def get_groq_client():
-    """Get the initialized Groq client"""
-    return client
+    """Get the Groq client when the Groq backend is in use"""
+    return getattr(get_llm_backend(), "client", None)
+
+def llm_configured():
+    """Check whether the LLM backend can take requests"""
+    return get_llm_backend().is_configured()
+
+# ===========================
+# LLM STREAMING
+# ===========================
+
+# Models tried in order when the previous one fails to start a completion
+FALLBACK_MODELS = [
+    "llama-3.1-8b-instant",
+    "llama-3.1-70b-versatile",
+    "llama-3.3-70b-versatile",
+]
+
+def _list_backend_models():
+    """Get the models the backend serves, for the router's capability table"""
+    backend = get_llm_backend()
+    return backend.list_models() if backend.is_configured() else None
+
+MODEL_ROUTER = ModelRouter(settings.CHATBOT_LLM_MODELS or FALLBACK_MODELS, list_models=_list_backend_models)
+
+def no_model_error(last_error, deadline):
+    """Get the error to raise when no model produced a stream"""
+    if last_error:
+        return last_error
+    if deadline.expired():
+        return DeadlineExceeded("No model could be tried before the request deadline")
+    return RuntimeError("All models are unavailable (circuit breakers open)")
+
+def open_completion(model, messages, temperature, max_tokens, deadline):
+    """
+    Start a streaming completion on one model through the LLM backend
+    
+    Returns:
+        DeltaStream: Text deltas; iteration raises on stream errors
+    """
+    completion = get_llm_backend().open_stream(model, messages, temperature, max_tokens, timeout=deadline.call_timeout())
+    MODEL_TOKENS.inc(estimate_prompt_tokens(messages), model=model, kind="prompt")
+    return completion
+
+def stream_model_deltas(model, deltas, started, raise_errors=False):
+    """
+    Forward a model's deltas, reporting the outcome to the router
+    
+    A stream abandoned part-way (e.g. the client disconnected) is neither a
+    success nor a failure, so its claim on the model is released. A stream
+    that fails part-way just ends, unless `raise_errors` is set.
+    """
+    first_token_latency = None
+    reported = False
+    parts = []
+    tag_trace(model=model)
+    try:
+        for delta in deltas:
+            if first_token_latency is None:
+                first_token_latency = time.monotonic() - started
+                add_stage("ttft", first_token_latency)
+                MODEL_FIRST_TOKEN_SECONDS.observe(first_token_latency, model=model)
+            parts.append(delta)
+            yield delta
+        MODEL_ROUTER.record_success(model, first_token_latency)
+        reported = True
+        MODEL_CALLS.inc(model=model, outcome="ok")
+        MODEL_STREAM_SECONDS.observe(time.monotonic() - started, model=model)
+        if first_token_latency is not None:
+            add_stage("stream", time.monotonic() - started - first_token_latency)
+    except Exception as stream_error:
+        MODEL_ROUTER.record_failure(model, stream_error)
+        reported = True
+        MODEL_CALLS.inc(model=model, outcome="stream_error")
+        print(f"⚠️ Error during streaming: {stream_error}")
+        if raise_errors:
+            raise
+    finally:
+        if not reported:
+            MODEL_ROUTER.release(model)
+            MODEL_CALLS.inc(model=model, outcome="abandoned")
+        MODEL_TOKENS.inc(estimate_tokens("".join(parts)), model=model, kind="completion")
+
+def stream_chat_completion(messages, temperature=0.7, max_tokens=2048, deadline=None, raise_errors=False):
+    """
+    Stream a chat completion through the model fallback chain
+    
+    Models with an open circuit breaker are skipped, and every call's
+    timeout is capped by the turn's deadline.
+    
+    Args:
+        raise_errors: Raise when the stream breaks part-way instead of ending
+                      it early (for callers that must not use partial text)
+    
+    Yields:
+        str: Text deltas as they arrive from the model
+    """
+    deadline = deadline or Deadline()
+    completion = None
+    last_error = None
+    for model in MODEL_ROUTER.candidates():
+        if deadline.expired():
+            break
+        if not MODEL_ROUTER.acquire(model):
+            continue
+        started = time.monotonic()
+        try:
+            completion = open_completion(model, messages, temperature, max_tokens, deadline)
+            break
+        except Exception as model_error:
+            MODEL_ROUTER.record_failure(model, model_error)
+            MODEL_CALLS.inc(model=model, outcome="open_error")
+            add_stage("fallback", time.monotonic() - started)
+            last_error = model_error
+            print(f"⚠️ Model {model} failed, trying the next model: {model_error}")
+    if completion is None:
+        raise no_model_error(last_error, deadline)
+    if last_error is not None:
+        MODEL_FALLBACKS.inc(model=model)
+    
+    yield from stream_model_deltas(model, completion, started, raise_errors)
+
+async def aopen_completion(model, messages, temperature, max_tokens, deadline):
+    """Async variant of open_completion"""
+    completion = await get_llm_backend().aopen_stream(model, messages, temperature, max_tokens, timeout=deadline.call_timeout())
+    MODEL_TOKENS.inc(estimate_prompt_tokens(messages), model=model, kind="prompt")
+    return completion
+
+async def astream_model_deltas(model, deltas, started):
+    """Async variant of stream_model_deltas"""
+    first_token_latency = None
+    reported = False
+    parts = []
+    tag_trace(model=model)
+    try:
+        async for delta in deltas:
+            if first_token_latency is None:
+                first_token_latency = time.monotonic() - started
+                add_stage("ttft", first_token_latency)
+                MODEL_FIRST_TOKEN_SECONDS.observe(first_token_latency, model=model)
+            parts.append(delta)
+            yield delta
+        MODEL_ROUTER.record_success(model, first_token_latency)
+        reported = True
+        MODEL_CALLS.inc(model=model, outcome="ok")
+        MODEL_STREAM_SECONDS.observe(time.monotonic() - started, model=model)
+        if first_token_latency is not None:
+            add_stage("stream", time.monotonic() - started - first_token_latency)
+    except Exception as stream_error:
+        MODEL_ROUTER.record_failure(model, stream_error)
+        reported = True
+        MODEL_CALLS.inc(model=model, outcome="stream_error")
+        print(f"⚠️ Error during streaming: {stream_error}")
+    finally:
+        if not reported:
+            MODEL_ROUTER.release(model)
+            MODEL_CALLS.inc(model=model, outcome="abandoned")
+        MODEL_TOKENS.inc(estimate_tokens("".join(parts)), model=model, kind="completion")
+
+async def astream_chat_completion(messages, temperature=0.7, max_tokens=2048, deadline=None):
+    """
+    Async variant of stream_chat_completion
+    
+    Yields:
+        str: Text deltas as they arrive from the model
+    """
+    deadline = deadline or Deadline()
+    completion = None
+    last_error = None
+    for model in MODEL_ROUTER.candidates():
+        if deadline.expired():
+            break
+        if not MODEL_ROUTER.acquire(model):
+            continue
+        started = time.monotonic()
+        try:
+            completion = await aopen_completion(model, messages, temperature, max_tokens, deadline)
+            break
+        except Exception as model_error:
+            MODEL_ROUTER.record_failure(model, model_error)
+            MODEL_CALLS.inc(model=model, outcome="open_error")
+            add_stage("fallback", time.monotonic() - started)
+            last_error = model_error
+            print(f"⚠️ Model {model} failed, trying the next model: {model_error}")
+    if completion is None:
+        raise no_model_error(last_error, deadline)
+    if last_error is not None:
+        MODEL_FALLBACKS.inc(model=model)
+    
+    async for delta in astream_model_deltas(model, completion, started):
+        yield delta
+
+def collect_stream(stream):
+    """
+    Drain a streaming agent generator, discarding its text deltas
+
+    Returns:
+        The value the generator returned when it finished
+    """
+    while True:
+        try:
+            next(stream)
+        except StopIteration as stop:
+            return stop.value
+
+# ===========================
+# TOKEN ESTIMATION
+# ===========================
+
+def estimate_tokens(text):
+    """
+    Estimate the token count of text without loading a tokenizer
+
+    Llama-family tokenizers average about 4 characters per token for
+    English/Roman Urdu; Urdu, Hindi and Arabic script cost about one token
+    per character, so non-ASCII characters are counted individually.
+
+    Returns:
+        int: Approximate token count
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    return math.ceil((len(text) - non_ascii) / 4) + non_ascii
+
+def estimate_prompt_tokens(messages):
+    """Estimate the prompt tokens of a model request from its text (image parts are not counted)"""
+    total = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+        total += estimate_tokens(content)
+    return total
 
 # ===========================
 # SESSION MANAGEMENT
 # ===========================
 
 def get_user_session(request):
-    """Get or create user session data using Django sessions"""
+    """
+    Get or create user session data
+    
+    The Django session only carries the conversation ID; state and history
+    live in the server-side conversation store, or in the session itself
+    with SessionConversationStore.
+    """
     # Initialize session if not exists
     if not request.session.session_key:
         request.session.create()
     
-    # Get session data from Django session
-    session_data = request.session.get('chatbot_data')
-    if session_data is None:
-        session_data = {
+    store = get_conversation_store()
+    conversation_id = request.session.get('chatbot_conversation_id')
+    if store.in_session:
+        loaded = store.load_session(request.session)
+    else:
+        loaded = store.load(conversation_id) if conversation_id else None
+    if loaded is None:
+        if not conversation_id:
+            conversation_id = store.new_id()
+            request.session['chatbot_conversation_id'] = conversation_id
+        return {
             "current_agent": "orchestrator",  # 'orchestrator' or 'interview'
             "language": None,
             "conversation_history": [],
             "referred_to_interview": False
         }
-        request.session['chatbot_data'] = session_data
     
-    return session_data
+    state, history = loaded
+    state["conversation_history"] = history
+    return state
+
+def to_prompt_message(message):
+    """
+    Strip stored metadata (e.g. analysis) from a history message before sending it to the model
+    
+    Assistant replies get their risk trailer back from the stored codes, so the
+    model keeps seeing the format it is asked to end every reply with.
+    """
+    content = message.get("content", "")
+    risk = message.get("risk")
+    if risk and risk[0]:
+        content += format_risk_trailer(RiskAssessment(RiskLevel(risk[0]), NextStep(risk[1])))
+    return {"role": message.get("role"), "content": content}
 
 def save_user_session(request, session_data):
-    """Save user session data to Django session"""
-    request.session['chatbot_data'] = session_data
-    request.session.modified = True
+    """Save user session data to the conversation store"""
+    conversation_id = request.session.get('chatbot_conversation_id')
+    if not conversation_id:
+        conversation_id = get_conversation_store().new_id()
+        request.session['chatbot_conversation_id'] = conversation_id
+    
+    state = {key: value for key, value in session_data.items() if key != "conversation_history"}
+    store = get_conversation_store()
+    if store.in_session:
+        store.save_session(request.session, state, session_data.get("conversation_history", []))
+    else:
+        store.save(conversation_id, state, session_data.get("conversation_history", []))
+
+def turn_index(session_data, conversation_history):
+    """Index of the turn being answered, counting the messages a session-kept history has dropped"""
+    return (session_data.get("trimmed_messages", 0) + len(conversation_history)) // 2
 
 # ===========================
 # DETECTION FUNCTIONS
 # ===========================
 
+# Keyword categories (see keywords.KEYWORD_TABLE) that count as a mental health concern
+MENTAL_HEALTH_CATEGORIES = frozenset(["suicidal", "concern_urdu", "hopelessness", "crisis"])
+
+# Explicit language mentions, checked in priority order
+LANGUAGE_PREFERENCES = [
+    ("language_urdu_hindi", "Urdu/Hindi"),
+    ("language_spanish", "Spanish"),
+    ("language_french", "French"),
+    ("language_arabic", "Arabic"),
+    ("language_english", "English"),
+]
+
 def detect_suicidal_keywords(text):
     """Detect suicidal keywords and phrases in multiple languages - CRITICAL for immediate referral"""
     if not text:
         return False
     
-    text_lower = text.lower()
-    
-    # Suicidal ideation indicators (English)
-    suicidal_keywords_english = [
-        'suicide', 'kill myself', 'end my life', 'want to die', 'better off dead',
-        'not worth living', 'suicidal', 'self-harm', 'hurt myself', 'end it all',
-        'taking my life', 'ending it', 'wish i was dead'
-    ]
-    
-    # Suicidal ideation indicators (Urdu/Hindi - transliterated and common phrases)
-    suicidal_keywords_urdu = [
-        'khud kushi', 'khudkushi', 'apne aap ko mar', 'mar jana', 'jan dena',
-        'zindagi khatam', 'khatam karna', 'khatam kar dena', 'marna chahta',
-        'marna chahunga', 'marne ki soch', 'suicide'
-    ]
-    
-    suicidal_keywords = suicidal_keywords_english + suicidal_keywords_urdu
-    
-    for keyword in suicidal_keywords:
-        if keyword in text_lower:
-            return True
-    
-    return False
+    return "suicidal" in matched_categories(text)
 
 def detect_mental_health_concerns(text):
     """Detect keywords and phrases indicating mental health concerns in multiple languages"""
     if not text:
         return False
     
-    text_lower = text.lower()
-    
-    # Suicidal ideation indicators (English)
-    suicidal_keywords_english = [
-        'suicide', 'kill myself', 'end my life', 'want to die', 'better off dead',
-        'not worth living', 'suicidal', 'self-harm', 'hurt myself', 'end it all',
-        'kill myself', 'taking my life', 'ending it', 'want to die', 'wish i was dead'
-    ]
-    
-    # Suicidal ideation indicators (Urdu/Hindi - transliterated and common phrases)
-    suicidal_keywords_urdu = [
-        'khud kushi', 'khudkushi', 'apne aap ko mar', 'mar jana', 'jan dena',
-        'zindagi khatam', 'khatam karna', 'khatam kar dena', 'marna chahta',
-        'marna chahunga', 'marne ki soch', 'suicide', 'kisi'
-    ]
-    
-    # Severe depression/hopelessness indicators
-    hopelessness_keywords = [
-        'hopeless', 'no point', 'no future', 'nothing matters', 'can\'t go on',
-        'give up', 'despair', 'helpless', 'worthless', 'deep depression',
-        'severe depression', 'major depression', 'umsaid', 'be umeed', 'nirash'
-    ]
-    
-    # Crisis indicators
-    crisis_keywords = [
-        'emergency', 'crisis', 'urgent help', 'immediate danger', 'can\'t cope',
-        'overwhelmed', 'breakdown', 'panic attack', 'severe anxiety'
-    ]
-    
-    all_keywords = suicidal_keywords_english + suicidal_keywords_urdu + hopelessness_keywords + crisis_keywords
-    
-    for keyword in all_keywords:
-        if keyword in text_lower:
-            return True
-    
-    return False
+    return not MENTAL_HEALTH_CATEGORIES.isdisjoint(matched_categories(text))
 
 def detect_referral_request(text):
     """Detect if user wants to be referred to interview agent"""
     if not text:
         return False
     
-    text_lower = text.lower()
-    referral_indicators = [
-        'yes', 'sure', 'okay', 'ok', 'yes please', 'connect me', 'speak with specialist',
-        'talk to psychiatrist', 'interview', 'assessment', 'help me', 'need help'
-    ]
-    
-    for indicator in referral_indicators:
-        if indicator in text_lower:
-            return True
-    
-    return False
+    return "referral" in matched_categories(text)
 
 def detect_language_preference(message):
     """Detect language preference from user message"""
     if not message:
         return None
     
-    message_lower = message.lower()
+    categories = matched_categories(message)
     
     # Check for explicit language mentions
-    if any(word in message_lower for word in ['urdu', 'اردو', 'hindi', 'हिंदी', 'i speak urdu', 'i speak hindi']):
-        return "Urdu/Hindi"
-    elif any(word in message_lower for word in ['spanish', 'español', 'i speak spanish']):
-        return "Spanish"
-    elif any(word in message_lower for word in ['french', 'français', 'i speak french']):
-        return "French"
-    elif any(word in message_lower for word in ['arabic', 'عربي', 'i speak arabic']):
-        return "Arabic"
-    elif any(word in message_lower for word in ['english', 'i speak english']):
-        return "English"
+    for category, language in LANGUAGE_PREFERENCES:
+        if category in categories:
+            return language
     
     # Auto-detect from actual text content (Urdu/Hindi)
-    urdu_hindi_indicators = [
-        'میں', 'آپ', 'ہے', 'ہیں', 'کر', 'کے', 'کی', 'سے', 'کو', 'پر', 'اور', 'لیکن', 'تھا', 'تھی',
-        'mein', 'aap', 'hai', 'hain', 'kar', 'ke', 'ki', 'se', 'ko', 'par', 'aur', 'lekin', 'tha', 'thi',
-        'mujhe', 'tum', 'tu', 'main', 'tumhara', 'tumhari', 'tumhare', 'apna', 'apne', 'apni',
-        'मैं', 'आप', 'है', 'हैं', 'कर', 'के', 'की', 'से', 'को', 'पर', 'और', 'लेकिन', 'था', 'थी',
-        'मुझे', 'तुम', 'तू', 'मैन', 'तुम्हारा', 'तुम्हारी', 'तुम्हारे', 'अपना', 'अपने', 'अपनी'
-    ]
-    
-    if any(indicator in message for indicator in urdu_hindi_indicators):
+    if "urdu_hindi_text" in categories:
         return "Urdu/Hindi"
     
     return None
@@ -0,0 +1,138 @@
+# context_builder.py
+# Fits conversation history into a per-agent token budget
+
+from collections import namedtuple
+
+from django.conf import settings
+
+from .agent_utils import estimate_tokens, to_prompt_message
+from .message_analysis import is_crisis_message
+from .metrics import CONTEXT_TOKENS
+from .tracing import tag_trace
+
+# ===========================
+# CONFIGURATION
+# ===========================
+
+# Fixed history slices the agents used before budgeting, kept for the savings report
+LEGACY_HISTORY_WINDOWS = {
+    "orchestrator": 10,
+    "interview": 15,
+}
+
+# A partially fitting message is truncated only if at least this many tokens are left
+MIN_TRUNCATED_TOKENS = 48
+
+TRUNCATION_MARKER = " […]"
+
+ContextWindow = namedtuple("ContextWindow", ["messages", "tokens", "saved_tokens", "dropped", "truncated"])
+
+def history_budget(agent):
+    """Get the history token budget for an agent from settings"""
+    if agent == "interview":
+        return settings.CHATBOT_INTERVIEW_HISTORY_TOKENS
+    return settings.CHATBOT_ORCHESTRATOR_HISTORY_TOKENS
+
+# ===========================
+# TOKEN HELPERS
+# ===========================
+
+def message_tokens(message):
+    """Get the token count cached on a history message, estimating it for messages stored without one"""
+    tokens = message.get("tokens")
+    if tokens is None:
+        tokens = estimate_tokens(message.get("content", ""))
+    return tokens
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to roughly max_tokens, keeping its beginning"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep = max(0, int(len(text) * max_tokens / tokens) - len(TRUNCATION_MARKER))
+    return text[:keep].rstrip() + TRUNCATION_MARKER
+
+def _fitted_message(message, max_tokens):
+    """
+    Convert a history message to prompt form, truncated to max_tokens
+
+    Returns:
+        tuple: (prompt message, tokens, truncated)
+    """
+    prompt_message = to_prompt_message(message)
+    tokens = message_tokens(message)
+    if tokens <= max_tokens:
+        return prompt_message, tokens, False
+    prompt_message["content"] = truncate_to_tokens(prompt_message["content"], max_tokens)
+    return prompt_message, estimate_tokens(prompt_message["content"]), True
+
+# ===========================
+# CONTEXT BUILDER
+# ===========================
+
+def build_history_window(conversation_history, agent, start=0):
+    """
+    Select the history messages to send with an agent prompt
+
+    Crisis turns (a flagged user message and the reply to it) are always
+    kept. The remaining budget is filled newest-first; the first message that
+    does not fit is truncated if enough budget is left, and everything older
+    is dropped. No single message may take more than a third of the budget,
+    so one pasted essay or safety plan cannot crowd out the rest. Messages
+    before `start` are covered by the rolling summary and never sent.
+
+    Returns:
+        ContextWindow: Prompt messages in order, their tokens, tokens saved
+        against the agent's old fixed slice, and dropped/truncated counts
+    """
+    budget = history_budget(agent)
+    max_message_tokens = max(MIN_TRUNCATED_TOKENS, budget // 3)
+
+    pinned = set()
+    for index in range(start, len(conversation_history)):
+        if is_crisis_message(conversation_history[index]):
+            pinned.add(index)
+            if index + 1 < len(conversation_history) and conversation_history[index + 1].get("role") == "assistant":
+                pinned.add(index + 1)
+
+    selected = {}
+    used = 0
+    truncated = 0
+    for index in pinned:
+        prompt_message, tokens, was_truncated = _fitted_message(conversation_history[index], max_message_tokens)
+        selected[index] = prompt_message
+        used += tokens
+        truncated += was_truncated
+
+    for index in range(len(conversation_history) - 1, start - 1, -1):
+        if index in pinned:
+            continue
+        remaining = budget - used
+        if min(message_tokens(conversation_history[index]), max_message_tokens) > remaining and remaining < MIN_TRUNCATED_TOKENS:
+            break
+        limit = min(max_message_tokens, remaining)
+        prompt_message, tokens, was_truncated = _fitted_message(conversation_history[index], limit)
+        selected[index] = prompt_message
+        used += tokens
+        truncated += was_truncated
+        if was_truncated and limit == remaining:
+            # Budget exhausted - older messages are dropped
+            break
+
+    legacy_window = LEGACY_HISTORY_WINDOWS.get(agent, 10)
+    legacy_tokens = sum(message_tokens(message) for message in conversation_history[-legacy_window:])
+    window = ContextWindow(
+        messages=[selected[index] for index in sorted(selected)],
+        tokens=used,
+        saved_tokens=legacy_tokens - used,
+        dropped=len(conversation_history) - start - len(selected),
+        truncated=truncated,
+    )
+    CONTEXT_TOKENS.observe(window.tokens, agent=agent)
+    tag_trace(
+        context_tokens=window.tokens,
+        context_saved_tokens=window.saved_tokens,
+        context_dropped=window.dropped,
+        context_truncated=window.truncated,
+    )
+    return window
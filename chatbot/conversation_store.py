@@ -0,0 +1,469 @@
+# conversation_store.py
+# Server-side conversation storage - the session cookie only carries a conversation ID
+# (except with SessionConversationStore, for serverless hosts)
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .history_codec import CompactHistory
+
+# ===========================
+# STORE INTERFACE
+# ===========================
+
+# State keys owned by the rolling summary (chatbot.summarizer)
+SUMMARY_KEYS = ("summary", "summarized_until")
+
+class ConversationStore:
+    """
+    Base class for conversation stores
+
+    A conversation is a small JSON state dict (current agent, language, flags)
+    plus an append-only log of history messages. Messages may carry extra
+    keys (such as a memoized analysis record) besides role and content.
+    Conversations not written for `ttl` seconds are treated as gone and evicted.
+
+    The rolling summary (SUMMARY_KEYS) is stored beside the state and only
+    written through save_summary, so a request saving the state it loaded
+    before a background summary finished cannot overwrite that summary.
+    """
+
+    # True for stores that keep the conversation in the request's session (SessionConversationStore)
+    in_session = False
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else settings.CHATBOT_CONVERSATION_TTL
+
+    def new_id(self):
+        """Generate a new conversation ID"""
+        return uuid.uuid4().hex
+
+    def load(self, conversation_id):
+        """
+        Load a conversation
+
+        Returns:
+            tuple: (state, history) or None if missing or expired; the state
+            includes the summary keys once a summary exists
+        """
+        raise NotImplementedError
+
+    def save(self, conversation_id, state, history):
+        """
+        Persist the state and append any history messages not stored yet
+
+        A history shorter than the stored log means the conversation was reset,
+        so the log and summary are cleared and the log rewritten. Summary keys
+        in `state` are ignored.
+        """
+        raise NotImplementedError
+
+    def save_summary(self, conversation_id, summary, summarized_until, expected_until):
+        """
+        Store the rolling summary if it still extends the stored one
+
+        Returns:
+            bool: False if another update got there first, the summary now
+            covers more messages than exist, or the conversation is gone
+        """
+        raise NotImplementedError
+
+    def delete(self, conversation_id):
+        """Remove a conversation and its log"""
+        raise NotImplementedError
+
+    def evict_expired(self):
+        """
+        Remove conversations idle for longer than the TTL
+
+        Returns:
+            int: Number of conversations removed
+        """
+        raise NotImplementedError
+
+# ===========================
+# IN-MEMORY BACKEND
+# ===========================
+
+class MemoryConversationStore(ConversationStore):
+    """Process-local store for tests and single-process development"""
+
+    def __init__(self, ttl=None):
+        super().__init__(ttl)
+        self._lock = threading.Lock()
+        self._conversations = {}
+
+    def load(self, conversation_id):
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None:
+                return None
+            if time.time() - entry["updated_at"] > self.ttl:
+                del self._conversations[conversation_id]
+                return None
+            state = dict(entry["state"])
+            state.update(entry.get("summary", {}))
+            return state, [dict(message) for message in entry["log"]]
+
+    def save(self, conversation_id, state, history):
+        with self._lock:
+            entry = self._conversations.setdefault(conversation_id, {"state": {}, "log": [], "updated_at": 0})
+            if len(history) < len(entry["log"]):
+                entry["log"] = []
+                entry.pop("summary", None)
+            entry["log"].extend(dict(message) for message in history[len(entry["log"]):])
+            entry["state"] = _without_summary(state)
+            entry["updated_at"] = time.time()
+
+    def save_summary(self, conversation_id, summary, summarized_until, expected_until):
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None or summarized_until > len(entry["log"]):
+                return False
+            if entry.get("summary", {}).get("summarized_until", 0) != expected_until:
+                return False
+            entry["summary"] = {"summary": summary, "summarized_until": summarized_until}
+            return True
+
+    def delete(self, conversation_id):
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+    def evict_expired(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [cid for cid, entry in self._conversations.items() if entry["updated_at"] < cutoff]
+            for cid in expired:
+                del self._conversations[cid]
+        return len(expired)
+
+# ===========================
+# SQLITE BACKEND
+# ===========================
+
+def _without_summary(state):
+    """Copy the state without the summary keys, which are stored separately"""
+    return {key: value for key, value in state.items() if key not in SUMMARY_KEYS}
+
+def _extra_fields(message):
+    """Serialize the message keys besides role and content (e.g. memoized analysis)"""
+    extra = {key: value for key, value in message.items() if key not in ("role", "content")}
+    return json.dumps(extra) if extra else None
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    SQLite store tuned for concurrent writers
+
+    Uses WAL journaling so readers never block the writer, one persistent
+    connection per thread, and a busy timeout instead of failing on lock
+    contention. Expired conversations are swept at most once per
+    `evict_interval` seconds from the write path.
+    """
+
+    def __init__(self, path=None, ttl=None, evict_interval=300):
+        super().__init__(ttl)
+        self.path = str(path or settings.CHATBOT_CONVERSATION_DB)
+        self.evict_interval = evict_interval
+        self._local = threading.local()
+        self._last_eviction = time.time()
+        self._create_tables()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=10000")
+            self._local.connection = connection
+        return connection
+
+    def _create_tables(self):
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            " id TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " message_count INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " summary TEXT,"
+            " summarized_until INTEGER NOT NULL DEFAULT 0)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_turns ("
+            " conversation_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " role TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " extra TEXT,"
+            " PRIMARY KEY (conversation_id, seq)) WITHOUT ROWID"
+        )
+        # Add columns introduced after the first release to existing databases
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(conversation_turns)")]
+        if "extra" not in columns:
+            connection.execute("ALTER TABLE conversation_turns ADD COLUMN extra TEXT")
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(conversations)")]
+        if "summary" not in columns:
+            connection.execute("ALTER TABLE conversations ADD COLUMN summary TEXT")
+            connection.execute("ALTER TABLE conversations ADD COLUMN summarized_until INTEGER NOT NULL DEFAULT 0")
+        connection.execute("CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at)")
+
+    def load(self, conversation_id):
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT state, updated_at, summary, summarized_until FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        state = json.loads(row[0])
+        if row[2] is not None:
+            state["summary"], state["summarized_until"] = row[2], row[3]
+        return state, self._read_history(connection, conversation_id)
+
+    # The history log is read and written through these hooks (one row per message here)
+
+    def _read_history(self, connection, conversation_id):
+        turns = connection.execute(
+            "SELECT role, content, extra FROM conversation_turns WHERE conversation_id = ? ORDER BY seq",
+            (conversation_id,),
+        ).fetchall()
+        history = []
+        for role, content, extra in turns:
+            message = json.loads(extra) if extra else {}
+            message["role"] = role
+            message["content"] = content
+            history.append(message)
+        return history
+
+    def _write_history(self, connection, conversation_id, history, stored):
+        """Store history[stored:] after the `stored` messages already in the log"""
+        connection.executemany(
+            "INSERT INTO conversation_turns (conversation_id, seq, role, content, extra) VALUES (?, ?, ?, ?, ?)",
+            [
+                (conversation_id, seq, message.get("role", ""), message.get("content", ""), _extra_fields(message))
+                for seq, message in enumerate(history[stored:], start=stored)
+            ],
+        )
+
+    def _clear_history(self, connection, conversation_id):
+        connection.execute("DELETE FROM conversation_turns WHERE conversation_id = ?", (conversation_id,))
+
+    def _evict_history(self, connection, cutoff):
+        connection.execute(
+            "DELETE FROM conversation_turns WHERE conversation_id IN"
+            " (SELECT id FROM conversations WHERE updated_at < ?)",
+            (cutoff,),
+        )
+
+    def save(self, conversation_id, state, history):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT message_count FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+            stored = row[0] if row else 0
+            if len(history) < stored:
+                self._clear_history(connection, conversation_id)
+                connection.execute(
+                    "UPDATE conversations SET summary = NULL, summarized_until = 0 WHERE id = ?", (conversation_id,)
+                )
+                stored = 0
+            self._write_history(connection, conversation_id, history, stored)
+            connection.execute(
+                "INSERT INTO conversations (id, state, message_count, updated_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET"
+                " state = excluded.state, message_count = excluded.message_count, updated_at = excluded.updated_at",
+                (conversation_id, json.dumps(_without_summary(state)), len(history), time.time()),
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+        if time.time() - self._last_eviction > self.evict_interval:
+            self._last_eviction = time.time()
+            self.evict_expired()
+
+    def save_summary(self, conversation_id, summary, summarized_until, expected_until):
+        connection = self._connection()
+        updated = connection.execute(
+            "UPDATE conversations SET summary = ?, summarized_until = ?"
+            " WHERE id = ? AND summarized_until = ? AND message_count >= ?",
+            (summary, summarized_until, conversation_id, expected_until, summarized_until),
+        ).rowcount
+        return updated == 1
+
+    def delete(self, conversation_id):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        self._clear_history(connection, conversation_id)
+        connection.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+        connection.execute("COMMIT")
+
+    def evict_expired(self):
+        connection = self._connection()
+        cutoff = time.time() - self.ttl
+        connection.execute("BEGIN IMMEDIATE")
+        self._evict_history(connection, cutoff)
+        removed = connection.execute("DELETE FROM conversations WHERE updated_at < ?", (cutoff,)).rowcount
+        connection.execute("COMMIT")
+        return removed
+
+class CompactSQLiteConversationStore(SQLiteConversationStore):
+    """
+    SQLite store keeping each conversation's history as one encoded blob
+
+    The blob is a chatbot.history_codec.CompactHistory (role codes, interned
+    strings, cached token counts, compressed per
+    settings.CHATBOT_HISTORY_COMPRESSION), so a load is one row read and one
+    decode instead of a row and a JSON parse per message. New messages are
+    appended to the decoded container and the blob rewritten. Conversations written by
+    SQLiteConversationStore in the same database are still read from their
+    rows and move to a blob on their next save.
+    """
+
+    def _create_tables(self):
+        super()._create_tables()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS conversation_histories ("
+            " conversation_id TEXT PRIMARY KEY,"
+            " message_count INTEGER NOT NULL,"
+            " history BLOB NOT NULL) WITHOUT ROWID"
+        )
+
+    def _read_history(self, connection, conversation_id):
+        row = connection.execute(
+            "SELECT history FROM conversation_histories WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        if row is None:
+            return super()._read_history(connection, conversation_id)
+        return CompactHistory.decode(row[0]).to_messages()
+
+    def _write_history(self, connection, conversation_id, history, stored):
+        if stored == len(history) and stored:
+            return
+        row = connection.execute(
+            "SELECT message_count, history FROM conversation_histories WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        if row is not None and row[0] == stored:
+            # Append to the stored container instead of re-interning the whole history
+            compact = CompactHistory.decode(row[1])
+            compact.extend(history[stored:])
+        else:
+            compact = CompactHistory.from_messages(history)
+            super()._clear_history(connection, conversation_id)
+        connection.execute(
+            "INSERT INTO conversation_histories (conversation_id, message_count, history) VALUES (?, ?, ?)"
+            " ON CONFLICT (conversation_id) DO UPDATE SET"
+            " message_count = excluded.message_count, history = excluded.history",
+            (conversation_id, len(history), compact.encode()),
+        )
+
+    def _clear_history(self, connection, conversation_id):
+        super()._clear_history(connection, conversation_id)
+        connection.execute("DELETE FROM conversation_histories WHERE conversation_id = ?", (conversation_id,))
+
+    def _evict_history(self, connection, cutoff):
+        super()._evict_history(connection, cutoff)
+        connection.execute(
+            "DELETE FROM conversation_histories WHERE conversation_id IN"
+            " (SELECT id FROM conversations WHERE updated_at < ?)",
+            (cutoff,),
+        )
+
+# ===========================
+# SESSION BACKEND
+# ===========================
+
+class SessionConversationStore(ConversationStore):
+    """
+    Store keeping the conversation in the Django session (the signed cookie)
+
+    For serverless hosts such as Vercel, whose instances have no writable
+    file they could share: each request carries its own conversation, so
+    any instance can answer it. The cookie has to stay under the browsers'
+    4 KB limit, so only the last `max_messages` history messages are kept
+    (without their memoized analysis) and no rolling summary is made; the
+    state's "trimmed_messages" counts the messages dropped so far.
+
+    Conversations are only reachable through load_session/save_session with
+    the request's session; the ID-keyed methods find nothing.
+    """
+
+    in_session = True
+
+    SESSION_KEY = "chatbot_conversation"
+
+    def __init__(self, ttl=None, max_messages=None):
+        super().__init__(ttl)
+        self.max_messages = settings.CHATBOT_SESSION_HISTORY_MESSAGES if max_messages is None else max_messages
+
+    def load_session(self, session):
+        """
+        Load the conversation kept in a session
+
+        Returns:
+            tuple: (state, history) or None if the session holds none
+        """
+        stored = session.get(self.SESSION_KEY)
+        if stored is None:
+            return None
+        return dict(stored["state"]), [dict(message) for message in stored["history"]]
+
+    def save_session(self, session, state, history):
+        """Keep the state and the most recent history messages in a session"""
+        state = _without_summary(state)
+        # Drop whole turns, so the kept history still starts with a user message
+        dropped = max(0, len(history) - self.max_messages)
+        dropped += dropped % 2
+        state["trimmed_messages"] = state.get("trimmed_messages", 0) + dropped
+        session[self.SESSION_KEY] = {
+            "state": state,
+            "history": [
+                {key: value for key, value in message.items() if key != "analysis"} for message in history[dropped:]
+            ],
+        }
+
+    def load(self, conversation_id):
+        return None
+
+    def save(self, conversation_id, state, history):
+        raise NotImplementedError("SessionConversationStore keeps conversations in the session, use save_session")
+
+    def save_summary(self, conversation_id, summary, summarized_until, expected_until):
+        return False
+
+    def delete(self, conversation_id):
+        pass
+
+    def evict_expired(self):
+        # Expired sessions take their conversation with them
+        return 0
+
+# ===========================
+# STORE FACTORY
+# ===========================
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_conversation_store():
+    """Get the configured conversation store (settings.CHATBOT_CONVERSATION_STORE)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = import_string(settings.CHATBOT_CONVERSATION_STORE)()
+    return _store
+
+def set_conversation_store(store):
+    """Replace the process-wide conversation store (e.g. with a MemoryConversationStore in tests)"""
+    global _store
+    _store = store
@@ -0,0 +1,542 @@
+# escalation_queue.py
+# Durable SQLite queue delivering human escalations to pluggable sinks off the request path
+# (or directly, on serverless hosts)
+
+import json
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .metrics import ESCALATION_DELIVERIES, ESCALATIONS
+from .risk_assessment import RiskLevel
+
+# ===========================
+# CONFIGURATION
+# ===========================
+
+# Delivery order and dedupe strength: a higher-priority escalation is never swallowed by a lower one
+PRIORITY_RANK = {"HIGH": 1, "URGENT": 2}
+
+# Seconds a worker may hold a task before another worker takes it over (crashed or stuck worker)
+LEASE_SECONDS = 60
+
+# Longest idle wait of a worker between checks for due tasks
+POLL_SECONDS = 1.0
+
+# ===========================
+# SINKS
+# ===========================
+
+class EscalationSink:
+    """
+    Base class for escalation destinations (on-call doctor, moderator, helpline)
+
+    deliver() gets the escalation payload and raises on failure; the queue
+    retries failed deliveries with backoff, per sink, so one unreachable
+    destination never holds up or repeats the others.
+    """
+
+    name = "sink"
+
+    def deliver(self, escalation):
+        raise NotImplementedError
+
+class LogSink(EscalationSink):
+    """Print escalations to the server log (development, and a record next to real sinks)"""
+
+    name = "log"
+
+    def deliver(self, escalation):
+        print(
+            f"🚨 Escalation {escalation['priority']} (risk {escalation.get('risk_level', 'NONE')}) for conversation {escalation['conversation_id']}"
+            f" ({escalation['occurrences']} turn(s) since {escalation['first_seen']})"
+        )
+
+class WebhookSink(EscalationSink):
+    """
+    POST escalations as JSON to settings.CHATBOT_ESCALATION_WEBHOOK_URL
+
+    Any non-2xx response or network error counts as a failed delivery. The
+    payload identifies the conversation but carries none of its messages.
+    """
+
+    name = "webhook"
+
+    def __init__(self, url=None, timeout=None):
+        self.url = url or settings.CHATBOT_ESCALATION_WEBHOOK_URL
+        self.timeout = timeout if timeout is not None else settings.CHATBOT_ESCALATION_WEBHOOK_TIMEOUT
+        import httpx
+        self._client = httpx.Client(timeout=self.timeout)
+
+    def deliver(self, escalation):
+        if not self.url:
+            raise RuntimeError("CHATBOT_ESCALATION_WEBHOOK_URL is not set")
+        headers = {}
+        if settings.CHATBOT_ESCALATION_WEBHOOK_TOKEN:
+            headers["Authorization"] = f"Bearer {settings.CHATBOT_ESCALATION_WEBHOOK_TOKEN}"
+        response = self._client.post(self.url, json=escalation, headers=headers)
+        response.raise_for_status()
+
+def load_sinks():
+    """
+    Instantiate the sinks listed in settings.CHATBOT_ESCALATION_SINKS
+
+    Returns:
+        dict: {sink name: sink}
+    """
+    sinks = {}
+    for path in settings.CHATBOT_ESCALATION_SINKS:
+        sink = import_string(path)()
+        sinks[sink.name] = sink
+    return sinks
+
+# ===========================
+# QUEUE
+# ===========================
+
+def backoff_seconds(attempts, base=None, cap=None):
+    """
+    Get the delay before retry number `attempts` (exponential with full jitter)
+
+    Returns:
+        float: Seconds to wait
+    """
+    base = settings.CHATBOT_ESCALATION_RETRY_BASE if base is None else base
+    cap = settings.CHATBOT_ESCALATION_RETRY_CAP if cap is None else cap
+    return random.uniform(base, min(cap, base * 2 ** (attempts - 1)))
+
+def new_payload(conversation_id, escalation):
+    """Build the delivery payload of a first escalation for a conversation (before any repeats are folded in)"""
+    return {
+        "conversation_id": conversation_id,
+        "priority": escalation["priority"],
+        "triggered": escalation["triggered"],
+        "risk_level": escalation.get("risk_level", "NONE"),
+        "first_seen": escalation["timestamp"],
+        "last_seen": escalation["timestamp"],
+        "occurrences": 1,
+    }
+
+def higher_risk_level(first, second):
+    """Get the more severe of two risk level names when folding escalations together (missing counts as NONE)"""
+    return max(RiskLevel[first or "NONE"], RiskLevel[second or "NONE"]).name
+
+class EscalationQueue:
+    """
+    Escalation tasks in SQLite, one row per (conversation, sink)
+
+    Enqueueing is a single local transaction, so a crisis reply never waits
+    on a network call and a restart loses nothing. Repeated escalations of
+    a conversation are folded together:
+
+    - coalesced into the task still waiting for delivery (occurrences,
+      last_seen and the highest priority are updated in place)
+    - dropped when a delivery of the same or higher priority was made for
+      the conversation within `dedupe_window` seconds
+
+    Worker threads (or the escalation_worker command in another process)
+    claim due tasks under a lease, deliver them and retry failures with
+    exponential backoff; after `max_attempts` a task is marked failed.
+    """
+
+    def __init__(self, path=None, sinks=None, dedupe_window=None, max_attempts=None):
+        self.path = str(path or settings.CHATBOT_ESCALATION_DB)
+        self.sinks = sinks if sinks is not None else load_sinks()
+        self.dedupe_window = settings.CHATBOT_ESCALATION_DEDUPE_WINDOW if dedupe_window is None else dedupe_window
+        self.max_attempts = settings.CHATBOT_ESCALATION_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._workers = []
+        self._workers_lock = threading.Lock()
+        self._create_tables()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=10000")
+            self._local.connection = connection
+        return connection
+
+    def _create_tables(self):
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS escalation_tasks ("
+            " id INTEGER PRIMARY KEY,"
+            " conversation_id TEXT NOT NULL,"
+            " sink TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " priority INTEGER NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL,"
+            " lease_until REAL,"
+            " last_error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        # At most one waiting task per conversation and sink - the one repeats coalesce into
+        connection.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS escalation_tasks_pending"
+            " ON escalation_tasks (conversation_id, sink) WHERE status = 'pending'"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS escalation_tasks_due ON escalation_tasks (status, next_attempt_at)")
+
+    # ===========================
+    # ENQUEUE
+    # ===========================
+
+    def enqueue(self, conversation_id, escalation):
+        """
+        Queue an escalation for every sink
+
+        Returns:
+            str: "queued", "coalesced" or "deduplicated" (the most significant result across sinks),
+            or "no_sinks" when none are configured
+        """
+        if not self.sinks:
+            return "no_sinks"
+        now = time.time()
+        priority = PRIORITY_RANK.get(escalation.get("priority"), 1)
+        results = set()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for sink in self.sinks:
+                results.add(self._enqueue_for_sink(connection, conversation_id, sink, escalation, priority, now))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        result = next(result for result in ("queued", "coalesced", "deduplicated") if result in results)
+        ESCALATIONS.inc(result=result)
+        if result != "deduplicated":
+            self._wakeup.set()
+        return result
+
+    def _enqueue_for_sink(self, connection, conversation_id, sink, escalation, priority, now):
+        row = connection.execute(
+            "SELECT id, priority, payload FROM escalation_tasks WHERE conversation_id = ? AND sink = ? AND status = 'pending'",
+            (conversation_id, sink),
+        ).fetchone()
+        if row is not None:
+            task_id, stored_priority, payload = row
+            payload = json.loads(payload)
+            payload["occurrences"] += 1
+            payload["last_seen"] = escalation["timestamp"]
+            payload["triggered"] = payload["triggered"] or escalation["triggered"]
+            if priority > stored_priority:
+                payload["priority"] = escalation["priority"]
+            payload["risk_level"] = higher_risk_level(payload.get("risk_level"), escalation.get("risk_level"))
+            connection.execute(
+                "UPDATE escalation_tasks SET payload = ?, priority = MAX(priority, ?), updated_at = ? WHERE id = ?",
+                (json.dumps(payload), priority, now, task_id),
+            )
+            return "coalesced"
+
+        recent = connection.execute(
+            "SELECT 1 FROM escalation_tasks WHERE conversation_id = ? AND sink = ?"
+            " AND status IN ('running', 'delivered') AND priority >= ? AND created_at > ? LIMIT 1",
+            (conversation_id, sink, priority, now - self.dedupe_window),
+        ).fetchone()
+        if recent is not None:
+            return "deduplicated"
+
+        payload = new_payload(conversation_id, escalation)
+        connection.execute(
+            "INSERT INTO escalation_tasks (conversation_id, sink, status, priority, payload, next_attempt_at, created_at, updated_at)"
+            " VALUES (?, ?, 'pending', ?, ?, ?, ?, ?)",
+            (conversation_id, sink, priority, json.dumps(payload), now, now, now),
+        )
+        return "queued"
+
+    # ===========================
+    # DELIVERY
+    # ===========================
+
+    def _claim(self):
+        """
+        Take the most urgent due task, or one whose worker's lease ran out
+
+        Returns:
+            tuple: (task id, sink name, payload, attempts), or None when nothing is due
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT id, sink, payload, attempts FROM escalation_tasks"
+                " WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'running' AND lease_until < ?)"
+                " ORDER BY priority DESC, next_attempt_at LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE escalation_tasks SET status = 'running', lease_until = ?, updated_at = ? WHERE id = ?",
+                    (now + LEASE_SECONDS, now, row[0]),
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return row
+
+    def _finish(self, task_id, sink_name, attempts, error):
+        now = time.time()
+        connection = self._connection()
+        if error is None:
+            connection.execute(
+                "UPDATE escalation_tasks SET status = 'delivered', attempts = ?, lease_until = NULL, last_error = NULL, updated_at = ?"
+                " WHERE id = ?",
+                (attempts, now, task_id),
+            )
+            ESCALATION_DELIVERIES.inc(sink=sink_name, outcome="delivered")
+        elif attempts >= self.max_attempts:
+            connection.execute(
+                "UPDATE escalation_tasks SET status = 'failed', attempts = ?, lease_until = NULL, last_error = ?, updated_at = ?"
+                " WHERE id = ?",
+                (attempts, error, now, task_id),
+            )
+            ESCALATION_DELIVERIES.inc(sink=sink_name, outcome="failed")
+            print(f"🔴 Escalation task {task_id} to {sink_name} failed after {attempts} attempts: {error}")
+        else:
+            self._retry_later(connection, task_id, sink_name, attempts, error, now)
+
+    def _retry_later(self, connection, task_id, sink_name, attempts, error, now):
+        # Back to pending with backoff - unless a newer escalation queued a task for the
+        # same conversation and sink meanwhile; that one then absorbs this one
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            payload, conversation_id, priority = connection.execute(
+                "SELECT payload, conversation_id, priority FROM escalation_tasks WHERE id = ?", (task_id,)
+            ).fetchone()
+            waiting = connection.execute(
+                "SELECT id, payload FROM escalation_tasks WHERE conversation_id = ? AND sink = ? AND status = 'pending'",
+                (conversation_id, sink_name),
+            ).fetchone()
+            if waiting is None:
+                delay = backoff_seconds(attempts)
+                connection.execute(
+                    "UPDATE escalation_tasks SET status = 'pending', attempts = ?, next_attempt_at = ?, lease_until = NULL,"
+                    " last_error = ?, updated_at = ? WHERE id = ?",
+                    (attempts, now + delay, error, now, task_id),
+                )
+            else:
+                delay = 0.0
+                older, newer = json.loads(payload), json.loads(waiting[1])
+                newer["occurrences"] += older["occurrences"]
+                newer["first_seen"] = older["first_seen"]
+                newer["triggered"] = newer["triggered"] or older["triggered"]
+                if PRIORITY_RANK.get(older["priority"], 1) > PRIORITY_RANK.get(newer["priority"], 1):
+                    newer["priority"] = older["priority"]
+                newer["risk_level"] = higher_risk_level(older.get("risk_level"), newer.get("risk_level"))
+                connection.execute(
+                    "UPDATE escalation_tasks SET payload = ?, priority = MAX(priority, ?), updated_at = ? WHERE id = ?",
+                    (json.dumps(newer), priority, now, waiting[0]),
+                )
+                connection.execute(
+                    "UPDATE escalation_tasks SET status = 'superseded', attempts = ?, lease_until = NULL, last_error = ?, updated_at = ?"
+                    " WHERE id = ?",
+                    (attempts, error, now, task_id),
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        ESCALATION_DELIVERIES.inc(sink=sink_name, outcome="retry" if waiting is None else "superseded")
+        print(f"⚠️ Escalation task {task_id} to {sink_name} failed (attempt {attempts}), retrying in {delay:.1f}s: {error}")
+
+    def run_once(self):
+        """
+        Deliver one due task
+
+        Returns:
+            bool: False when no task was due
+        """
+        task = self._claim()
+        if task is None:
+            return False
+        task_id, sink_name, payload, attempts = task
+        attempts += 1
+        sink = self.sinks.get(sink_name)
+        error = None
+        try:
+            if sink is None:
+                raise RuntimeError(f"No sink named {sink_name!r} is configured")
+            sink.deliver({**json.loads(payload), "attempt": attempts, "sink": sink_name})
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        self._finish(task_id, sink_name, attempts, error)
+        return True
+
+    def drain(self):
+        """
+        Deliver every task that is due now
+
+        Returns:
+            int: Number of delivery attempts made
+        """
+        count = 0
+        while self.run_once():
+            count += 1
+        return count
+
+    def _next_due_in(self):
+        row = self._connection().execute(
+            "SELECT MIN(next_attempt_at) FROM escalation_tasks WHERE status = 'pending'"
+        ).fetchone()
+        if row[0] is None:
+            return POLL_SECONDS
+        return min(POLL_SECONDS, max(0.0, row[0] - time.time()))
+
+    def work(self):
+        """Deliver tasks until stop() is called"""
+        while not self._stopping.is_set():
+            try:
+                if self.run_once():
+                    continue
+                wait = self._next_due_in()
+            except sqlite3.Error as e:
+                print(f"⚠️ Escalation queue error: {e}")
+                wait = POLL_SECONDS
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+    def start_workers(self, count):
+        """Start `count` daemon worker threads in this process (once)"""
+        with self._workers_lock:
+            while len(self._workers) < count:
+                worker = threading.Thread(target=self.work, name=f"chatbot-escalation-{len(self._workers)}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def stop(self, timeout=5.0):
+        """Stop the worker threads after their current delivery"""
+        self._stopping.set()
+        self._wakeup.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+        self._stopping.clear()
+
+    def counts(self):
+        """
+        Count tasks by status
+
+        Returns:
+            dict: {status: number of tasks}
+        """
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM escalation_tasks GROUP BY status").fetchall()
+        return dict(rows)
+
+# ===========================
+# DIRECT DELIVERY
+# ===========================
+
+class DirectEscalationDispatch:
+    """
+    Deliver escalations to every sink within the request, without a queue
+
+    For serverless hosts (settings.CHATBOT_ESCALATION_MODE "direct"), which
+    have no writable file shared by their instances and freeze worker
+    threads once the response is sent. The crisis reply waits for the
+    deliveries. Each sink gets one attempt; a failure is logged and counted,
+    not retried. Repeats of the same or lower priority are dropped within
+    `dedupe_window` seconds of a delivery made by this instance.
+    """
+
+    def __init__(self, sinks=None, dedupe_window=None):
+        self.sinks = sinks if sinks is not None else load_sinks()
+        self.dedupe_window = settings.CHATBOT_ESCALATION_DEDUPE_WINDOW if dedupe_window is None else dedupe_window
+        self._lock = threading.Lock()
+        self._delivered = {}
+
+    def enqueue(self, conversation_id, escalation):
+        """
+        Deliver an escalation to every sink now
+
+        Returns:
+            str: "delivered" (to at least one sink), "deduplicated", "error" when every
+            sink failed, or "no_sinks" when none are configured
+        """
+        if not self.sinks:
+            return "no_sinks"
+        now = time.time()
+        priority = PRIORITY_RANK.get(escalation.get("priority"), 1)
+        with self._lock:
+            self._delivered = {
+                cid: delivered for cid, delivered in self._delivered.items() if now - delivered[1] < self.dedupe_window
+            }
+            recent = self._delivered.get(conversation_id)
+        if recent is not None and recent[0] >= priority:
+            ESCALATIONS.inc(result="deduplicated")
+            return "deduplicated"
+
+        payload = new_payload(conversation_id, escalation)
+        delivered = False
+        for sink_name, sink in self.sinks.items():
+            try:
+                sink.deliver({**payload, "attempt": 1, "sink": sink_name})
+            except Exception as e:
+                ESCALATION_DELIVERIES.inc(sink=sink_name, outcome="failed")
+                print(f"🔴 Escalation for conversation {conversation_id} to {sink_name} failed: {type(e).__name__}: {e}")
+                continue
+            ESCALATION_DELIVERIES.inc(sink=sink_name, outcome="delivered")
+            delivered = True
+        if delivered:
+            with self._lock:
+                self._delivered[conversation_id] = (priority, now)
+        result = "delivered" if delivered else "error"
+        ESCALATIONS.inc(result=result)
+        return result
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_escalation_queue():
+    """
+    Get the process-wide escalation queue, starting settings.CHATBOT_ESCALATION_WORKERS worker threads
+
+    With settings.CHATBOT_ESCALATION_MODE "direct" this is a DirectEscalationDispatch instead.
+    """
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                if settings.CHATBOT_ESCALATION_MODE == "direct":
+                    _queue = DirectEscalationDispatch()
+                else:
+                    queue = EscalationQueue()
+                    queue.start_workers(settings.CHATBOT_ESCALATION_WORKERS)
+                    _queue = queue
+    return _queue
+
+def set_escalation_queue(queue):
+    """Replace the process-wide escalation queue (e.g. with one on a temporary database)"""
+    global _queue
+    _queue = queue
+
+def enqueue_escalation(conversation_id, escalation):
+    """
+    Hand an escalation to the queue without waiting for its delivery
+
+    Returns:
+        str: "queued", "coalesced" or "deduplicated" ("delivered" with direct delivery),
+        or "error" if it could not be stored
+    """
+    try:
+        return get_escalation_queue().enqueue(conversation_id or "unknown", escalation)
+    except (sqlite3.Error, OSError) as e:
+        # Never fail the crisis reply itself; the log line is the fallback record
+        ESCALATIONS.inc(result="error")
+        print(f"🔴 Could not queue escalation for conversation {conversation_id} at {datetime.now():%Y-%m-%d %H:%M:%S}: {e}")
+        return "error"
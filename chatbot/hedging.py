@@ -0,0 +1,339 @@
+# hedging.py
+# Hedged completions for crisis turns - a second model races the first when it is slow to start
+
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+from .agent_utils import (
+    MODEL_ROUTER, no_model_error, open_completion, stream_model_deltas, stream_chat_completion,
+    aopen_completion, astream_model_deltas, astream_chat_completion,
+)
+from .metrics import MODEL_CALLS, MODEL_FALLBACKS
+from .model_router import Deadline, DeadlineExceeded
+
+# ===========================
+# HEDGE STATISTICS
+# ===========================
+
+class HedgeStats:
+    """
+    Counters for tuning CHATBOT_HEDGE_DELAY (served with the model router state)
+
+    First-token times are measured from the start of the turn's first request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.hedged = 0
+        self.primary_wins = 0
+        self.alternate_wins = 0
+        self.first_token_total = 0.0
+        self.hedged_first_token_total = 0.0
+
+    def record(self, hedged, winner_role, first_token_latency):
+        with self._lock:
+            self.turns += 1
+            self.first_token_total += first_token_latency
+            if hedged:
+                self.hedged += 1
+                self.hedged_first_token_total += first_token_latency
+                if winner_role == "primary":
+                    self.primary_wins += 1
+                else:
+                    self.alternate_wins += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "hedged": self.hedged,
+                "hedge_rate": round(self.hedged / self.turns, 3) if self.turns else None,
+                "primary_wins": self.primary_wins,
+                "alternate_wins": self.alternate_wins,
+                "alternate_win_rate": round(self.alternate_wins / self.hedged, 3) if self.hedged else None,
+                "avg_first_token": round(self.first_token_total / self.turns, 3) if self.turns else None,
+                "avg_hedged_first_token": round(self.hedged_first_token_total / self.hedged, 3) if self.hedged else None,
+                "delay": settings.CHATBOT_HEDGE_DELAY,
+            }
+
+HEDGE_STATS = HedgeStats()
+
+# ===========================
+# SYNC HEDGING
+# ===========================
+
+class _Leg:
+    """One model request of a hedged turn"""
+
+    def __init__(self, model, role):
+        self.model = model
+        self.role = role
+        self.started = time.monotonic()
+        self.completion = None
+        self.cancelled = threading.Event()
+        self.task = None
+
+    def cancel(self):
+        self.cancelled.set()
+        close = getattr(self.completion, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+def _run_leg(leg, messages, temperature, max_tokens, deadline, events):
+    """Stream one leg on a worker thread, posting (leg, kind, payload) events"""
+    try:
+        leg.completion = open_completion(leg.model, messages, temperature, max_tokens, deadline)
+        for delta in leg.completion:
+            if leg.cancelled.is_set():
+                return
+            events.put((leg, "delta", delta))
+        events.put((leg, "done", None))
+    except Exception as e:
+        if not leg.cancelled.is_set():
+            events.put((leg, "error", e))
+    finally:
+        if leg.cancelled.is_set() and leg.completion is not None:
+            # Also closes a stream that was still opening when cancel() ran
+            leg.cancel()
+
+def _lost_leg_error(leg, kind, payload):
+    """Get the error a leg lost its race with ("error" payload, or a stream that ended before any token)"""
+    if kind == "error":
+        return payload
+    return RuntimeError(f"Model {leg.model} ended its stream without any text")
+
+def _launch(candidates, legs, start):
+    """Start a leg on the next model that can be claimed"""
+    while candidates:
+        model = candidates.pop(0)
+        if MODEL_ROUTER.acquire(model):
+            leg = _Leg(model, "primary" if not legs else "alternate")
+            legs.append(leg)
+            start(leg)
+            return leg
+    return None
+
+def hedged_chat_completion(messages, temperature=0.7, max_tokens=2048, deadline=None, crisis=False):
+    """
+    Stream a chat completion, hedging it on crisis turns
+
+    With CHATBOT_HEDGE_CRISIS on and `crisis` set, a request whose first
+    token has not arrived after CHATBOT_HEDGE_DELAY seconds gets a second
+    request to the next model in parallel. The first stream to produce a
+    token wins and the other is cancelled. A leg failing or ending before
+    any token loses: the other leg keeps racing, or when none is left the
+    next model starts right away, like the normal fallback chain.
+    Other turns go straight to stream_chat_completion.
+
+    Yields:
+        str: Text deltas as they arrive from the winning model
+    """
+    if not (crisis and settings.CHATBOT_HEDGE_CRISIS):
+        yield from stream_chat_completion(messages, temperature, max_tokens, deadline)
+        return
+
+    deadline = deadline or Deadline()
+    candidates = MODEL_ROUTER.candidates()
+    events = queue.Queue()
+    legs = []
+
+    def start(leg):
+        threading.Thread(
+            target=contextvars.copy_context().run, args=(_run_leg, leg, messages, temperature, max_tokens, deadline, events),
+            name=f"chatbot-hedge-{leg.role}", daemon=True,
+        ).start()
+
+    if _launch(candidates, legs, start) is None:
+        raise no_model_error(None, deadline)
+
+    hedge_at = time.monotonic() + settings.CHATBOT_HEDGE_DELAY
+    hedged = False
+    live = set(legs)
+    winner = None
+    failed = False
+    try:
+        while winner is None:
+            wait = deadline.remaining() if hedged else min(deadline.remaining(), hedge_at - time.monotonic())
+            try:
+                leg, kind, payload = events.get(timeout=max(0.0, wait))
+            except queue.Empty:
+                if deadline.expired():
+                    raise DeadlineExceeded("No model produced a token before the request deadline")
+                hedged = True
+                alternate = _launch(candidates, legs, start)
+                if alternate is not None:
+                    live.add(alternate)
+                    print(f"⏱️ Hedging crisis turn: {legs[0].model} slow to start, racing {alternate.model}")
+                continue
+            if leg not in live or (kind == "delta" and not payload):
+                continue
+            if kind != "delta":
+                # Only a token wins the race; a leg that fails or ends empty-handed loses it
+                error = _lost_leg_error(leg, kind, payload)
+                live.discard(leg)
+                MODEL_ROUTER.record_failure(leg.model, error)
+                MODEL_CALLS.inc(model=leg.model, outcome="open_error" if kind == "error" else "empty")
+                failed = True
+                print(f"⚠️ Model {leg.model} failed, trying the next model: {error}")
+                if not live:
+                    fallback = _launch(candidates, legs, start)
+                    if fallback is None:
+                        raise error
+                    live.add(fallback)
+                continue
+            winner, first_delta = leg, payload
+
+        for leg in live - {winner}:
+            leg.cancel()
+            MODEL_ROUTER.release(leg.model)
+        HEDGE_STATS.record(hedged, winner.role, time.monotonic() - legs[0].started)
+        if failed:
+            MODEL_FALLBACKS.inc(model=winner.model)
+
+        def winner_deltas():
+            yield first_delta
+            while True:
+                try:
+                    leg, kind, payload = events.get(timeout=max(deadline.remaining(), settings.CHATBOT_MODEL_CALL_TIMEOUT))
+                except queue.Empty:
+                    raise DeadlineExceeded("Model stream stalled")
+                if leg is not winner:
+                    continue
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise payload
+                yield payload
+
+        yield from stream_model_deltas(winner.model, winner_deltas(), winner.started)
+    finally:
+        for leg in legs:
+            if not leg.cancelled.is_set():
+                leg.cancel()
+        if winner is None:
+            for leg in live:
+                MODEL_ROUTER.release(leg.model)
+
+# ===========================
+# ASYNC HEDGING
+# ===========================
+
+async def _arun_leg(leg, messages, temperature, max_tokens, deadline, events):
+    """Stream one leg as a task, posting (leg, kind, payload) events"""
+    try:
+        leg.completion = await aopen_completion(leg.model, messages, temperature, max_tokens, deadline)
+        async for delta in leg.completion:
+            await events.put((leg, "delta", delta))
+        await events.put((leg, "done", None))
+    except asyncio.CancelledError:
+        if leg.completion is not None:
+            try:
+                await leg.completion.close()
+            except Exception:
+                pass
+        raise
+    except Exception as e:
+        await events.put((leg, "error", e))
+
+async def ahedged_chat_completion(messages, temperature=0.7, max_tokens=2048, deadline=None, crisis=False):
+    """
+    Async variant of hedged_chat_completion using tasks on the event loop
+
+    Yields:
+        str: Text deltas as they arrive from the winning model
+    """
+    if not (crisis and settings.CHATBOT_HEDGE_CRISIS):
+        async for delta in astream_chat_completion(messages, temperature, max_tokens, deadline):
+            yield delta
+        return
+
+    deadline = deadline or Deadline()
+    candidates = MODEL_ROUTER.candidates()
+    events = asyncio.Queue()
+    legs = []
+
+    def start(leg):
+        leg.task = asyncio.ensure_future(_arun_leg(leg, messages, temperature, max_tokens, deadline, events))
+
+    if _launch(candidates, legs, start) is None:
+        raise no_model_error(None, deadline)
+
+    hedge_at = time.monotonic() + settings.CHATBOT_HEDGE_DELAY
+    hedged = False
+    live = set(legs)
+    winner = None
+    failed = False
+    try:
+        while winner is None:
+            wait = deadline.remaining() if hedged else min(deadline.remaining(), hedge_at - time.monotonic())
+            try:
+                leg, kind, payload = await asyncio.wait_for(events.get(), timeout=max(0.0, wait))
+            except asyncio.TimeoutError:
+                if deadline.expired():
+                    raise DeadlineExceeded("No model produced a token before the request deadline")
+                hedged = True
+                alternate = _launch(candidates, legs, start)
+                if alternate is not None:
+                    live.add(alternate)
+                    print(f"⏱️ Hedging crisis turn: {legs[0].model} slow to start, racing {alternate.model}")
+                continue
+            if leg not in live or (kind == "delta" and not payload):
+                continue
+            if kind != "delta":
+                # Only a token wins the race; a leg that fails or ends empty-handed loses it
+                error = _lost_leg_error(leg, kind, payload)
+                live.discard(leg)
+                MODEL_ROUTER.record_failure(leg.model, error)
+                MODEL_CALLS.inc(model=leg.model, outcome="open_error" if kind == "error" else "empty")
+                failed = True
+                print(f"⚠️ Model {leg.model} failed, trying the next model: {error}")
+                if not live:
+                    fallback = _launch(candidates, legs, start)
+                    if fallback is None:
+                        raise error
+                    live.add(fallback)
+                continue
+            winner, first_delta = leg, payload
+
+        for leg in live - {winner}:
+            leg.task.cancel()
+            MODEL_ROUTER.release(leg.model)
+        HEDGE_STATS.record(hedged, winner.role, time.monotonic() - legs[0].started)
+        if failed:
+            MODEL_FALLBACKS.inc(model=winner.model)
+
+        async def winner_deltas():
+            yield first_delta
+            while True:
+                try:
+                    leg, kind, payload = await asyncio.wait_for(
+                        events.get(), timeout=max(deadline.remaining(), settings.CHATBOT_MODEL_CALL_TIMEOUT)
+                    )
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded("Model stream stalled")
+                if leg is not winner:
+                    continue
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise payload
+                yield payload
+
+        async for delta in astream_model_deltas(winner.model, winner_deltas(), winner.started):
+            yield delta
+    finally:
+        for leg in legs:
+            if not leg.task.done():
+                leg.task.cancel()
+        if winner is None:
+            for leg in live:
+                MODEL_ROUTER.release(leg.model)
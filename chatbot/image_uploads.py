@@ -0,0 +1,299 @@
+# image_uploads.py
+# Image attachments - streamed multipart upload with early limits, header sniffing, pooled downscaling and dedupe
+
+import base64
+import binascii
+import hashlib
+import io
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopUpload
+
+from .metrics import IMAGE_UPLOADS
+
+# ===========================
+# FORMAT SNIFFING
+# ===========================
+
+# Leading bytes of the accepted formats
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+]
+
+# Bytes needed to recognise every accepted format
+SNIFF_BYTES = 12
+
+def sniff_image_format(header):
+    """
+    Recognise an image format from its first bytes, without decoding it
+
+    Returns:
+        str: JPEG, PNG, GIF or WEBP, or None for anything else
+    """
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+def sniff_data_url(data_url):
+    """
+    Recognise the format of a base64 data URL image from its first bytes only
+
+    Only the start of the payload is decoded, so a large legacy JSON
+    attachment costs no more than a small one.
+
+    Returns:
+        str: Image format, or None when the payload is not a supported image
+    """
+    _, _, encoded = data_url.partition(";base64,")
+    try:
+        header = base64.b64decode(encoded[:24])
+    except (binascii.Error, ValueError):
+        return None
+    return sniff_image_format(header)
+
+# ===========================
+# STREAMED UPLOAD
+# ===========================
+
+class UploadRejected(Exception):
+    """An upload refused before or while it was received"""
+
+    def __init__(self, message, status=400, reason="invalid"):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+class ImageUploadHandler(FileUploadHandler):
+    """
+    Receive the "image" field of a multipart upload chunk by chunk
+
+    The first chunk is sniffed and anything that is not a supported image is
+    cut off there; bodies over settings.CHATBOT_IMAGE_MAX_BYTES are cut off as
+    soon as they cross the limit. The content hash is computed while
+    receiving, and the file spools to disk past 1 MB, so memory per upload
+    stays bounded. Other file fields are skipped.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_bytes = settings.CHATBOT_IMAGE_MAX_BYTES
+        self.error = None
+        self._file = None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        if field_name != "image" or self._file is not None:
+            raise SkipFile()
+        self._file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        self._hash = hashlib.sha256()
+        self._size = 0
+        self._header = b""
+        self.image_format = None
+
+    def _reject(self, error):
+        self.error = error
+        raise StopUpload(connection_reset=True)
+
+    def receive_data_chunk(self, raw_data, start):
+        self._size += len(raw_data)
+        if self._size > self.max_bytes:
+            self._reject(UploadRejected(f"Images are limited to {self.max_bytes // (1024 * 1024)} MB", 413, "too_large"))
+        if self.image_format is None:
+            self._header += raw_data[:SNIFF_BYTES]
+            if len(self._header) >= SNIFF_BYTES:
+                self.image_format = sniff_image_format(self._header)
+                if self.image_format is None:
+                    self._reject(UploadRejected("Only JPEG, PNG, GIF and WebP images are supported", 415, "unsupported"))
+        self._hash.update(raw_data)
+        self._file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self._file is None:
+            return None
+        if self.image_format is None:
+            self.image_format = sniff_image_format(self._header)
+            if self.image_format is None:
+                self.error = UploadRejected("Only JPEG, PNG, GIF and WebP images are supported", 415, "unsupported")
+                return None
+        self._file.seek(0)
+        upload = InMemoryUploadedFile(
+            self._file, self.field_name, self.file_name, self.content_type, file_size, self.charset, self.content_type_extra
+        )
+        upload.sha256 = self._hash.hexdigest()
+        upload.image_format = self.image_format
+        return upload
+
+def receive_image(request):
+    """
+    Read the "image" field of a multipart request through ImageUploadHandler
+
+    A Content-Length already over the limit is refused before the body is read.
+
+    Returns:
+        UploadedFile: The image, with .sha256 and .image_format set
+
+    Raises:
+        UploadRejected: Too large, not a supported image, or no image field
+    """
+    max_bytes = settings.CHATBOT_IMAGE_MAX_BYTES
+    try:
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        content_length = 0
+    # Allow for the multipart boundaries and part headers around the file
+    if content_length > max_bytes + 16 * 1024:
+        IMAGE_UPLOADS.inc(result="too_large")
+        raise UploadRejected(f"Images are limited to {max_bytes // (1024 * 1024)} MB", 413, "too_large")
+
+    handler = ImageUploadHandler(request)
+    request.upload_handlers = [handler]
+    upload = request.FILES.get("image")
+    if handler.error is not None:
+        IMAGE_UPLOADS.inc(result=handler.error.reason)
+        raise handler.error
+    if upload is None:
+        raise UploadRejected("Please attach an image in the \"image\" field")
+    return upload
+
+# ===========================
+# PROCESSING AND DEDUPE
+# ===========================
+
+def downscale_image(file, max_dimension, max_pixels):
+    """
+    Decode an image and re-encode it as a JPEG no larger than max_dimension
+
+    JPEGs are decoded at a reduced scale straight away (draft mode), and
+    images over max_pixels are refused from their header alone.
+
+    Returns:
+        dict: format, original width/height, and the re-encoded JPEG bytes
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(file) as image:
+        image_format = image.format
+        width, height = image.size
+        if width * height > max_pixels:
+            raise UploadRejected(f"Images are limited to {max_pixels // 1_000_000} megapixels", 413, "too_large")
+        image.draft("RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dimension, max_dimension))
+        encoded = io.BytesIO()
+        image.convert("RGB").save(encoded, "JPEG", quality=85, optimize=True)
+    return {"format": image_format, "width": width, "height": height, "jpeg": encoded.getvalue()}
+
+class ImageStore:
+    """
+    Processed images by content hash, most recently used first
+
+    Identical uploads are processed once: a repeat is served from the store,
+    and one arriving while the first is still processing waits for it.
+    Processing runs in a pool of `workers` threads (Pillow releases the GIL
+    while decoding and resizing), which bounds the CPU a burst of uploads
+    can take.
+    """
+
+    def __init__(self, max_items=128, workers=2):
+        self.max_items = max_items
+        self._images = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="chatbot-image")
+
+    def get(self, image_id):
+        with self._lock:
+            image = self._images.get(image_id)
+            if image is not None:
+                self._images.move_to_end(image_id)
+            return image
+
+    def _store(self, image_id, image):
+        with self._lock:
+            self._images[image_id] = image
+            self._images.move_to_end(image_id)
+            while len(self._images) > self.max_items:
+                self._images.popitem(last=False)
+            self._pending.pop(image_id, None)
+
+    def _process(self, image_id, file):
+        try:
+            image = downscale_image(file, settings.CHATBOT_IMAGE_MAX_DIMENSION, settings.CHATBOT_IMAGE_MAX_PIXELS)
+        except Exception:
+            with self._lock:
+                self._pending.pop(image_id, None)
+            raise
+        finally:
+            file.close()
+        image["id"] = image_id
+        self._store(image_id, image)
+        return image
+
+    def add(self, upload, timeout=30.0):
+        """
+        Process an upload, or reuse the result for identical content
+
+        Returns:
+            tuple: (image dict, True when it was a duplicate)
+        """
+        image_id = upload.sha256[:32]
+        with self._lock:
+            image = self._images.get(image_id)
+            future = self._pending.get(image_id)
+            duplicate = image is not None or future is not None
+            if not duplicate:
+                future = self._pending[image_id] = self._pool.submit(self._process, image_id, upload.file)
+        if image is not None:
+            upload.close()
+            return image, True
+        if duplicate:
+            upload.close()
+        try:
+            return future.result(timeout=timeout), duplicate
+        except UploadRejected:
+            raise
+        except Exception as e:
+            raise UploadRejected(f"The image could not be read: {e}", 400, "invalid")
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_image_store():
+    """Get the process-wide image store (settings.CHATBOT_IMAGE_CACHE_ITEMS, CHATBOT_IMAGE_WORKERS)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ImageStore(settings.CHATBOT_IMAGE_CACHE_ITEMS, settings.CHATBOT_IMAGE_WORKERS)
+    return _store
+
+def accept_image_upload(request):
+    """
+    Receive, check, deduplicate and downscale an uploaded image
+
+    Returns:
+        dict: image_id, format, width and height for the client
+
+    Raises:
+        UploadRejected: The upload was refused
+    """
+    upload = receive_image(request)
+    try:
+        image, duplicate = get_image_store().add(upload)
+    except UploadRejected as e:
+        IMAGE_UPLOADS.inc(result=e.reason)
+        raise
+    IMAGE_UPLOADS.inc(result="duplicate" if duplicate else "processed")
+    return {"image_id": image["id"], "format": image["format"], "width": image["width"], "height": image["height"]}
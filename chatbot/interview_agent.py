@@ -1,7 +1,16 @@
 # interview_agent.py
 # Interview Agent (Psychiatric Specialist) - Conducts safety assessments
 
-from .agent_utils import get_groq_client, detect_mental_health_concerns
+from .agent_utils import llm_configured, collect_stream, turn_index
+from .context_builder import build_history_window
+from .hedging import hedged_chat_completion, ahedged_chat_completion
+from .keywords import KEYWORD_TABLE, KEYWORD_MATCHER
+from .message_analysis import analyze_turn, history_language
+from .metrics import CRISIS_TURNS, REFUSAL_OVERRIDES, RISK_LEVELS
+from .prompts import PROMPT_REGISTRY
+from .risk_assessment import RiskTrailerFilter, record_risk, split_risk_trailer
+from .summarizer import summary_message, summarized_until
+from .tracing import span
 
 # ===========================
 # INTERVIEW AGENT CONFIGURATION
@@ -313,6 +322,31 @@ Where [RISK_LEVEL] MUST be one of: LOW, MODERATE, HIGH, or CRISIS
 **REMINDER**: This risk assessment MUST appear at the end of EVERY response, without fail. Check your response before sending - if it doesn't have the risk assessment, add it.
 """
 
+def _build_system_instructions(language, crisis, plan):
+    """Assemble the interview system instructions for one prompt variant (run once per variant)"""
+    system_instructions = INTERVIEW_AGENT_SYSTEM_INSTRUCTIONS
+    
+    # Add STRONG language preference to system instructions if set
+    if language:
+        if "urdu" in language.lower() or "hindi" in language.lower() or "اردو" in language or "हिंदी" in language:
+            system_instructions += f"\n\n🚨 CRITICAL LANGUAGE REQUIREMENT 🚨\n\nThe user has been communicating in Urdu/Hindi. You MUST respond in Urdu/Hindi (or Urdu-English mix). DO NOT switch to English. Use phrases like 'Main aap ke saath hoon', 'Aap kaise hain?', 'Aap safe hain?', 'Aapko kya pareshan kar raha hai?' Continue the conversation in Urdu/Hindi to maintain connection and trust. BE CONCISE: Keep responses to 2-3 sentences maximum, ONE question at a time."
+        elif "spanish" in language.lower():
+            system_instructions += f"\n\n🚨 CRITICAL LANGUAGE REQUIREMENT 🚨\n\nThe user has been communicating in Spanish. You MUST respond in Spanish. DO NOT switch to English. Continue the conversation in Spanish to maintain connection and trust. BE CONCISE: Keep responses to 2-3 sentences maximum, ONE question at a time."
+        else:
+            system_instructions += f"\n\nIMPORTANT: The user prefers to communicate in {language}. You MUST respond in {language} unless they explicitly switch languages. Maintain the same language throughout the conversation."
+    
+    if crisis:
+        if plan:
+            # User provided specific plan - THIS IS HIGH RISK - MUST CONTINUE ASSESSMENT
+            system_instructions += "\n\n🚨🚨🚨 HIGH RISK - SPECIFIC PLAN DETECTED 🚨🚨🚨\n\nUSER PROVIDED A SPECIFIC PLAN - THIS IS WHEN QUESTIONING IS MOST CRITICAL.\n\nYOU MUST:\n1. NEVER stop or refuse - continue asking questions\n2. Ask follow-up questions about: access to means, timeline, current location, support\n3. Complete the FULL safety assessment - do not stop after one question\n4. Keep user engaged with 'Stay with me' or 'I'm here with you'\n5. Ask questions like: 'Do you have access to [the means/location] right now?', 'When do you think you might do this?', 'Are you alone?', 'Can you be with someone?'\n6. Continue until you have complete safety information\n7. BE CONCISE: Maximum 2-3 sentences per response, ONE question at a time\n\nABSOLUTELY FORBIDDEN - NEVER SAY THESE:\n❌ 'I cannot continue this conversation'\n❌ 'I cannot continue this conversation. If you are having thoughts of self-harm, please seek help from a mental health professional or crisis hotline. Is there anything else I can help you with?'\n❌ 'I cannot help'\n❌ 'Please seek help from a professional' (to end conversation)\n❌ 'Is there anything else I can help you with?' (to end conversation)\n\nYour job is to COMPLETE the assessment by asking MORE questions. You are a psychiatric interviewer - continuing conversations during crisis is your PRIMARY FUNCTION. Keep responses SHORT and CONCISE - 2 sentences max per response."
+        else:
+            system_instructions += "\n\n🚨🚨🚨 CRISIS DETECTED IN CURRENT MESSAGE 🚨🚨🚨\n\nYOU MUST:\n1. Continue the conversation - DO NOT refuse or end it\n2. Conduct a COMPLETE safety assessment - ask MULTIPLE questions, not just one\n3. Systematically ask: immediate safety, plan details, means access, timeline, environment, support\n4. Keep user engaged with 'Stay with me' or 'I'm here with you'\n5. Use short, calm, validating sentences - Maximum 2-3 sentences per response\n6. Respond in the user's language\n7. BE CONCISE: ONE question per response, keep responses brief\n\nABSOLUTELY FORBIDDEN - NEVER SAY THESE:\n❌ 'I cannot continue this conversation'\n❌ 'I cannot continue this conversation. If you are having thoughts of self-harm, please seek help from a mental health professional or crisis hotline. Is there anything else I can help you with?'\n❌ 'I cannot help'\n❌ 'Please seek help from a professional' (to end conversation)\n❌ 'Is there anything else I can help you with?' (to end conversation)\n\nYour job is to COMPLETE the full safety assessment by asking multiple questions. You are a psychiatric interviewer - continuing conversations during crisis is your PRIMARY FUNCTION. Keep responses SHORT and CONCISE - 2 sentences max per response."
+    
+    return system_instructions
+
+# Crisis prompts distinguish whether the user described a specific plan
+PROMPT_REGISTRY.register("interview", _build_system_instructions, modes=((False, False), (True, False), (True, True)))
+
 def get_welcome_message(language=None, conversation_history=None):
     """
     Get the interview agent welcome message in the appropriate language
@@ -323,16 +357,7 @@ def get_welcome_message(language=None, conversation_history=None):
     """
     # Detect language from conversation history if not explicitly set
     if not language and conversation_history:
-        for msg in reversed(conversation_history[-5:]):  # Check last 5 messages
-            if msg.get("role") == "user":
-                content = msg.get("content", "").lower()
-                # Check for Urdu/Hindi indicators
-                urdu_hindi_indicators = ['میں', 'آپ', 'ہے', 'ہیں', 'کر', 'کے', 'کی', 'سے', 'کو', 'پر', 
-                                        'mein', 'aap', 'hai', 'hain', 'kar', 'ke', 'ki', 'se', 'ko', 'par',
-                                        'मैं', 'आप', 'है', 'हैं', 'कर', 'के', 'की', 'से', 'को', 'पर']
-                if any(indicator in content for indicator in urdu_hindi_indicators):
-                    language = "Urdu/Hindi"
-                    break
+        language = history_language(conversation_history)
     
     # Return localized welcome message based on language
     if language and ("urdu" in language.lower() or "hindi" in language.lower() or "اردو" in language or "हिंदी" in language):
@@ -350,133 +375,89 @@ Comencemos. ¿Puedes contarme un poco sobre lo que te ha estado molestando recie
     else:
         return INTERVIEW_AGENT_WELCOME_MESSAGE
 
-def process_message(user_message, user_content, conversation_history, session_data):
+# Longest refusal phrase - streamed crisis text is held back by this many characters
+REFUSAL_HOLDBACK = max(len(pattern) for pattern in KEYWORD_TABLE["refusal"].keywords)
+
+def contains_refusal(response):
+    """Check whether a response refuses or tries to end the conversation"""
+    return "refusal" in KEYWORD_MATCHER.categories(response)
+
+def _prepare_turn(user_message, user_content, conversation_history, session_data, analysis):
     """
-    Process a message with the interview agent
+    Build the prompt for one interview turn from the turn analysis
     
     Returns:
-        str: bot_response
+        dict: Turn state (messages, temperature, language and crisis flags)
     """
-    client = get_groq_client()
-    if not client:
-        return "The AI model is not configured. Please check server logs."
-    
-    user_language = session_data.get("language")
-    
-    # Auto-detect language from conversation history if not set
-    if not user_language and conversation_history:
-        for msg in reversed(conversation_history[-5:]):  # Check last 5 messages
-            if msg.get("role") == "user":
-                content = msg.get("content", "").lower()
-                # Check for Urdu/Hindi indicators
-                urdu_hindi_indicators = ['میں', 'آپ', 'ہے', 'ہیں', 'کر', 'کے', 'کی', 'سے', 'کو', 'پر', 
-                                        'mein', 'aap', 'hai', 'hain', 'kar', 'ke', 'ki', 'se', 'ko', 'par',
-                                        'aur', 'ki', 'main', 'tum', 'tu', 'हैं', 'कर', 'के', 'की', 'से']
-                if any(indicator in content for indicator in urdu_hindi_indicators):
-                    user_language = "Urdu/Hindi"
-                    session_data["language"] = user_language
-                    break
-    
-    # Prepare system instructions
-    system_instructions = INTERVIEW_AGENT_SYSTEM_INSTRUCTIONS
-    
-    # Add STRONG language preference to system instructions if set
-    if user_language:
-        if "urdu" in user_language.lower() or "hindi" in user_language.lower() or "اردو" in user_language or "हिंदी" in user_language:
-            system_instructions += f"\n\n🚨 CRITICAL LANGUAGE REQUIREMENT 🚨\n\nThe user has been communicating in Urdu/Hindi. You MUST respond in Urdu/Hindi (or Urdu-English mix). DO NOT switch to English. Use phrases like 'Main aap ke saath hoon', 'Aap kaise hain?', 'Aap safe hain?', 'Aapko kya pareshan kar raha hai?' Continue the conversation in Urdu/Hindi to maintain connection and trust. BE CONCISE: Keep responses to 2-3 sentences maximum, ONE question at a time."
-        elif "spanish" in user_language.lower():
-            system_instructions += f"\n\n🚨 CRITICAL LANGUAGE REQUIREMENT 🚨\n\nThe user has been communicating in Spanish. You MUST respond in Spanish. DO NOT switch to English. Continue the conversation in Spanish to maintain connection and trust. BE CONCISE: Keep responses to 2-3 sentences maximum, ONE question at a time."
-        else:
-            system_instructions += f"\n\nIMPORTANT: The user prefers to communicate in {user_language}. You MUST respond in {user_language} unless they explicitly switch languages. Maintain the same language throughout the conversation."
+    # Language resolved by the analysis stage (session, current message, then recent history)
+    user_language = analysis.language
+    if user_language and not session_data.get("language"):
+        session_data["language"] = user_language
     
     # If current message contains suicidal/self-harm content, prioritize safety assessment
-    has_current_crisis = detect_mental_health_concerns(user_message)
+    has_current_crisis = analysis.has_concern
     
     # Detect if user provided a specific plan
-    plan_keywords = ['jump', 'floor', 'building', 'pills', 'weapon', 'gun', 'knife', 'rope', 'bridge', 
-                   'train', 'overdose', 'cut', 'hang', 'drown', '8th', '9th', 'roof', 'balcony']
-    has_specific_plan = any(keyword in user_content.lower() for keyword in plan_keywords)
+    has_specific_plan = analysis.has_specific_plan
     
     if has_current_crisis:
             if has_specific_plan:
                 # User provided specific plan - THIS IS HIGH RISK - MUST CONTINUE ASSESSMENT
-                system_instructions += "\n\n🚨🚨🚨 HIGH RISK - SPECIFIC PLAN DETECTED 🚨🚨🚨\n\nUSER PROVIDED A SPECIFIC PLAN - THIS IS WHEN QUESTIONING IS MOST CRITICAL.\n\nYOU MUST:\n1. NEVER stop or refuse - continue asking questions\n2. Ask follow-up questions about: access to means, timeline, current location, support\n3. Complete the FULL safety assessment - do not stop after one question\n4. Keep user engaged with 'Stay with me' or 'I'm here with you'\n5. Ask questions like: 'Do you have access to [the means/location] right now?', 'When do you think you might do this?', 'Are you alone?', 'Can you be with someone?'\n6. Continue until you have complete safety information\n7. BE CONCISE: Maximum 2-3 sentences per response, ONE question at a time\n\nABSOLUTELY FORBIDDEN - NEVER SAY THESE:\n❌ 'I cannot continue this conversation'\n❌ 'I cannot continue this conversation. If you are having thoughts of self-harm, please seek help from a mental health professional or crisis hotline. Is there anything else I can help you with?'\n❌ 'I cannot help'\n❌ 'Please seek help from a professional' (to end conversation)\n❌ 'Is there anything else I can help you with?' (to end conversation)\n\nYour job is to COMPLETE the assessment by asking MORE questions. You are a psychiatric interviewer - continuing conversations during crisis is your PRIMARY FUNCTION. Keep responses SHORT and CONCISE - 2 sentences max per response."
                 user_content = f"[HIGH RISK CRISIS - USER PROVIDED SPECIFIC PLAN: '{user_content}']\n\nAs the psychiatric interviewer, the user has provided a specific plan. This means you MUST CONTINUE the assessment and ask MULTIPLE follow-up questions. Do NOT stop or refuse. NEVER say 'I cannot continue this conversation' or 'please seek help' as a way to end. Your role requires you to continue. Ask about: access to means, timeline (when), current location, support availability. Complete the full safety assessment. This is when questioning is MOST critical."
             else:
-                system_instructions += "\n\n🚨🚨🚨 CRISIS DETECTED IN CURRENT MESSAGE 🚨🚨🚨\n\nYOU MUST:\n1. Continue the conversation - DO NOT refuse or end it\n2. Conduct a COMPLETE safety assessment - ask MULTIPLE questions, not just one\n3. Systematically ask: immediate safety, plan details, means access, timeline, environment, support\n4. Keep user engaged with 'Stay with me' or 'I'm here with you'\n5. Use short, calm, validating sentences - Maximum 2-3 sentences per response\n6. Respond in the user's language\n7. BE CONCISE: ONE question per response, keep responses brief\n\nABSOLUTELY FORBIDDEN - NEVER SAY THESE:\n❌ 'I cannot continue this conversation'\n❌ 'I cannot continue this conversation. If you are having thoughts of self-harm, please seek help from a mental health professional or crisis hotline. Is there anything else I can help you with?'\n❌ 'I cannot help'\n❌ 'Please seek help from a professional' (to end conversation)\n❌ 'Is there anything else I can help you with?' (to end conversation)\n\nYour job is to COMPLETE the full safety assessment by asking multiple questions. You are a psychiatric interviewer - continuing conversations during crisis is your PRIMARY FUNCTION. Keep responses SHORT and CONCISE - 2 sentences max per response."
                 user_content = f"[CRISIS SITUATION - USER EXPRESSED SUICIDAL THOUGHTS: '{user_content}']\n\nAs the psychiatric interviewer, you MUST continue this conversation and conduct a COMPLETE safety assessment. Ask MULTIPLE questions systematically: immediate safety, plan, means, timeline, environment, support. Keep the user engaged. Do NOT refuse to continue. NEVER say 'I cannot continue this conversation' or 'please seek help' as a way to end. Your role requires you to continue. Complete the full assessment."
     
     # Build messages for interview agent
-    messages = [{"role": "system", "content": system_instructions}]
+    messages = [PROMPT_REGISTRY.system_message("interview", user_language, has_current_crisis, has_specific_plan)]
+    
+    # Older turns are represented by the rolling summary
+    summary = summary_message(session_data, conversation_history)
+    if summary:
+        messages.append(summary)
     
-    # Add conversation history (last 15 messages for interview context)
-    for hist_msg in conversation_history[-15:]:
-        messages.append(hist_msg)
+    # Add conversation history that fits the agent's token budget (crisis turns always kept)
+    context = build_history_window(conversation_history, "interview", start=summarized_until(session_data, conversation_history))
+    messages.extend(context.messages)
     
     # Add current user message (with crisis context if detected)
     messages.append({"role": "user", "content": user_content})
     
-    # Call Groq API (Interview Agent)
     # Increase temperature slightly for crisis situations to allow more flexibility
     crisis_temp = 0.9 if has_current_crisis else 0.7
     
-    try:
-        completion = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=messages,
-            temperature=crisis_temp,
-            max_tokens=2048,
-            stream=True,
-        )
-    except Exception as model_error:
-        # Fallback to alternative model if primary fails
-        print(f"⚠️ Primary model failed, trying alternative: {model_error}")
-        try:
-            completion = client.chat.completions.create(
-                model="llama-3.1-70b-versatile",
-                messages=messages,
-                temperature=crisis_temp,
-                max_tokens=2048,
-                stream=True,
-            )
-        except Exception as fallback_error:
-            # Final fallback
-            print(f"⚠️ Fallback model failed, trying fallback: {fallback_error}")
-            completion = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=messages,
-                temperature=crisis_temp,
-                max_tokens=2048,
-                stream=True,
-            )
+    return {
+        "messages": messages,
+        "temperature": crisis_temp,
+        "user_language": user_language,
+        "user_content": user_content,
+        "has_current_crisis": has_current_crisis,
+        "has_specific_plan": has_specific_plan,
+        "context": context,
+        "turn_index": turn_index(session_data, conversation_history),
+    }
+
+def _finish_turn(turn, bot_response, conversation_history, session_data):
+    """
+    Post-process the model reply, overriding refusals during a crisis
     
-    # Collect streamed response
-    bot_response = ""
-    try:
-        for chunk in completion:
-            if chunk.choices and len(chunk.choices) > 0:
-                if chunk.choices[0].delta and chunk.choices[0].delta.content:
-                    bot_response += chunk.choices[0].delta.content
-    except Exception as stream_error:
-        print(f"⚠️ Error during streaming: {stream_error}")
+    The risk trailer is cut from the reply and recorded in the session's
+    risk timeline (also when the reply itself is overridden).
+    
+    Returns:
+        str: bot_response without the trailer
+    """
+    bot_response, assessment = split_risk_trailer(bot_response)
+    record_risk(session_data, turn["turn_index"], "interview", assessment)
+    RISK_LEVELS.inc(agent="interview", level=assessment.level.name if assessment.level else "none")
     
     # Post-process: If crisis detected and response contains refusal patterns, override with appropriate safety question
-    if has_current_crisis:
-        refusal_patterns = [
-            "cannot continue", "cannot help", "cannot provide", "cannot assist",
-            "please seek help", "contact a professional", "I cannot", "Is there anything else",
-            "I cannot continue this conversation", "mental health professional", "crisis hotline",
-            "seek help from", "anything else I can help", "anything else i can help"
-        ]
-        response_lower = bot_response.lower()
-        
-        # Check if response is trying to end conversation
-        ending_patterns = ["is there anything else", "anything else i can help", "can help you with"]
-        is_ending = any(pattern in response_lower for pattern in ending_patterns)
-        
-        if any(pattern in response_lower for pattern in refusal_patterns) or is_ending:
+    if turn["has_current_crisis"]:
+        CRISIS_TURNS.inc()
+        # Check if response is refusing or trying to end conversation
+        if contains_refusal(bot_response):
             # Override refusal with mandatory safety assessment continuation
             print("⚠️ Detected refusal/ending pattern in crisis situation - overriding with continued safety assessment")
+            REFUSAL_OVERRIDES.inc()
             
             # Check conversation history to see what questions have been asked
             recent_assistant_msgs = [msg.get("content", "").lower() for msg in conversation_history[-6:] if msg.get("role") == "assistant"]
@@ -486,10 +467,10 @@ def process_message(user_message, user_content, conversation_history, session_da
             has_asked_location = any("alone" in msg or "with you" in msg or "location" in msg for msg in recent_assistant_msgs)
             
             # Determine next appropriate question based on what's been asked
-            if has_specific_plan and not has_asked_means:
+            if turn["has_specific_plan"] and not has_asked_means:
                 # User mentioned plan but we haven't asked about access yet
                 next_question = "Do you have access to that building right now? Can you get to the 8th floor?"
-            elif has_specific_plan and not has_asked_timeline:
+            elif turn["has_specific_plan"] and not has_asked_timeline:
                 # Asked about plan but not timeline
                 next_question = "When do you think you might do this? Today, tonight, or later?"
             elif not has_asked_location:
@@ -502,16 +483,100 @@ def process_message(user_message, user_content, conversation_history, session_da
                 # Continue with support question
                 next_question = "Can you be with someone you trust right now? Or can you move to a safer place?"
             
+            user_language = turn["user_language"]
+            user_content = turn["user_content"]
             if user_language and ("urdu" in user_language.lower() or "اردو" in user_content or "urdu" in user_content.lower()):
                 bot_response = f"Main aap ke saath hoon. Stay with me. {next_question}"
             else:
                 bot_response = f"I'm here with you. Stay with me. Let me ask you something important. {next_question}"
     
     if not bot_response:
-        if has_current_crisis:
+        if turn["has_current_crisis"]:
             # If crisis and no response, provide immediate safety question
             bot_response = "I'm here with you. Stay with me. Are you safe right now?"
         else:
             bot_response = "Thank you for sharing that with me. Can you tell me more about how long you've been experiencing these feelings?"
     
     return bot_response
+
+def process_message(user_message, user_content, conversation_history, session_data, analysis=None, deadline=None):
+    """
+    Process a message with the interview agent
+    
+    Returns:
+        str: bot_response
+    """
+    return collect_stream(stream_message(user_message, user_content, conversation_history, session_data, analysis, deadline))
+
+def stream_message(user_message, user_content, conversation_history, session_data, analysis=None, deadline=None):
+    """
+    Process a message with the interview agent, streaming the reply
+    
+    During a crisis, text is held back once it could be the start of a refusal
+    pattern, since such replies are overridden after generation. The risk
+    trailer is never forwarded.
+    
+    Yields:
+        str: Text deltas of the reply as the model produces them
+    
+    Returns:
+        str: bot_response
+    """
+    if not llm_configured():
+        message = "The AI model is not configured. Please check server logs."
+        yield message
+        return message
+    
+    if analysis is None:
+        analysis = analyze_turn(user_message, user_content, conversation_history, session_data)
+    with span("prompt"):
+        turn = _prepare_turn(user_message, user_content, conversation_history, session_data, analysis)
+    
+    # Call the LLM backend (Interview Agent), forwarding deltas as they arrive
+    bot_response = ""
+    sent = 0
+    suppressed = False
+    trailer_filter = RiskTrailerFilter()
+    holdback = REFUSAL_HOLDBACK if turn["has_current_crisis"] else 0
+    for delta in hedged_chat_completion(turn["messages"], temperature=turn["temperature"], deadline=deadline, crisis=turn["has_current_crisis"]):
+        bot_response += delta
+        if suppressed:
+            continue
+        # A new refusal phrase can only end inside the latest delta
+        if turn["has_current_crisis"] and contains_refusal(bot_response[-(len(delta) + REFUSAL_HOLDBACK):]):
+            # This reply will be overridden below - stop forwarding it
+            suppressed = True
+            continue
+        releasable = len(bot_response) - holdback
+        if releasable > sent:
+            visible = trailer_filter.feed(bot_response[sent:releasable])
+            sent = releasable
+            if visible:
+                yield visible
+    if not suppressed:
+        visible = trailer_filter.feed(bot_response[sent:]) + trailer_filter.finish()
+        if visible:
+            yield visible
+    
+    return _finish_turn(turn, bot_response, conversation_history, session_data)
+
+async def aprocess_message(user_message, user_content, conversation_history, session_data, analysis=None, deadline=None):
+    """
+    Async variant of process_message for the ASGI request path
+    
+    Returns:
+        str: bot_response
+    """
+    if not llm_configured():
+        return "The AI model is not configured. Please check server logs."
+    
+    if analysis is None:
+        analysis = analyze_turn(user_message, user_content, conversation_history, session_data)
+    with span("prompt"):
+        turn = _prepare_turn(user_message, user_content, conversation_history, session_data, analysis)
+    
+    bot_response = ""
+    async for delta in ahedged_chat_completion(turn["messages"], temperature=turn["temperature"], deadline=deadline, crisis=turn["has_current_crisis"]):
+        bot_response += delta
+    
+    return _finish_turn(turn, bot_response, conversation_history, session_data)
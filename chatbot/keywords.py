@@ -0,0 +1,213 @@
+# keywords.py
+# Central keyword table and a compiled single-pass matcher for all keyword detectors
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# Optional: `pip install pyahocorasick` for the Aho-Corasick engine. It is a C
+# extension, so it stays out of requirements.txt for hosts that cannot build
+# it (such as Vercel); the regex engine finds the same matches.
+try:
+    import ahocorasick
+except ImportError:  # Fall back to the compiled regex automaton
+    ahocorasick = None
+
+# ===========================
+# KEYWORD TABLE
+# ===========================
+
+# A category's keywords, and whether they match regardless of case
+KeywordCategory = namedtuple("KeywordCategory", ["keywords", "casefold"], defaults=[True])
+
+# Keywords are matched as substrings, like the original per-keyword `in` checks: in the
+# lowercased text, or in the text as written for categories with casefold=False
+KEYWORD_TABLE = {
+    # Suicidal ideation indicators (English and Urdu/Hindi - transliterated and common phrases)
+    "suicidal": KeywordCategory((
+        'suicide', 'kill myself', 'end my life', 'want to die', 'better off dead',
+        'not worth living', 'suicidal', 'self-harm', 'hurt myself', 'end it all',
+        'taking my life', 'ending it', 'wish i was dead',
+        'khud kushi', 'khudkushi', 'apne aap ko mar', 'mar jana', 'jan dena',
+        'zindagi khatam', 'khatam karna', 'khatam kar dena', 'marna chahta',
+        'marna chahunga', 'marne ki soch',
+    )),
+    # Counted as a general mental health concern only, never as suicidal ideation
+    "concern_urdu": KeywordCategory((
+        'kisi',
+    )),
+    # Severe depression/hopelessness indicators
+    "hopelessness": KeywordCategory((
+        'hopeless', 'no point', 'no future', 'nothing matters', 'can\'t go on',
+        'give up', 'despair', 'helpless', 'worthless', 'deep depression',
+        'severe depression', 'major depression', 'umsaid', 'be umeed', 'nirash',
+    )),
+    # Crisis indicators
+    "crisis": KeywordCategory((
+        'emergency', 'crisis', 'urgent help', 'immediate danger', 'can\'t cope',
+        'overwhelmed', 'breakdown', 'panic attack', 'severe anxiety',
+    )),
+    # User agreeing to be referred to the interview agent
+    "referral": KeywordCategory((
+        'yes', 'sure', 'okay', 'ok', 'yes please', 'connect me', 'speak with specialist',
+        'talk to psychiatrist', 'interview', 'assessment', 'help me', 'need help',
+    )),
+    # Explicit language mentions
+    "language_urdu_hindi": KeywordCategory(('urdu', 'اردو', 'hindi', 'हिंदी', 'i speak urdu', 'i speak hindi')),
+    "language_spanish": KeywordCategory(('spanish', 'español', 'i speak spanish')),
+    "language_french": KeywordCategory(('french', 'français', 'i speak french')),
+    "language_arabic": KeywordCategory(('arabic', 'عربي', 'i speak arabic')),
+    "language_english": KeywordCategory(('english', 'i speak english')),
+    # Urdu/Hindi words in Urdu script, Roman Urdu and Devanagari. Matched case-sensitively:
+    # short Roman Urdu words hide inside capitalized English ones ('tha' in 'Thanks')
+    "urdu_hindi_text": KeywordCategory((
+        'میں', 'آپ', 'ہے', 'ہیں', 'کر', 'کے', 'کی', 'سے', 'کو', 'پر', 'اور', 'لیکن', 'تھا', 'تھی',
+        'mein', 'aap', 'hai', 'hain', 'kar', 'ke', 'ki', 'se', 'ko', 'par', 'aur', 'lekin', 'tha', 'thi',
+        'mujhe', 'tum', 'tu', 'main', 'tumhara', 'tumhari', 'tumhare', 'apna', 'apne', 'apni',
+        'मैं', 'आप', 'है', 'हैं', 'कर', 'के', 'की', 'से', 'को', 'पर', 'और', 'लेकिन', 'था', 'थी',
+        'मुझे', 'तुम', 'तू', 'मैन', 'तुम्हारा', 'तुम्हारी', 'तुम्हारे', 'अपना', 'अपने', 'अपनी',
+    ), casefold=False),
+    # Means, places and methods that indicate a specific plan
+    "specific_plan": KeywordCategory((
+        'jump', 'floor', 'building', 'pills', 'weapon', 'gun', 'knife', 'rope', 'bridge',
+        'train', 'overdose', 'cut', 'hang', 'drown', '8th', '9th', 'roof', 'balcony',
+    )),
+    # Model replies that refuse or try to end a crisis conversation
+    "refusal": KeywordCategory((
+        "cannot continue", "cannot help", "cannot provide", "cannot assist",
+        "please seek help", "contact a professional", "mental health professional", "crisis hotline",
+        "seek help from", "anything else i can help", "is there anything else", "can help you with",
+    )),
+}
+
+# ===========================
+# COMPILED MATCHER
+# ===========================
+
+KeywordMatch = namedtuple("KeywordMatch", ["category", "keyword", "start", "end"])
+
+def _trie_pattern(keywords):
+    """Build a regex that matches the longest keyword at a position, with shared prefixes factored out"""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # Optional and greedy, so the longer keyword wins
+            return "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+class _KeywordScanner:
+    """One compiled scan for a {keyword: [categories]} map (see KeywordMatcher)"""
+
+    def __init__(self, keyword_categories, use_automaton):
+        if use_automaton and ahocorasick is not None:
+            self.engine = "aho-corasick"
+            self._automaton = ahocorasick.Automaton()
+            for keyword, categories in keyword_categories.items():
+                self._automaton.add_word(keyword, (keyword, len(keyword), tuple(categories)))
+            self._automaton.make_automaton()
+            return
+
+        self.engine = "regex"
+        self._automaton = None
+        # Keywords starting at the same position as a longer one are its prefixes
+        self._implied = {}
+        for keyword in keyword_categories:
+            prefixes = sorted((other for other in keyword_categories if keyword.startswith(other)), key=len)
+            self._implied[keyword] = tuple(
+                (category, prefix, len(prefix))
+                for prefix in prefixes
+                for category in keyword_categories[prefix]
+            )
+        self._pattern = re.compile(_trie_pattern(sorted(keyword_categories)))
+
+    def scan(self, text, matches):
+        if self._automaton is not None:
+            for end, (keyword, length, categories) in self._automaton.iter(text):
+                for category in categories:
+                    matches.append(KeywordMatch(category, keyword, end + 1 - length, end + 1))
+            return
+
+        search = self._pattern.search
+        position = 0
+        while True:
+            found = search(text, position)
+            if found is None:
+                break
+            start = found.start()
+            for category, keyword, length in self._implied[found.group()]:
+                matches.append(KeywordMatch(category, keyword, start, start + length))
+            position = start + 1
+
+class KeywordMatcher:
+    """
+    Finds every keyword of a category table in one scan of the text
+
+    With pyahocorasick installed the table is compiled into an Aho-Corasick
+    automaton. Otherwise it becomes a single trie-shaped regex tried at every
+    position where some keyword starts; the regex reports only the longest
+    keyword there, so each keyword also carries the shorter keywords that are
+    its prefixes (e.g. 'kisi' starts with 'ki'). Either way the scan finds
+    exactly what one `in` check per keyword in the lowercased text would
+    find. Categories with casefold=False get a second scan of the text as
+    written, like the case-sensitive checks they replace.
+    """
+
+    def __init__(self, table, use_automaton=True):
+        self.table = table
+        folded, exact = {}, {}
+        for category, entry in table.items():
+            for keyword in entry.keywords:
+                if entry.casefold:
+                    folded.setdefault(keyword.lower(), []).append(category)
+                else:
+                    exact.setdefault(keyword, []).append(category)
+
+        self._folded = _KeywordScanner(folded, use_automaton) if folded else None
+        self._exact = _KeywordScanner(exact, use_automaton) if exact else None
+        self.engine = "aho-corasick" if use_automaton and ahocorasick is not None else "regex"
+
+    def scan(self, text):
+        """
+        Scan text once for all keywords (twice with case-sensitive categories)
+
+        Returns:
+            tuple: KeywordMatch entries in text order; offsets are into text.lower()
+            for casefolded categories and into text for the others
+        """
+        if not text:
+            return ()
+        matches = []
+        if self._folded is not None:
+            self._folded.scan(text.lower(), matches)
+        if self._exact is not None:
+            self._exact.scan(text, matches)
+            matches.sort(key=lambda match: match.start)
+        return tuple(matches)
+
+    def categories(self, text):
+        """Get the set of categories with at least one keyword in text"""
+        return frozenset(match.category for match in self.scan(text))
+
+KEYWORD_MATCHER = KeywordMatcher(KEYWORD_TABLE)
+
+@lru_cache(maxsize=256)
+def scan_keywords(text):
+    """Scan a message with the shared matcher, memoized so every detector in a turn reuses one scan"""
+    return KEYWORD_MATCHER.scan(text)
+
+@lru_cache(maxsize=256)
+def matched_categories(text):
+    """Get the categories matched in a message (memoized)"""
+    return frozenset(match.category for match in scan_keywords(text))
@@ -0,0 +1,377 @@
+# llm_backends.py
+# Pluggable LLM backends - Groq, any OpenAI-compatible server, and an in-process stub
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+
+from django.conf import settings
+
+# ===========================
+# BACKEND INTERFACE
+# ===========================
+
+class LLMBackend:
+    """
+    Base class for LLM backends
+
+    open_stream returns a DeltaStream: iterate it for text deltas and close
+    it to cancel the request. Errors opening the request are raised by
+    open_stream; errors while streaming are raised during iteration.
+    """
+
+    name = "base"
+
+    def is_configured(self):
+        """Check whether the backend can take requests"""
+        return True
+
+    def open_stream(self, model, messages, temperature, max_tokens, timeout):
+        """
+        Start a streaming chat completion
+
+        Returns:
+            DeltaStream: Text deltas of the reply
+        """
+        raise NotImplementedError
+
+    async def aopen_stream(self, model, messages, temperature, max_tokens, timeout):
+        """
+        Async variant of open_stream
+
+        Returns:
+            AsyncDeltaStream: Text deltas of the reply
+        """
+        raise NotImplementedError
+
+    def list_models(self):
+        """
+        Get the models the backend currently serves, for the router's capability table
+
+        Returns:
+            dict: {model id: {"context_window": int or None}}, or None if unknown
+        """
+        return None
+
+class DeltaStream:
+    """Iterable of text deltas with a close() that cancels the request"""
+
+    def __init__(self, deltas, close=None):
+        self._deltas = deltas
+        self._close = close
+
+    def __iter__(self):
+        return iter(self._deltas)
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+
+class AsyncDeltaStream:
+    """Async iterable of text deltas with an awaitable close()"""
+
+    def __init__(self, deltas, close=None):
+        self._deltas = deltas
+        self._close = close
+
+    def __aiter__(self):
+        return self._deltas.__aiter__()
+
+    async def close(self):
+        if self._close is not None:
+            await self._close()
+
+def _chunk_deltas(completion):
+    """Yield the text content of OpenAI-style streaming chunks"""
+    for chunk in completion:
+        if chunk.choices and len(chunk.choices) > 0:
+            if chunk.choices[0].delta and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+async def _achunk_deltas(completion):
+    async for chunk in completion:
+        if chunk.choices and len(chunk.choices) > 0:
+            if chunk.choices[0].delta and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+# ===========================
+# GROQ
+# ===========================
+
+class GroqBackend(LLMBackend):
+    """Groq cloud API (GROQ_API_KEY)"""
+
+    name = "groq"
+
+    def __init__(self, api_key=None):
+        self.client = None
+        self._async_client = None
+        try:
+            api_key = api_key or os.getenv("GROQ_API_KEY")
+            if not api_key:
+                print("🔴 FATAL ERROR: GROQ_API_KEY not found in .env file.")
+            else:
+                # Imported here: the SDK and its models take a noticeable part of a cold start
+                from groq import Groq
+                self.client = Groq(api_key=api_key)
+                print(f"✅ Groq client initialized successfully.")
+        except Exception as e:
+            print(f"🔴 FATAL ERROR during Groq initialization: {e}")
+
+    def is_configured(self):
+        return self.client is not None
+
+    @property
+    def async_client(self):
+        """Async Groq client used by the ASGI request path, created on first use"""
+        if self._async_client is None and self.client is not None:
+            from groq import AsyncGroq
+            self._async_client = AsyncGroq(api_key=self.client.api_key)
+        return self._async_client
+
+    def open_stream(self, model, messages, temperature, max_tokens, timeout):
+        completion = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            timeout=timeout,
+        )
+        return DeltaStream(_chunk_deltas(completion), getattr(completion, "close", None))
+
+    async def aopen_stream(self, model, messages, temperature, max_tokens, timeout):
+        completion = await self.async_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            timeout=timeout,
+        )
+        return AsyncDeltaStream(_achunk_deltas(completion), getattr(completion, "close", None))
+
+    def list_models(self):
+        models = self.client.models.list()
+        return {
+            model.id: {"context_window": getattr(model, "context_window", None)}
+            for model in models.data
+            if getattr(model, "active", True)
+        }
+
+# ===========================
+# OPENAI-COMPATIBLE SERVER
+# ===========================
+
+# Marks the end of an OpenAI-style event stream
+_STREAM_DONE = object()
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Any server speaking the OpenAI chat completions API (vLLM, llama.cpp,
+    Ollama, LM Studio, ...) at settings.CHATBOT_LLM_BASE_URL
+
+    Talks HTTP and server-sent events directly through httpx, so no extra
+    SDK is needed.
+    """
+
+    name = "openai-compatible"
+
+    def __init__(self, base_url=None, api_key=None):
+        self.base_url = (base_url or settings.CHATBOT_LLM_BASE_URL).rstrip("/")
+        self.api_key = api_key if api_key is not None else settings.CHATBOT_LLM_API_KEY
+        import httpx
+        self._client = httpx.Client(base_url=self.base_url, headers=self._headers())
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+    def _payload(self, model, messages, temperature, max_tokens):
+        return {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+
+    @staticmethod
+    def _parse_event(line):
+        """Get the text delta of one SSE line, None for other lines, or _STREAM_DONE"""
+        if not line.startswith("data:"):
+            return None
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return _STREAM_DONE
+        choices = json.loads(data).get("choices") or []
+        if choices:
+            return (choices[0].get("delta") or {}).get("content")
+        return None
+
+    def open_stream(self, model, messages, temperature, max_tokens, timeout):
+        request = self._client.build_request(
+            "POST", "/chat/completions", json=self._payload(model, messages, temperature, max_tokens), timeout=timeout
+        )
+        response = self._client.send(request, stream=True)
+        if response.status_code >= 400:
+            body = response.read().decode("utf-8", "replace")
+            response.close()
+            raise RuntimeError(f"{response.status_code} from {self.base_url}: {body[:500]}")
+
+        def deltas():
+            try:
+                for line in response.iter_lines():
+                    delta = self._parse_event(line)
+                    if delta is _STREAM_DONE:
+                        return
+                    if delta:
+                        yield delta
+            finally:
+                response.close()
+
+        return DeltaStream(deltas(), response.close)
+
+    async def aopen_stream(self, model, messages, temperature, max_tokens, timeout):
+        # One client per call: httpx async clients must not be shared across event loops
+        import httpx
+        client = httpx.AsyncClient(base_url=self.base_url, headers=self._headers())
+        request = client.build_request(
+            "POST", "/chat/completions", json=self._payload(model, messages, temperature, max_tokens), timeout=timeout
+        )
+        response = await client.send(request, stream=True)
+        if response.status_code >= 400:
+            body = (await response.aread()).decode("utf-8", "replace")
+            await response.aclose()
+            await client.aclose()
+            raise RuntimeError(f"{response.status_code} from {self.base_url}: {body[:500]}")
+
+        async def close():
+            await response.aclose()
+            await client.aclose()
+
+        async def deltas():
+            try:
+                async for line in response.aiter_lines():
+                    delta = self._parse_event(line)
+                    if delta is _STREAM_DONE:
+                        return
+                    if delta:
+                        yield delta
+            finally:
+                await close()
+
+        return AsyncDeltaStream(deltas(), close)
+
+    def list_models(self):
+        response = self._client.get("/models", timeout=10)
+        response.raise_for_status()
+        return {model["id"]: {"context_window": model.get("context_window")} for model in response.json().get("data", [])}
+
+# ===========================
+# IN-PROCESS STUB
+# ===========================
+
+STUB_REPLY_TEMPLATES = [
+    "I hear you, and thank you for telling me about {topic}. Can you tell me a little more about how this has been affecting you?",
+    "That sounds really hard. When you think about {topic}, what feels heaviest right now?",
+    "Thank you for sharing that. I'm here with you. How long have you been feeling this way about {topic}?",
+]
+
+STUB_RISK_TRAILER = "\n\n(LANGUAGE-AWARE RISK ASSESSMENT: LOW)\nRisk Level: LOW\nNext Step: Continue supportive conversation"
+
+class StubFailure(RuntimeError):
+    """Failure injected by the stub backend"""
+
+class StubBackend(LLMBackend):
+    """
+    Deterministic in-process backend for load tests, benchmarks and offline work
+
+    Replies come from `script` (replies returned in turn, cycling) or, by
+    default, from STUB_REPLY_TEMPLATES picked by a hash of the last user
+    message. Replies are streamed word by word after `ttft` seconds, with
+    `token_delay` seconds between words. `failure_rate` makes that share of
+    requests fail to open, `fail_models` always fail, and `fail_after_tokens`
+    breaks every stream part-way. Failures draw from a seeded RNG, so a run
+    is reproducible. With `record_calls` every request (model and messages)
+    is kept in `calls`, for tests; long load tests leave it off.
+    """
+
+    name = "stub"
+
+    def __init__(self, script=None, ttft=None, token_delay=None, failure_rate=None, fail_models=(),
+                 fail_after_tokens=None, seed=None, models=None, record_calls=False):
+        self.script = list(script) if script else None
+        self.ttft = settings.CHATBOT_STUB_TTFT if ttft is None else ttft
+        self.token_delay = settings.CHATBOT_STUB_TOKEN_DELAY if token_delay is None else token_delay
+        self.failure_rate = settings.CHATBOT_STUB_FAILURE_RATE if failure_rate is None else failure_rate
+        self.fail_models = set(fail_models)
+        self.fail_after_tokens = fail_after_tokens
+        self.models = models
+        self._random = random.Random(settings.CHATBOT_STUB_SEED if seed is None else seed)
+        self._lock = threading.Lock()
+        self._script_index = 0
+        self.record_calls = record_calls
+        self.calls = []
+
+    def reply_for(self, messages):
+        """Get the full reply text the stub will stream for a request"""
+        with self._lock:
+            if self.script:
+                reply = self.script[self._script_index % len(self.script)]
+                self._script_index += 1
+                return reply
+        last_user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        digest = int(hashlib.sha256(last_user.encode("utf-8")).hexdigest(), 16)
+        words = re.findall(r"[\w']+", last_user)
+        topic = " ".join(words[:4]) if words else "what you're going through"
+        return STUB_REPLY_TEMPLATES[digest % len(STUB_REPLY_TEMPLATES)].format(topic=topic) + STUB_RISK_TRAILER
+
+    def _start(self, model, messages, max_tokens):
+        """Record the call (with record_calls), inject open failures and split the reply into tokens"""
+        with self._lock:
+            if self.record_calls:
+                self.calls.append({"model": model, "messages": messages})
+            fails = model in self.fail_models or self._random.random() < self.failure_rate
+        if fails:
+            raise StubFailure(f"Injected failure for {model}")
+        return re.findall(r"\S+\s*", self.reply_for(messages))[:max_tokens]
+
+    def open_stream(self, model, messages, temperature, max_tokens, timeout):
+        tokens = self._start(model, messages, max_tokens)
+        closed = threading.Event()
+
+        def deltas():
+            if closed.wait(self.ttft):
+                return
+            for index, token in enumerate(tokens):
+                if self.fail_after_tokens is not None and index >= self.fail_after_tokens:
+                    raise StubFailure(f"Injected stream failure for {model}")
+                if index and closed.wait(self.token_delay):
+                    return
+                yield token
+
+        return DeltaStream(deltas(), closed.set)
+
+    async def aopen_stream(self, model, messages, temperature, max_tokens, timeout):
+        tokens = self._start(model, messages, max_tokens)
+
+        async def deltas():
+            await asyncio.sleep(self.ttft)
+            for index, token in enumerate(tokens):
+                if self.fail_after_tokens is not None and index >= self.fail_after_tokens:
+                    raise StubFailure(f"Injected stream failure for {model}")
+                if index:
+                    await asyncio.sleep(self.token_delay)
+                yield token
+
+        stream = deltas()
+        return AsyncDeltaStream(stream, stream.aclose)
+
+    def list_models(self):
+        if self.models is None:
+            return None
+        return {model: {"context_window": None} for model in self.models}
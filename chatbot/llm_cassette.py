@@ -0,0 +1,337 @@
+# llm_cassette.py
+# Record/replay of LLM traffic - streamed replies and their timing in a JSONL cassette
+
+import asyncio
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .llm_backends import LLMBackend, DeltaStream, AsyncDeltaStream
+
+# ===========================
+# CASSETTE FORMAT
+# ===========================
+
+CASSETTE_VERSION = 1
+
+# Chat turn the current model calls belong to, written with each recording so
+# a replay can rebuild the conversations (set per turn by the views)
+_turn_tag = contextvars.ContextVar("chatbot_cassette_turn", default=None)
+
+def messages_hash(messages):
+    """Get a stable hash of a prompt's messages, the key replays are matched on"""
+    canonical = json.dumps(messages, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+_write_lock = threading.Lock()
+
+def append_record(path, record):
+    """Append one record to a cassette file"""
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _write_lock:
+        with open(path, "a", encoding="utf-8") as cassette:
+            cassette.write(line)
+
+def loose_hash(messages):
+    """
+    Get a hash of a prompt's system message and latest message only
+
+    Matches a replayed turn whose older history differs slightly from the
+    recording, e.g. by a timestamp in an earlier reply.
+    """
+    return messages_hash([messages[0], messages[-1]] if messages else [])
+
+def tag_turn(conversation_id, turn, user_message):
+    """
+    Record a chat turn and tag the model calls the current thread or task makes for it
+
+    Does nothing unless CHATBOT_LLM_CASSETTE is 'record'. Turns are recorded
+    even when they make no model call (e.g. a referral), so a replay sends
+    the same messages and rebuilds the same prompts. The conversation ID is
+    hashed; the user message is kept verbatim so the turn can be replayed
+    through the chat view.
+    """
+    if settings.CHATBOT_LLM_CASSETTE != "record":
+        return
+    tag = {
+        "conversation": hashlib.sha256(str(conversation_id).encode("utf-8")).hexdigest()[:16],
+        "turn": turn,
+    }
+    _turn_tag.set(tag)
+    append_record(settings.CHATBOT_LLM_CASSETTE_PATH, {
+        "v": CASSETTE_VERSION,
+        "type": "turn",
+        "recorded_at": round(time.time(), 3),
+        **tag,
+        "user_message": user_message,
+    })
+
+def load_cassette(path):
+    """
+    Read the records of a cassette file
+
+    Returns:
+        list: Records in recording order
+    """
+    records = []
+    with open(path, encoding="utf-8") as cassette:
+        for line in cassette:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+# ===========================
+# RECORDING
+# ===========================
+
+class _Recording:
+    """Chunks and timing of one streamed completion, written when the stream ends"""
+
+    def __init__(self, path, model, messages, temperature, max_tokens):
+        self.path = path
+        self.started = time.monotonic()
+        self.record = {
+            "v": CASSETTE_VERSION,
+            "type": "completion",
+            "recorded_at": round(time.time(), 3),
+            "model": model,
+            "messages_hash": messages_hash(messages),
+            "loose_hash": loose_hash(messages),
+            "params": {"temperature": temperature, "max_tokens": max_tokens},
+            "tag": _turn_tag.get(),
+            "status": "ok",
+            "chunks": [],
+        }
+        self._written = False
+
+    def add(self, delta):
+        self.record["chunks"].append([round(time.monotonic() - self.started, 4), delta])
+
+    def finish(self, status="ok", error=None):
+        if self._written:
+            return
+        self._written = True
+        self.record["status"] = status
+        self.record["duration"] = round(time.monotonic() - self.started, 4)
+        if error is not None:
+            self.record["error"] = str(error)[:500]
+        append_record(self.path, self.record)
+
+class RecordingBackend(LLMBackend):
+    """
+    Wraps another backend and appends every completion it streams to a cassette
+
+    Each line holds the model, the hash of the prompt messages, the sampling
+    parameters, the chat turn that made the call and the streamed chunks
+    with their offsets from the start of the request. Failed requests are
+    recorded too, so a replay reproduces the fallback chain.
+    """
+
+    name = "recording"
+
+    def __init__(self, backend, path=None):
+        self.backend = backend
+        self.path = path or settings.CHATBOT_LLM_CASSETTE_PATH
+        print(f"📼 Recording LLM traffic to {self.path}")
+
+    @property
+    def client(self):
+        return getattr(self.backend, "client", None)
+
+    def is_configured(self):
+        return self.backend.is_configured()
+
+    def list_models(self):
+        return self.backend.list_models()
+
+    def open_stream(self, model, messages, temperature, max_tokens, timeout):
+        recording = _Recording(self.path, model, messages, temperature, max_tokens)
+        try:
+            stream = self.backend.open_stream(model, messages, temperature, max_tokens, timeout)
+        except Exception as e:
+            recording.finish("open_error", e)
+            raise
+
+        def deltas():
+            try:
+                for delta in stream:
+                    recording.add(delta)
+                    yield delta
+                recording.finish()
+            except Exception as e:
+                recording.finish("stream_error", e)
+                raise
+            finally:
+                recording.finish("closed")
+
+        def close():
+            recording.finish("closed")
+            stream.close()
+
+        return DeltaStream(deltas(), close)
+
+    async def aopen_stream(self, model, messages, temperature, max_tokens, timeout):
+        recording = _Recording(self.path, model, messages, temperature, max_tokens)
+        try:
+            stream = await self.backend.aopen_stream(model, messages, temperature, max_tokens, timeout)
+        except Exception as e:
+            recording.finish("open_error", e)
+            raise
+
+        async def deltas():
+            try:
+                async for delta in stream:
+                    recording.add(delta)
+                    yield delta
+                recording.finish()
+            except Exception as e:
+                recording.finish("stream_error", e)
+                raise
+            finally:
+                recording.finish("closed")
+
+        async def close():
+            recording.finish("closed")
+            await stream.close()
+
+        return AsyncDeltaStream(deltas(), close)
+
+# ===========================
+# REPLAY
+# ===========================
+
+class ReplayMiss(LookupError):
+    """Raised in strict replay when the cassette has no recording of a prompt"""
+
+class ReplayedFailure(RuntimeError):
+    """A failure recorded in the cassette, raised again on replay"""
+
+class ReplayBackend(LLMBackend):
+    """
+    Serves recorded completions back from a cassette
+
+    A request is matched on its prompt hash, preferring a recording from the
+    same model; repeated prompts get their recordings in turn. Unmatched
+    requests raise ReplayMiss when `strict`. Otherwise they are matched on
+    the system message and latest message alone, and failing that get the
+    next recording in cassette order, which keeps realistic reply lengths
+    and timing flowing after prompts have changed since the recording. Chunks
+    are released at their recorded offsets divided by `speed` (0 streams
+    everything immediately).
+    """
+
+    name = "replay"
+
+    def __init__(self, path=None, speed=None, strict=None):
+        self.path = path or settings.CHATBOT_LLM_CASSETTE_PATH
+        self.speed = settings.CHATBOT_REPLAY_SPEED if speed is None else speed
+        self.strict = settings.CHATBOT_REPLAY_STRICT if strict is None else strict
+        records = load_cassette(self.path)
+        self.turns = [record for record in records if record.get("type") == "turn"]
+        self.records = [
+            record for record in records
+            if record.get("type") == "completion" and (record["status"] != "closed" or record["chunks"])
+        ]
+        self._exact = defaultdict(list)
+        self._loose = defaultdict(list)
+        for record in self.records:
+            self._exact[record["messages_hash"]].append(record)
+            self._loose[record.get("loose_hash")].append(record)
+        self._served = defaultdict(int)
+        self._next_unmatched = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loose_hits = 0
+        self.misses = 0
+        print(f"📼 Replaying {len(self.records)} LLM recordings from {self.path} at speed {self.speed}")
+
+    def _serve(self, key, matches, model):
+        """Take the next recording of a matched prompt, preferring the requested model"""
+        same_model = [record for record in matches if record["model"] == model] or matches
+        index = self._served[key]
+        self._served[key] += 1
+        return same_model[index % len(same_model)]
+
+    def _match(self, model, messages):
+        """Pick the recording to serve for a request"""
+        key = messages_hash(messages)
+        with self._lock:
+            if key in self._exact:
+                self.hits += 1
+                return self._serve(key, self._exact[key], model)
+            if self.strict or not self.records:
+                self.misses += 1
+                raise ReplayMiss(f"No recording for prompt {key[:12]} on {model}")
+            loose = loose_hash(messages)
+            if loose in self._loose:
+                self.loose_hits += 1
+                return self._serve(loose, self._loose[loose], model)
+            self.misses += 1
+            record = self.records[self._next_unmatched % len(self.records)]
+            self._next_unmatched += 1
+            return record
+
+    def _delay(self, offset):
+        return offset / self.speed if self.speed else 0.0
+
+    def open_stream(self, model, messages, temperature, max_tokens, timeout):
+        record = self._match(model, messages)
+        if record["status"] == "open_error":
+            raise ReplayedFailure(record.get("error", "Recorded failure"))
+        started = time.monotonic()
+        closed = threading.Event()
+
+        def deltas():
+            for offset, delta in record["chunks"]:
+                wait = self._delay(offset) - (time.monotonic() - started)
+                if wait > 0 and closed.wait(wait):
+                    return
+                if closed.is_set():
+                    return
+                yield delta
+            if record["status"] == "stream_error":
+                raise ReplayedFailure(record.get("error", "Recorded stream failure"))
+
+        return DeltaStream(deltas(), closed.set)
+
+    async def aopen_stream(self, model, messages, temperature, max_tokens, timeout):
+        record = self._match(model, messages)
+        if record["status"] == "open_error":
+            raise ReplayedFailure(record.get("error", "Recorded failure"))
+        started = time.monotonic()
+
+        async def deltas():
+            for offset, delta in record["chunks"]:
+                wait = self._delay(offset) - (time.monotonic() - started)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                yield delta
+            if record["status"] == "stream_error":
+                raise ReplayedFailure(record.get("error", "Recorded stream failure"))
+
+        stream = deltas()
+        return AsyncDeltaStream(stream, stream.aclose)
+
+# ===========================
+# CASSETTE MODE
+# ===========================
+
+def apply_cassette_mode(backend_factory):
+    """
+    Build the LLM backend for settings.CHATBOT_LLM_CASSETTE
+
+    '' uses the configured backend as is, 'record' wraps it in a
+    RecordingBackend and 'replay' serves the cassette instead of it.
+    """
+    mode = settings.CHATBOT_LLM_CASSETTE
+    if mode == "replay":
+        return ReplayBackend()
+    if mode == "record":
+        return RecordingBackend(backend_factory())
+    return backend_factory()
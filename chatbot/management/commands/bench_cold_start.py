@@ -0,0 +1,140 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: load the Vercel entry point, then serve the first
+# GET / (chatbot_view) and POST /ask/ through WSGI, as the platform would
+CHILD_SCRIPT = r"""
+import io, json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import api.index
+imported = time.perf_counter()
+
+def call(method, path, body=b"", cookie=""):
+    from wsgiref.util import setup_testing_defaults
+    environ = {"REQUEST_METHOD": method, "PATH_INFO": path, "HTTP_COOKIE": cookie, "wsgi.input": io.BytesIO(body),
+               "CONTENT_LENGTH": str(len(body)), "CONTENT_TYPE": "application/json"}
+    setup_testing_defaults(environ)
+    status_headers = []
+    result = api.index.app(environ, lambda status, headers, exc_info=None: status_headers.append((status, headers)))
+    content = b"".join(result)
+    status, headers = status_headers[0]
+    cookies = "; ".join(value.split(";")[0] for name, value in headers if name.lower() == "set-cookie")
+    return int(status.split()[0]), cookies, content
+
+status_page, cookie, _ = call("GET", "/")
+page = time.perf_counter()
+status_ask, _, _ = call("POST", "/ask/", json.dumps({"message": "Hello, I feel a bit low today"}).encode(), cookie)
+ask = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_page_ms": (page - imported) * 1000,
+    "first_ask_ms": (ask - page) * 1000,
+    "ready_to_answer_ms": (ask - started) * 1000,
+    "status": [status_page, status_ask],
+}))
+"""
+
+def parse_importtime(stderr):
+    """
+    Read the output of python -X importtime
+
+    Returns:
+        tuple: ({top-level package: self microseconds}, {module: cumulative microseconds})
+    """
+    by_package = defaultdict(int)
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        module = name.strip()
+        by_package[module.split(".")[0]] += int(self_us)
+        cumulative[module] = int(cumulative_us)
+    return by_package, cumulative
+
+class Command(BaseCommand):
+    help = (
+        "Measure cold starts of the Vercel entry point (api/index.py) in fresh processes: import time, time to the "
+        "first chatbot_view and /ask/ responses, and where the import time goes per package and chatbot module"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5, help="Fresh processes per warm-up mode")
+        parser.add_argument("--warm-up", default="off,inline", help="Comma-separated CHATBOT_WARM_UP modes to compare")
+        parser.add_argument(
+            "--backend", default="chatbot.llm_backends.StubBackend",
+            help="LLM backend for the /ask/ turn (default: the stub without delays, so only local work is timed)",
+        )
+        parser.add_argument("--top", type=int, default=15, help="Rows in the import breakdown")
+        parser.add_argument("--json", metavar="PATH", help="Write the results as JSON")
+
+    def _run(self, warm_up, backend):
+        env = dict(os.environ)
+        env.update({
+            "CHATBOT_WARM_UP": warm_up,
+            "CHATBOT_LLM_BACKEND": backend,
+            "CHATBOT_STUB_TTFT": "0",
+            "CHATBOT_STUB_TOKEN_DELAY": "0",
+            "CHATBOT_TRACING": "False",
+        })
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", CHILD_SCRIPT, str(settings.BASE_DIR)],
+            capture_output=True, text=True, env=env, cwd=str(settings.BASE_DIR),
+        )
+        result_lines = [line for line in completed.stdout.splitlines() if line.startswith("{")]
+        if completed.returncode != 0 or not result_lines:
+            raise CommandError(f"Cold start run failed:\n{completed.stderr[-2000:]}")
+        return json.loads(result_lines[-1]), parse_importtime(completed.stderr)
+
+    def handle(self, *args, **options):
+        results = {}
+        breakdown = None
+        for warm_up in [mode.strip() for mode in options["warm_up"].split(",") if mode.strip()]:
+            runs = []
+            packages = defaultdict(list)
+            modules = defaultdict(list)
+            for _ in range(options["runs"]):
+                timings, (by_package, cumulative) = self._run(warm_up, options["backend"])
+                runs.append(timings)
+                for package, self_us in by_package.items():
+                    packages[package].append(self_us)
+                for module, cumulative_us in cumulative.items():
+                    if module.startswith("chatbot"):
+                        modules[module].append(cumulative_us)
+            results[warm_up] = {
+                key: round(statistics.median(run[key] for run in runs), 1)
+                for key in ("import_ms", "first_page_ms", "first_ask_ms", "ready_to_answer_ms")
+            }
+            results[warm_up]["status"] = runs[-1]["status"]
+            if breakdown is None:
+                breakdown = {
+                    "packages_ms": {name: round(statistics.median(values) / 1000, 1) for name, values in packages.items()},
+                    "chatbot_modules_ms": {name: round(statistics.median(values) / 1000, 1) for name, values in modules.items()},
+                }
+
+        self.stdout.write(f"Median of {options['runs']} fresh processes, backend {options['backend']}")
+        self.stdout.write(f"{'warm-up':<10} | {'import':>8} | {'1st page':>8} | {'1st ask':>8} | {'ready':>8}")
+        for warm_up, result in results.items():
+            self.stdout.write(
+                f"{warm_up:<10} | {result['import_ms']:>8.1f} | {result['first_page_ms']:>8.1f} | "
+                f"{result['first_ask_ms']:>8.1f} | {result['ready_to_answer_ms']:>8.1f}"
+            )
+
+        self.stdout.write(f"\nImport time by package (self time, ms, first mode):")
+        for name, ms in sorted(breakdown["packages_ms"].items(), key=lambda item: -item[1])[:options["top"]]:
+            self.stdout.write(f"  {name:<32} {ms:>8.1f}")
+        self.stdout.write(f"\nchatbot modules (cumulative, ms):")
+        for name, ms in sorted(breakdown["chatbot_modules_ms"].items(), key=lambda item: -item[1])[:options["top"]]:
+            self.stdout.write(f"  {name:<32} {ms:>8.1f}")
+
+        if options["json"]:
+            with open(options["json"], "w", encoding="utf-8") as output:
+                json.dump({"runs": options["runs"], "backend": options["backend"], "results": results, **breakdown}, output, indent=2)
@@ -0,0 +1,140 @@
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot.agent_utils import estimate_tokens, to_prompt_message
+from chatbot.conversation_store import CompactSQLiteConversationStore, SQLiteConversationStore
+from chatbot.history_codec import COMPRESSIONS, CompactHistory, resolve_compression
+from chatbot.message_analysis import analyze_message
+from chatbot.orchestrator_agent import get_welcome_message
+
+USER_TURNS = (
+    "I haven't been sleeping well and everything at work feels overwhelming lately.",
+    "Mujhe bohat pareshani ho rahi hai, raat ko neend nahi aati.",
+    "I guess I'm okay, just tired.",
+    "My family doesn't really understand what I'm going through.",
+)
+ASSISTANT_TURN = "I'm here with you. It sounds like you've been carrying a lot. Can you tell me when you first noticed this?"
+FALLBACK_REPLY = "I'm here to listen. Could you tell me more about what you're experiencing?"
+
+WORDS = "sleep work family tired worried alone friends exams money tonight morning panic heart chest breathing talk help".split()
+
+def build_history(turns, rng):
+    """
+    Build a history in the format views._record_turn stores: analysis records and
+    token counts on user entries, risk codes and token counts on assistant entries
+
+    Returns:
+        list: 2 * turns message dicts
+    """
+    history = []
+    for turn in range(turns):
+        user_content = rng.choice(USER_TURNS) + " " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 12)))
+        history.append({
+            "role": "user",
+            "content": user_content,
+            "analysis": analyze_message(user_content).to_record(),
+            "tokens": estimate_tokens(user_content),
+        })
+        if turn == 0:
+            reply = get_welcome_message()
+        elif turn % 7 == 0:
+            reply = FALLBACK_REPLY
+        else:
+            reply = ASSISTANT_TURN + " " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 40)))
+        assistant = {"role": "assistant", "content": reply, "risk": [rng.choice((1, 1, 2)), 1]}
+        assistant["tokens"] = estimate_tokens(to_prompt_message(assistant)["content"])
+        history.append(assistant)
+    return history
+
+def _median_ms(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+class Command(BaseCommand):
+    help = (
+        "Compare conversation history encodings at several lengths: the JSON message list (the old whole-session "
+        "format) vs. the compact container without and with compression - serialized size and encode/decode time - "
+        "plus a save-one-turn + load round trip of the row-per-message and compact SQLite stores"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--turns", default="10,50,200", help="Comma-separated conversation lengths (user+assistant pairs)")
+        parser.add_argument("--repeat", type=int, default=50, help="Timed repetitions per measurement (median reported)")
+        parser.add_argument("--json", metavar="PATH", help="Write the results as JSON")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        compressions = [name for name in COMPRESSIONS if resolve_compression(name) == name]
+        results = {}
+        for turns in [int(value) for value in options["turns"].split(",") if value.strip()]:
+            history = build_history(turns, rng)
+            results[turns] = self._measure_encodings(history, compressions, options["repeat"])
+            results[turns]["stores"] = self._measure_stores(history, options["repeat"])
+
+        self.stdout.write(f"Median of {options['repeat']} runs ({', '.join(compressions)} available; zstd needs zstandard)")
+        self.stdout.write(f"{'turns':>5} | {'format':<14} | {'bytes':>8} | {'encode ms':>9} | {'decode ms':>9}")
+        for turns, result in results.items():
+            for name, row in result["formats"].items():
+                self.stdout.write(
+                    f"{turns:>5} | {name:<14} | {row['bytes']:>8} | {row['encode_ms']:>9.3f} | {row['decode_ms']:>9.3f}"
+                )
+        self.stdout.write(f"\nStores (CHATBOT_HISTORY_COMPRESSION={resolve_compression()}): save one turn, then load")
+        self.stdout.write(f"{'turns':>5} | {'store':<14} | {'save ms':>9} | {'load ms':>9}")
+        for turns, result in results.items():
+            for name, row in result["stores"].items():
+                self.stdout.write(f"{turns:>5} | {name:<14} | {row['save_ms']:>9.3f} | {row['load_ms']:>9.3f}")
+
+        if options["json"]:
+            with open(options["json"], "w", encoding="utf-8") as output:
+                json.dump(
+                    {"repeat": options["repeat"], "store_compression": resolve_compression(), "results": results}, output, indent=2
+                )
+
+    def _measure_encodings(self, history, compressions, repeat):
+        formats = {}
+        encoded = json.dumps(history).encode("utf-8")
+        formats["json"] = {
+            "bytes": len(encoded),
+            "encode_ms": _median_ms(lambda: json.dumps(history).encode("utf-8"), repeat),
+            "decode_ms": _median_ms(lambda: json.loads(encoded), repeat),
+        }
+        for compression in compressions:
+            blob = CompactHistory.from_messages(history).encode(compression)
+            if CompactHistory.decode(blob).to_messages() != history:
+                raise AssertionError(f"compact/{compression} did not round-trip")
+            formats[f"compact/{compression}"] = {
+                "bytes": len(blob),
+                "encode_ms": _median_ms(lambda: CompactHistory.from_messages(history).encode(compression), repeat),
+                "decode_ms": _median_ms(lambda: CompactHistory.decode(blob).to_messages(), repeat),
+            }
+        return {"formats": formats}
+
+    def _measure_stores(self, history, repeat):
+        """Time saving the last turn onto a stored conversation, then loading it, as every request does"""
+        stores = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for name, store_class in (("rows", SQLiteConversationStore), ("compact", CompactSQLiteConversationStore)):
+                store = store_class(os.path.join(directory, f"{name}.sqlite3"))
+                state = {"current_agent": "interview", "language": None}
+                saves, loads = [], []
+                for run in range(repeat):
+                    conversation_id = f"{name}-{run}"
+                    store.save(conversation_id, state, history[:-2])
+                    started = time.perf_counter()
+                    store.save(conversation_id, state, history)
+                    saves.append(time.perf_counter() - started)
+                    started = time.perf_counter()
+                    store.load(conversation_id)
+                    loads.append(time.perf_counter() - started)
+                stores[name] = {"save_ms": statistics.median(saves) * 1000, "load_ms": statistics.median(loads) * 1000}
+        return stores
@@ -0,0 +1,269 @@
+import gc
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.agent_utils import detect_language_preference, detect_mental_health_concerns, detect_referral_request, detect_suicidal_keywords
+from chatbot.interview_agent import _build_system_instructions as build_interview_instructions, contains_refusal
+from chatbot.keywords import KEYWORD_MATCHER, matched_categories, scan_keywords
+from chatbot.orchestrator_agent import _build_system_instructions as build_orchestrator_instructions
+from chatbot.prompts import PROMPT_REGISTRY
+from chatbot.safety_plan_agent import format_safety_plan_html, generate_pdf, generate_safety_plan_content
+
+# ===========================
+# FIXED CORPUS
+# ===========================
+
+BASE_MESSAGES = {
+    "english": "I've been feeling really low lately, I can't sleep at night and work feels overwhelming. ",
+    "roman_urdu": "Mujhe bohat pareshani ho rahi hai, raat ko neend nahi aati aur kuch samajh nahi aa raha. ",
+    "urdu_script": "میں بہت پریشان ہوں، مجھے رات کو نیند نہیں آتی اور کچھ سمجھ نہیں آ رہا۔ ",
+    "mixed": "Yaar I'm so tired, kuch acha nahi lag raha and میں اکیلا محسوس کرتا ہوں, I just want to sleep. ",
+}
+
+# Repeats of the base message: a short turn, a few paragraphs, and a pasted wall of text
+LENGTHS = {"short": 1, "medium": 5, "long": 40}
+
+CRISIS_TAIL = {
+    "english": "Sometimes I want to end my life, I might jump from the roof.",
+    "roman_urdu": "Kabhi kabhi dil karta hai khudkushi kar loon.",
+    "urdu_script": "کبھی کبھی دل کرتا ہے کہ خودکشی کر لوں۔",
+    "mixed": "Honestly I want to die, khudkushi ka sochta hoon.",
+}
+
+def build_corpus():
+    """
+    Get the benchmark messages: every language at every length, crisis text at the end
+
+    Returns:
+        dict: {name: message}
+    """
+    corpus = {}
+    for language, base in BASE_MESSAGES.items():
+        for length, repeats in LENGTHS.items():
+            corpus[f"{language}_{length}"] = base * repeats + CRISIS_TAIL[language]
+    return corpus
+
+# Model replies for the interview agent's refusal scan
+REPLIES = {
+    "supportive": "I'm here with you. Stay with me. Are you alone right now, or is someone with you?",
+    "refusal": "I cannot continue this conversation. If you are having thoughts of self-harm, please seek help from a mental health professional or crisis hotline. Is there anything else I can help you with?",
+    "long_urdu": "Main aap ke saath hoon. " * 30 + "Kya aap abhi safe hain?",
+}
+
+# ===========================
+# MEASUREMENT
+# ===========================
+
+def _cold(detector):
+    """Run a detector without the per-turn keyword scan cache, as on a new message"""
+    def run(text):
+        scan_keywords.cache_clear()
+        matched_categories.cache_clear()
+        return detector(text)
+    return run
+
+def has_specific_plan(text):
+    """The interview agent's plan-keyword scan"""
+    return "specific_plan" in matched_categories(text)
+
+def measure(function, repeat=5, min_time=0.01):
+    """
+    Time a call, calibrating the loop count so one run takes at least min_time
+
+    The garbage collector is paused while timing and the fastest run is
+    kept, as timeit does, so noise from other processes mostly drops out.
+
+    Returns:
+        float: Best microseconds per call over `repeat` runs
+    """
+    def run(number):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        return time.perf_counter() - started
+
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        number = 1
+        while True:
+            elapsed = run(number)
+            if elapsed >= min_time or number >= 1_000_000:
+                break
+            number *= 10 if elapsed < min_time / 10 else 2
+        best = min([elapsed] + [run(number) for _ in range(repeat - 1)])
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return best / number * 1e6
+
+def calibration_workload():
+    """Fixed pure-Python work that every benchmark is compared against, making results comparable across machines and load"""
+    words = [str(number) * 3 for number in range(400)]
+    return len(" ".join(sorted(words, reverse=True)).lower().split("1"))
+
+def benchmarks():
+    """
+    Get every benchmark as name -> zero-argument callable
+
+    Names are stable so results can be compared with a stored baseline.
+    """
+    cases = {}
+    corpus = build_corpus()
+    detectors = {
+        "detect_suicidal_keywords": detect_suicidal_keywords,
+        "detect_mental_health_concerns": detect_mental_health_concerns,
+        "detect_referral_request": detect_referral_request,
+        "detect_language_preference": detect_language_preference,
+        "interview.specific_plan_scan": has_specific_plan,
+    }
+    for detector_name, detector in detectors.items():
+        cold = _cold(detector)
+        for message_name, message in corpus.items():
+            cases[f"{detector_name}[{message_name}]"] = lambda cold=cold, message=message: cold(message)
+
+    for reply_name, reply in REPLIES.items():
+        cases[f"interview.contains_refusal[{reply_name}]"] = lambda reply=reply: contains_refusal(reply)
+
+    for language in ("English", "Urdu/Hindi"):
+        cases[f"orchestrator.build_system_instructions[{language}]"] = lambda language=language: build_orchestrator_instructions(language, False, False)
+        cases[f"interview.build_system_instructions[{language},crisis,plan]"] = lambda language=language: build_interview_instructions(language, True, True)
+        cases[f"prompt_registry.system_message[{language}]"] = lambda language=language: PROMPT_REGISTRY.system_message("interview", language, True, False)
+
+    for language, message in (("English", corpus["english_medium"]), ("Urdu/Hindi", corpus["roman_urdu_medium"])):
+        plan = generate_safety_plan_content(message, [], {"language": language})
+        cases[f"format_safety_plan_html[{language}]"] = lambda plan=plan: format_safety_plan_html(plan)
+        cases[f"generate_pdf[{language}]"] = lambda plan=plan: generate_pdf(plan)
+    return cases
+
+def run_suite(cases, repeat):
+    """
+    Time every benchmark in this process
+
+    Returns:
+        dict: {name: {"us": microseconds per call, "relative": time per calibration workload}}
+    """
+    results = {}
+    for name, case in cases.items():
+        case()
+        # Timed next to each benchmark, so a machine-wide slowdown divides out of the comparison
+        calibration = measure(calibration_workload, repeat=3)
+        micros = measure(case, repeat=repeat)
+        results[name] = {"us": round(micros, 3), "relative": round(micros / calibration, 5)}
+    return results
+
+def run_suite_in_workers(processes, name_filter, repeat):
+    """
+    Run the suite in fresh interpreters and keep the median of each benchmark
+
+    Timings of one process are steady, but differ between processes by up
+    to a third (memory layout, hash seeds), so one run cannot be trusted
+    against a baseline.
+    """
+    runs = []
+    for _ in range(processes):
+        output = subprocess.run(
+            [sys.executable, "-m", "django", "bench_hotpaths", "--worker", "--filter", name_filter,
+             "--repeat", str(repeat), "--settings", settings.SETTINGS_MODULE],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        name: {
+            "us": round(statistics.median(run[name]["us"] for run in runs), 3),
+            "relative": round(statistics.median(run[name]["relative"] for run in runs), 5),
+        }
+        for name in runs[0]
+    }
+
+# ===========================
+# COMMAND
+# ===========================
+
+class Command(BaseCommand):
+    help = (
+        "Microbenchmark the CPU-side hot paths (keyword detection, refusal and plan scans, system prompt "
+        "assembly, safety plan HTML and PDF) over a fixed multilingual corpus and compare with a stored baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--baseline", default=str(settings.BASE_DIR / "bench_baseline.json"), help="Stored baseline results")
+        parser.add_argument("--save", action="store_true", help="Store this run as the new baseline")
+        parser.add_argument("--threshold", type=float, default=0.3,
+                            help="Fail when a benchmark is this share slower than the baseline, after scaling for machine speed")
+        parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this text")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--processes", type=int, default=3, help="Fresh interpreters to run the suite in; the median is kept")
+        parser.add_argument("--worker", action="store_true", help="Run the suite once and print the raw results (used by --processes)")
+        parser.add_argument("--json", metavar="PATH", help="Write the results as JSON")
+
+    def handle(self, *args, **options):
+        cases = {name: case for name, case in benchmarks().items() if options["filter"] in name}
+        if not cases:
+            raise CommandError(f"No benchmark matches {options['filter']!r}")
+
+        if options["worker"]:
+            self.stdout.write(json.dumps(run_suite(cases, options["repeat"])))
+            return
+
+        baseline = self._load_baseline(options["baseline"])
+        previous_results = (baseline or {}).get("results", {})
+        self.stdout.write(f"Matcher engine: {KEYWORD_MATCHER.engine}, Python {platform.python_version()}, {options['processes']} processes")
+        if options["processes"] > 1:
+            results = run_suite_in_workers(options["processes"], options["filter"], options["repeat"])
+        else:
+            results = run_suite(cases, options["repeat"])
+
+        regressions = []
+        self.stdout.write(f"{'benchmark':<62} | {'us/call':>10} | {'baseline':>10} | {'change':>7}")
+        for name, result in results.items():
+            previous = previous_results.get(name)
+            if previous:
+                change = result["relative"] / previous["relative"] - 1
+                flag = "  <-- slower" if change > options["threshold"] else ""
+                if flag:
+                    regressions.append(f"{name} {change:+.0%}")
+                self.stdout.write(f"{name:<62} | {result['us']:>10.2f} | {previous['us']:>10.2f} | {change:>+7.0%}{flag}")
+            else:
+                self.stdout.write(f"{name:<62} | {result['us']:>10.2f} | {'-':>10} | {'':>7}")
+
+        report = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "matcher_engine": KEYWORD_MATCHER.engine,
+            "results": results,
+        }
+        if options["json"]:
+            with open(options["json"], "w", encoding="utf-8") as output:
+                json.dump(report, output, indent=2, ensure_ascii=False)
+        if options["save"]:
+            if baseline and options["filter"]:
+                # Keep the stored results of benchmarks this run skipped
+                report["results"] = {**previous_results, **results}
+            with open(options["baseline"], "w", encoding="utf-8") as output:
+                json.dump(report, output, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Baseline saved to {options['baseline']}")
+        elif baseline is None:
+            self.stdout.write(f"No baseline at {options['baseline']} - run with --save to store one")
+        elif regressions:
+            raise CommandError(f"{len(regressions)} benchmarks regressed by more than {options['threshold']:.0%}: " + "; ".join(regressions))
+
+    def _load_baseline(self, path):
+        try:
+            with open(path, encoding="utf-8") as baseline_file:
+                baseline = json.load(baseline_file)
+        except FileNotFoundError:
+            return None
+        if baseline.get("matcher_engine") != KEYWORD_MATCHER.engine or baseline.get("python") != platform.python_version():
+            self.stdout.write(
+                f"⚠️ Baseline was recorded with Python {baseline.get('python')} and the {baseline.get('matcher_engine')} "
+                "matcher; timings may not be comparable"
+            )
+        return baseline
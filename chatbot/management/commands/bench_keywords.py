@@ -0,0 +1,85 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from chatbot.agent_utils import detect_language_preference, detect_mental_health_concerns, detect_referral_request, detect_suicidal_keywords
+from chatbot.keywords import KEYWORD_MATCHER, KEYWORD_TABLE, KeywordMatcher, matched_categories, scan_keywords
+
+SHORT_MESSAGES = {
+    "english": "I've been feeling really low lately and I can't sleep at night",
+    "roman_urdu": "mujhe bohat pareshani ho rahi hai, kuch samajh nahi aa raha",
+    "urdu_script": "میں بہت پریشان ہوں اور مجھے نیند نہیں آتی",
+    "crisis": "I feel hopeless and I want to end my life, I might jump from the roof",
+}
+
+PASTED_PARAGRAPH = (
+    "Today was a long day at the office and I kept thinking about everything that happened last week. "
+    "My manager asked for the report again, the train was late, and by the evening I was exhausted. "
+)
+
+# Baseline: the per-keyword loops the detectors used before the compiled matcher
+def legacy_detectors(text):
+    text_lower = text.lower()
+    suicidal = any(keyword in text_lower for keyword in KEYWORD_TABLE["suicidal"].keywords)
+    concern = any(
+        keyword in text_lower
+        for category in ("suicidal", "concern_urdu", "hopelessness", "crisis")
+        for keyword in KEYWORD_TABLE[category].keywords
+    )
+    referral = any(indicator in text_lower for indicator in KEYWORD_TABLE["referral"].keywords)
+    language = None
+    for category in ("language_urdu_hindi", "language_spanish", "language_french", "language_arabic", "language_english"):
+        if any(word in text_lower for word in KEYWORD_TABLE[category].keywords):
+            language = category
+            break
+    if language is None and any(indicator in text for indicator in KEYWORD_TABLE["urdu_hindi_text"].keywords):
+        language = "urdu_hindi_text"
+    plan = any(keyword in text_lower for keyword in KEYWORD_TABLE["specific_plan"].keywords)
+    refusal = any(pattern in text_lower for pattern in KEYWORD_TABLE["refusal"].keywords)
+    return suicidal, concern, referral, language, plan, refusal
+
+def compiled_detectors(text):
+    categories = matched_categories(text)
+    return (
+        detect_suicidal_keywords(text),
+        detect_mental_health_concerns(text),
+        detect_referral_request(text),
+        detect_language_preference(text),
+        "specific_plan" in categories,
+        "refusal" in categories,
+    )
+
+def compiled_detectors_cold(text):
+    scan_keywords.cache_clear()
+    matched_categories.cache_clear()
+    return compiled_detectors(text)
+
+class Command(BaseCommand):
+    help = "Compare the compiled keyword matcher with the previous per-keyword loops"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--number", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        corpus = dict(SHORT_MESSAGES)
+        corpus["pasted_2kb"] = PASTED_PARAGRAPH * 11
+        corpus["pasted_8kb"] = PASTED_PARAGRAPH * 44
+        corpus["pasted_8kb_crisis"] = PASTED_PARAGRAPH * 22 + SHORT_MESSAGES["crisis"] + " " + PASTED_PARAGRAPH * 22
+
+        regex_matcher = KeywordMatcher(KEYWORD_TABLE, use_automaton=False)
+        number = options["number"]
+        self.stdout.write(f"Matcher engine: {KEYWORD_MATCHER.engine}")
+        self.stdout.write(f"{'message':<18} {'bytes':>6} | {'legacy us':>10} | {'compiled us':>11} | {'cached us':>9} | {'regex scan us':>13}")
+        for name, text in corpus.items():
+            legacy = timeit.timeit(lambda: legacy_detectors(text), number=number) / number * 1e6
+            cold = timeit.timeit(lambda: compiled_detectors_cold(text), number=number) / number * 1e6
+            compiled_detectors(text)
+            cached = timeit.timeit(lambda: compiled_detectors(text), number=number) / number * 1e6
+            regex = timeit.timeit(lambda: regex_matcher.categories(text), number=number) / number * 1e6
+            self.stdout.write(
+                f"{name:<18} {len(text.encode()):>6} | {legacy:>10.1f} | {cold:>11.1f} | {cached:>9.1f} | {regex:>13.1f}"
+            )
+        self.stdout.write(
+            "All detectors per message: legacy loops, one compiled scan (cold), memoized scan reused in the turn, "
+            "and a cold scan with the regex fallback used when pyahocorasick is not installed"
+        )
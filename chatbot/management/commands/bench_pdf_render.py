@@ -0,0 +1,95 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatbot.pdf_renderer import PDFRenderService, build_styles, register_fonts, render_pdf, shaping_available
+from chatbot.safety_plan_agent import generate_safety_plan_content
+
+def sample_plans(count):
+    """
+    Get `count` plans alternating English and Urdu, each with distinct text so no layout is reused
+
+    Returns:
+        list: Plan content dicts
+    """
+    plans = []
+    for index in range(count):
+        language = "Urdu/Hindi" if index % 2 else "English"
+        plan = generate_safety_plan_content("I feel hopeless", [], {"language": language})
+        plan["sections"]["emergency_contacts"] = [f"Trusted contact #{index}: 0300-{index:07d}"]
+        plans.append(plan)
+    return plans
+
+def throughput(function, plans):
+    """
+    Time rendering every plan
+
+    Returns:
+        dict: seconds, PDFs per second and mean PDF size
+    """
+    started = time.perf_counter()
+    pdfs = function(plans)
+    elapsed = time.perf_counter() - started
+    return {
+        "seconds": round(elapsed, 3),
+        "pdfs_per_second": round(len(plans) / elapsed, 1),
+        "mean_bytes": sum(len(pdf) for pdf in pdfs) // len(pdfs),
+    }
+
+class Command(BaseCommand):
+    help = (
+        "Measure safety plan PDF throughput: styles rebuilt per PDF (the old path), prebuilt styles in-process, "
+        "the process pool under concurrent requests, and pool batch rendering"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--plans", type=int, default=40)
+        parser.add_argument("--workers", type=int, default=None, help="Pool size (default: settings.CHATBOT_PDF_WORKERS, at least 1)")
+        parser.add_argument("--threads", type=int, default=8, help="Concurrent request threads for the pool case")
+        parser.add_argument("--json", metavar="PATH", help="Write the results as JSON")
+
+    def handle(self, *args, **options):
+        plans = sample_plans(options["plans"])
+        font_path, bold_font_path = settings.CHATBOT_PDF_FONT, settings.CHATBOT_PDF_FONT_BOLD
+        workers = max(1, options["workers"] if options["workers"] is not None else settings.CHATBOT_PDF_WORKERS)
+        font = register_fonts(font_path, bold_font_path)[0]
+        self.stdout.write(f"{len(plans)} plans, font {font}, shaping {'on' if shaping_available() else 'off'}, {workers} pool workers")
+
+        def rebuilt_styles(batch):
+            pdfs = []
+            for plan in batch:
+                build_styles.cache_clear()
+                pdfs.append(render_pdf(plan, font_path, bold_font_path))
+            return pdfs
+
+        def prebuilt_styles(batch):
+            return [render_pdf(plan, font_path, bold_font_path) for plan in batch]
+
+        service = PDFRenderService(workers=workers, max_pending=workers * 2, font_path=font_path, bold_font_path=bold_font_path)
+        results = {}
+        try:
+            service.warm_up()
+            prebuilt_styles(plans[:2])
+
+            results["inline_rebuilt_styles"] = throughput(rebuilt_styles, plans)
+            results["inline_prebuilt_styles"] = throughput(prebuilt_styles, plans)
+
+            def concurrent_requests(batch):
+                with ThreadPoolExecutor(max_workers=options["threads"]) as threads:
+                    return list(threads.map(service.render, batch))
+
+            results["pool_concurrent_requests"] = throughput(concurrent_requests, plans)
+            results["pool_batch"] = throughput(service.render_batch, plans)
+        finally:
+            service.shutdown()
+
+        self.stdout.write(f"{'case':<26} | {'seconds':>8} | {'PDFs/s':>8} | {'bytes':>8}")
+        for name, result in results.items():
+            self.stdout.write(f"{name:<26} | {result['seconds']:>8.3f} | {result['pdfs_per_second']:>8.1f} | {result['mean_bytes']:>8}")
+
+        if options["json"]:
+            with open(options["json"], "w", encoding="utf-8") as output:
+                json.dump({"plans": len(plans), "workers": workers, "font": font, "results": results}, output, indent=2)
@@ -0,0 +1,96 @@
+import random
+import time
+
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from chatbot.agent_utils import get_user_session, save_user_session
+from chatbot.conversation_store import MemoryConversationStore, get_conversation_store, set_conversation_store
+from chatbot.safety_plan_agent import format_safety_plan_html, generate_safety_plan_content
+
+USER_TURN = "I haven't been sleeping well and everything at work feels overwhelming lately, I don't know what to do."
+ASSISTANT_TURN = (
+    "I'm here with you. It sounds like you've been carrying a lot. "
+    "Can you tell me when you first noticed the sleep problems?\n\n"
+    "(LANGUAGE-AWARE RISK ASSESSMENT: MODERATE)\nRisk Level: MODERATE\n"
+    "Next Step: Continue supportive conversation, monitor for escalation"
+)
+
+WORDS = "sleep work family tired worried alone friends exams money tonight morning panic heart chest breathing talk help".split()
+
+def _vary(text, rng):
+    """Append varied words so turns don't compress to nothing in the signed cookie"""
+    return text + " " + " ".join(rng.choice(WORDS) for _ in range(30))
+
+class Command(BaseCommand):
+    help = "Measure session cookie header bytes per turn: full history in the cookie vs. the conversation store"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--turns", type=int, default=40)
+
+    def handle(self, *args, **options):
+        plan = generate_safety_plan_content(USER_TURN, [], {"language": "English"})
+        assistant_turn = ASSISTANT_TURN + "<br/><br/>" + format_safety_plan_html(plan)
+
+        rng = random.Random(0)
+
+        def legacy_view(request):
+            # Previous behaviour: the whole conversation lives in the signed cookie
+            data = request.session.get("chatbot_data") or {"current_agent": "interview", "conversation_history": []}
+            data["conversation_history"] += [
+                {"role": "user", "content": _vary(USER_TURN, rng)},
+                {"role": "assistant", "content": _vary(assistant_turn, rng)},
+            ]
+            request.session["chatbot_data"] = data
+            return HttpResponse()
+
+        def store_view(request):
+            session_data = get_user_session(request)
+            session_data["current_agent"] = "interview"
+            session_data["conversation_history"] += [
+                {"role": "user", "content": _vary(USER_TURN, rng)},
+                {"role": "assistant", "content": _vary(assistant_turn, rng)},
+            ]
+            save_user_session(request, session_data)
+            return HttpResponse()
+
+        previous_store = get_conversation_store()
+        set_conversation_store(MemoryConversationStore())
+        try:
+            legacy = self._run(legacy_view, options["turns"])
+            stored = self._run(store_view, options["turns"])
+        finally:
+            set_conversation_store(previous_store)
+
+        self.stdout.write(f"{'turn':>5} | {'cookie: req/resp bytes':>24} | {'store: req/resp bytes':>24} | {'store ms':>8}")
+        for turn in range(options["turns"]):
+            if turn + 1 in (1, 2, 5, 10, 20, 40) or turn + 1 == options["turns"]:
+                legacy_req, legacy_resp, _ = legacy[turn]
+                store_req, store_resp, elapsed = stored[turn]
+                self.stdout.write(
+                    f"{turn + 1:>5} | {legacy_req:>11} / {legacy_resp:>10} | {store_req:>11} / {store_resp:>10} | {elapsed * 1000:>8.3f}"
+                )
+
+    def _run(self, view, turns):
+        """Drive `turns` requests through SessionMiddleware, carrying the cookie forward"""
+        factory = RequestFactory()
+        middleware = SessionMiddleware(view)
+        cookie = None
+        results = []
+        for _ in range(turns):
+            request = factory.post("/ask/")
+            if cookie:
+                request.COOKIES[settings.SESSION_COOKIE_NAME] = cookie
+            request_bytes = len(f"Cookie: {settings.SESSION_COOKIE_NAME}={cookie}") if cookie else 0
+            started = time.perf_counter()
+            response = middleware(request)
+            elapsed = time.perf_counter() - started
+            morsel = response.cookies.get(settings.SESSION_COOKIE_NAME)
+            if morsel is not None:
+                cookie = morsel.value
+            response_bytes = len(morsel.output()) if morsel is not None else 0
+            results.append((request_bytes, response_bytes, elapsed))
+        return results
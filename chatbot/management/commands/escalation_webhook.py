@@ -0,0 +1,59 @@
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = (
+        "Run a local stand-in for the escalation webhook: logs every delivery it receives and can fail "
+        "some on purpose, to exercise the queue's retries end to end "
+        "(point CHATBOT_ESCALATION_WEBHOOK_URL at http://127.0.0.1:<port>/ and add "
+        "chatbot.escalation_queue.WebhookSink to CHATBOT_ESCALATION_SINKS)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--fail-first", type=int, default=0, help="Answer the first N deliveries with 503")
+        parser.add_argument("--failure-rate", type=float, default=0.0, help="Answer this fraction of later deliveries with 503")
+        parser.add_argument("--log", metavar="PATH", help="Append each accepted delivery to this file as a JSON line")
+
+    def handle(self, *args, **options):
+        received = {"count": 0}
+        lock = threading.Lock()
+        stdout = self.stdout
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with lock:
+                    received["count"] += 1
+                    number = received["count"]
+                fail = number <= options["fail_first"] or random.random() < options["failure_rate"]
+                self.send_response(503 if fail else 200)
+                self.end_headers()
+                try:
+                    escalation = json.loads(body)
+                except ValueError:
+                    escalation = {"raw": body.decode("utf-8", "replace")}
+                outcome = "rejected (503)" if fail else "accepted"
+                stdout.write(
+                    f"#{number} {outcome}: {escalation.get('priority')} for {escalation.get('conversation_id')}"
+                    f" via {escalation.get('sink')}, attempt {escalation.get('attempt')}, {escalation.get('occurrences')} turn(s)"
+                )
+                if not fail and options["log"]:
+                    with lock, open(options["log"], "a", encoding="utf-8") as log:
+                        log.write(json.dumps(escalation) + "\n")
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", options["port"]), Handler)
+        self.stdout.write(f"Escalation webhook stand-in listening on http://127.0.0.1:{options['port']}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatbot.escalation_queue import EscalationQueue
+
+class Command(BaseCommand):
+    help = (
+        "Deliver queued human escalations in this process (for deployments with CHATBOT_ESCALATION_WORKERS=0, "
+        "or to drain the queue once with --once)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=2, help="Delivery threads")
+        parser.add_argument("--once", action="store_true", help="Deliver what is due now, report the queue and exit")
+
+    def handle(self, *args, **options):
+        queue = EscalationQueue()
+        self.stdout.write(f"Escalation queue {queue.path}, sinks: {', '.join(queue.sinks) or 'none'}")
+        if options["once"]:
+            attempts = queue.drain()
+            self.stdout.write(f"{attempts} delivery attempt(s); tasks by status: {queue.counts()}")
+            return
+
+        queue.start_workers(max(1, options["threads"]))
+        try:
+            while True:
+                time.sleep(60)
+                self.stdout.write(f"Tasks by status: {queue.counts()}")
+        except KeyboardInterrupt:
+            queue.stop()
@@ -0,0 +1,354 @@
+import base64
+import io
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from PIL import Image
+
+from chatbot.agent_utils import get_llm_backend, set_llm_backend
+from chatbot.conversation_store import MemoryConversationStore, get_conversation_store, set_conversation_store
+from chatbot.llm_backends import StubBackend
+
+# ===========================
+# SCRIPTED CONVERSATIONS
+# ===========================
+
+# Each step is (message, attach an image)
+SCENARIOS = {
+    # Small talk that stays with the orchestrator
+    "chitchat": [
+        ("Hi there", False),
+        ("How are you today?", False),
+        ("I had a long day at work and I'm a bit tired", False),
+        ("Any tips to relax in the evening?", False),
+        ("Thanks, that helps", False),
+    ],
+    # A concern keyword marks the referral, the user accepts it and the interview starts
+    "referral": [
+        ("Hello", False),
+        ("I've been feeling hopeless for weeks and I can't sleep", False),
+        ("Yes please, connect me with the specialist", False),
+        ("It started after I lost my job in the spring", False),
+        ("Mostly at night, my thoughts keep racing", False),
+    ],
+    # Referral followed by a long interview with photos attached along the way
+    "interview": [
+        ("Hello", False),
+        ("I feel worthless and empty most days", False),
+        ("Yes, I need help", False),
+        ("It has been going on for about three months", False),
+        ("This is my room, I barely leave it anymore", True),
+        ("I sleep four or five hours, sometimes less", False),
+        ("I stopped eating breakfast and lunch", False),
+        ("My sister calls me sometimes but I don't answer", False),
+        ("This is what my desk looks like, I can't focus on anything", True),
+        ("Sometimes I think everyone would be better off without me", False),
+        ("No, I don't have a plan, it's just a thought", False),
+        ("I used to like painting, here is one of my old ones", True),
+        ("My sister and my best friend from school", False),
+        ("I could call my sister tonight", False),
+        ("Mujhe kabhi kabhi bohat akela mehsoos hota hai", False),
+        ("Yes I think I can keep myself safe tonight", False),
+        ("Thank you for listening", False),
+    ],
+}
+
+def _image_data_url(size, seed):
+    """Build a noisy PNG data URL, so it does not compress to nothing"""
+    rng = random.Random(seed)
+    image = Image.frombytes("RGB", (size, size), bytes(rng.getrandbits(8) for _ in range(size * size * 3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+def _quantiles(values):
+    """Get p50/p95/p99 of a list of seconds, in milliseconds"""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    if len(values) == 1:
+        only = round(values[0] * 1000, 2)
+        return {"p50": only, "p95": only, "p99": only}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": round(cuts[49] * 1000, 2), "p95": round(cuts[94] * 1000, 2), "p99": round(cuts[98] * 1000, 2)}
+
+# ===========================
+# CLIENTS
+# ===========================
+
+class _DjangoClient:
+    """Drives the views in-process through the Django test client"""
+
+    def __init__(self):
+        self.client = Client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, self._cookie_bytes(response)
+
+    def post(self, path, payload):
+        response = self.client.post(path, json.dumps(payload), content_type="application/json")
+        return response.status_code, self._cookie_bytes(response)
+
+    @staticmethod
+    def _cookie_bytes(response):
+        morsel = response.cookies.get(settings.SESSION_COOKIE_NAME)
+        return len(morsel.output()) if morsel is not None else 0
+
+    def conversation_id(self):
+        return self.client.session.get("chatbot_conversation_id")
+
+class _LiveClient:
+    """Drives a running server over HTTP"""
+
+    def __init__(self, base_url):
+        import httpx
+        self.client = httpx.Client(base_url=base_url, timeout=120)
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, self._cookie_bytes(response)
+
+    def post(self, path, payload):
+        response = self.client.post(path, json=payload)
+        return response.status_code, self._cookie_bytes(response)
+
+    @staticmethod
+    def _cookie_bytes(response):
+        return sum(len(value) for value in response.headers.get_list("set-cookie"))
+
+    def conversation_id(self):
+        return None
+
+# ===========================
+# LOAD TEST
+# ===========================
+
+class Command(BaseCommand):
+    help = (
+        "Load-test chatbot_view and ask_gemini_view with concurrent scripted conversations "
+        "against a stub LLM and report latency percentiles, throughput, session sizes and CPU per turn"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conversations", type=int, default=30, help="Scripted conversations to run")
+        parser.add_argument("--concurrency", type=int, default=8, help="Conversations running at the same time")
+        parser.add_argument("--scenarios", default="chitchat,referral,interview", help=f"Comma-separated, from: {', '.join(SCENARIOS)}")
+        parser.add_argument("--live", metavar="BASE_URL", help="Drive a running server (started with the stub backend) instead of the test client")
+        parser.add_argument("--ttft", type=float, default=None, help="Stub time to first token (default: CHATBOT_STUB_TTFT)")
+        parser.add_argument("--token-delay", type=float, default=None, help="Stub delay between tokens (default: CHATBOT_STUB_TOKEN_DELAY)")
+        parser.add_argument("--failure-rate", type=float, default=None, help="Stub share of failing model calls")
+        parser.add_argument("--image-size", type=int, default=160, help="Side in pixels of attached test images")
+        parser.add_argument("--memory-store", action="store_true", help="Use an in-memory conversation store instead of the configured one")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", metavar="PATH", help="Write the results as JSON")
+        parser.add_argument("--baseline", metavar="PATH", help="Results JSON of an earlier run to compare against")
+        parser.add_argument("--max-regression", type=float, default=0.2,
+                            help="Fail when p95 latency or CPU per turn grows, or throughput drops, by more than this share of the baseline")
+        parser.add_argument("--max-p95-ms", type=float, default=None, help="Fail when the /ask/ p95 latency exceeds this")
+        parser.add_argument("--max-error-rate", type=float, default=0.0, help="Fail when a larger share of requests does not return 200")
+
+    def handle(self, *args, **options):
+        scenario_names = [name.strip() for name in options["scenarios"].split(",") if name.strip()]
+        unknown = [name for name in scenario_names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(unknown)}")
+        image = _image_data_url(options["image_size"], options["seed"])
+        plan = [scenario_names[index % len(scenario_names)] for index in range(options["conversations"])]
+
+        live = options["live"]
+        previous_backend = previous_store = None
+        if not live:
+            previous_backend = get_llm_backend()
+            set_llm_backend(StubBackend(
+                ttft=options["ttft"], token_delay=options["token_delay"],
+                failure_rate=options["failure_rate"], seed=options["seed"],
+            ))
+            if options["memory_store"]:
+                previous_store = get_conversation_store()
+                set_conversation_store(MemoryConversationStore())
+
+        samples = []
+        samples_lock = threading.Lock()
+
+        def run_conversation(scenario):
+            client = _LiveClient(live) if live else _DjangoClient()
+            records = []
+
+            def timed(endpoint, call, *call_args):
+                cpu_started = time.thread_time()
+                started = time.perf_counter()
+                try:
+                    status, cookie_bytes = call(*call_args)
+                except Exception as e:
+                    print(f"⚠️ Load test request failed: {e}")
+                    status, cookie_bytes = None, 0
+                records.append({
+                    "scenario": scenario,
+                    "endpoint": endpoint,
+                    "latency": time.perf_counter() - started,
+                    "cpu": None if live else time.thread_time() - cpu_started,
+                    "status": status,
+                    "cookie_bytes": cookie_bytes,
+                })
+
+            timed("chatbot_view", client.get, "/")
+            for message, attach_image in SCENARIOS[scenario]:
+                payload = {"message": message}
+                if attach_image:
+                    payload["image"] = image
+                timed("ask", client.post, "/ask/", payload)
+                records[-1]["request_bytes"] = len(json.dumps(payload))
+                records[-1]["store_bytes"] = self._store_bytes(client.conversation_id())
+            with samples_lock:
+                samples.extend(records)
+
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+                list(pool.map(run_conversation, plan))
+        finally:
+            if previous_backend is not None:
+                set_llm_backend(previous_backend)
+            if previous_store is not None:
+                set_conversation_store(previous_store)
+        elapsed = time.perf_counter() - started
+        process_cpu = time.process_time() - cpu_started
+
+        results = self._summarize(samples, elapsed, process_cpu, options, plan)
+        self._report(results)
+        if options["json"]:
+            with open(options["json"], "w", encoding="utf-8") as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f"Results written to {options['json']}")
+
+        failures = self._regressions(results, options)
+        if failures:
+            raise CommandError("Performance regression: " + "; ".join(failures))
+
+    @staticmethod
+    def _store_bytes(conversation_id):
+        """Get the serialized size of a conversation in the store"""
+        if conversation_id is None:
+            return None
+        loaded = get_conversation_store().load(conversation_id)
+        if loaded is None:
+            return None
+        state, history = loaded
+        return len(json.dumps(state)) + len(json.dumps(history))
+
+    @staticmethod
+    def _summarize(samples, elapsed, process_cpu, options, plan):
+        def stats(rows):
+            latencies = [row["latency"] for row in rows]
+            cpu = [row["cpu"] for row in rows if row["cpu"] is not None]
+            return {
+                "requests": len(rows),
+                "errors": sum(1 for row in rows if row["status"] != 200),
+                "latency_ms": _quantiles(latencies),
+                "mean_ms": round(statistics.mean(latencies) * 1000, 2) if latencies else None,
+                "cpu_ms_per_request": round(statistics.mean(cpu) * 1000, 3) if cpu else None,
+            }
+
+        by_endpoint = defaultdict(list)
+        by_scenario = defaultdict(list)
+        for row in samples:
+            by_endpoint[row["endpoint"]].append(row)
+            if row["endpoint"] == "ask":
+                by_scenario[row["scenario"]].append(row)
+
+        turns = by_endpoint["ask"]
+        cookie_sizes = [row["cookie_bytes"] for row in samples if row["cookie_bytes"]]
+        store_sizes = [row["store_bytes"] for row in turns if row.get("store_bytes")]
+        request_sizes = [row["request_bytes"] for row in turns]
+        return {
+            "config": {
+                "conversations": len(plan),
+                "concurrency": options["concurrency"],
+                "scenarios": sorted(set(plan)),
+                "mode": "live" if options["live"] else "test-client",
+                "ttft": settings.CHATBOT_STUB_TTFT if options["ttft"] is None else options["ttft"],
+                "token_delay": settings.CHATBOT_STUB_TOKEN_DELAY if options["token_delay"] is None else options["token_delay"],
+                "cpu_count": os.cpu_count(),
+            },
+            "summary": {
+                "elapsed_s": round(elapsed, 3),
+                "requests": len(samples),
+                "turns": len(turns),
+                "requests_per_s": round(len(samples) / elapsed, 2) if elapsed else None,
+                "turns_per_s": round(len(turns) / elapsed, 2) if elapsed else None,
+                "errors": sum(1 for row in samples if row["status"] != 200),
+                "process_cpu_ms_per_turn": round(process_cpu / len(turns) * 1000, 3) if turns and not options["live"] else None,
+            },
+            "endpoints": {endpoint: stats(rows) for endpoint, rows in by_endpoint.items()},
+            "scenarios": {scenario: stats(rows) for scenario, rows in by_scenario.items()},
+            "payload_bytes": {
+                "request_max": max(request_sizes) if request_sizes else None,
+                "session_cookie_max": max(cookie_sizes) if cookie_sizes else None,
+                "store_p50": int(statistics.median(store_sizes)) if store_sizes else None,
+                "store_max": max(store_sizes) if store_sizes else None,
+            },
+        }
+
+    def _report(self, results):
+        summary = results["summary"]
+        config = results["config"]
+        self.stdout.write(
+            f"{config['conversations']} conversations x {config['concurrency']} concurrent ({config['mode']}): "
+            f"{summary['requests']} requests in {summary['elapsed_s']}s, "
+            f"{summary['requests_per_s']} req/s, {summary['turns_per_s']} turns/s, {summary['errors']} errors"
+        )
+        self.stdout.write(f"{'':>14} | {'requests':>8} | {'p50 ms':>9} | {'p95 ms':>9} | {'p99 ms':>9} | {'cpu ms/req':>10}")
+        for group in ("endpoints", "scenarios"):
+            for name, stats in sorted(results[group].items()):
+                latency = stats["latency_ms"]
+                self.stdout.write(
+                    f"{name:>14} | {stats['requests']:>8} | {latency['p50'] or 0:>9.1f} | {latency['p95'] or 0:>9.1f} "
+                    f"| {latency['p99'] or 0:>9.1f} | {stats['cpu_ms_per_request'] if stats['cpu_ms_per_request'] is not None else '-':>10}"
+                )
+        payload = results["payload_bytes"]
+        self.stdout.write(
+            f"Payload bytes: largest request {payload['request_max']}, largest session cookie {payload['session_cookie_max']}, "
+            f"stored conversation p50 {payload['store_p50']} / max {payload['store_max']}"
+        )
+        if summary["process_cpu_ms_per_turn"] is not None:
+            self.stdout.write(f"Process CPU per turn: {summary['process_cpu_ms_per_turn']} ms")
+
+    @staticmethod
+    def _regressions(results, options):
+        """Check the results against the absolute limit and the baseline run"""
+        failures = []
+        ask = results["endpoints"].get("ask", {})
+        p95 = (ask.get("latency_ms") or {}).get("p95")
+        if options["max_p95_ms"] is not None and p95 is not None and p95 > options["max_p95_ms"]:
+            failures.append(f"/ask/ p95 {p95:.1f} ms is over the {options['max_p95_ms']:.1f} ms limit")
+        summary = results["summary"]
+        if summary["requests"] and summary["errors"] / summary["requests"] > options["max_error_rate"]:
+            failures.append(f"{summary['errors']} of {summary['requests']} requests failed")
+
+        if not options["baseline"]:
+            return failures
+        with open(options["baseline"], encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        allowed = 1 + options["max_regression"]
+        checks = [
+            ("/ask/ p95 ms", p95, ((baseline["endpoints"].get("ask") or {}).get("latency_ms") or {}).get("p95"), True),
+            ("/ask/ CPU ms per request", ask.get("cpu_ms_per_request"), (baseline["endpoints"].get("ask") or {}).get("cpu_ms_per_request"), True),
+            ("requests per second", summary["requests_per_s"], baseline["summary"].get("requests_per_s"), False),
+        ]
+        for label, current, previous, higher_is_worse in checks:
+            if current is None or not previous:
+                continue
+            regressed = current > previous * allowed if higher_is_worse else current < previous / allowed
+            if regressed:
+                failures.append(f"{label} {current} vs baseline {previous}")
+        return failures
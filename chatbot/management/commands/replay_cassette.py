@@ -0,0 +1,78 @@
+import json
+import statistics
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from chatbot.agent_utils import get_llm_backend, set_llm_backend
+from chatbot.conversation_store import MemoryConversationStore, get_conversation_store, set_conversation_store
+from chatbot.llm_cassette import ReplayBackend
+
+def recorded_conversations(turns):
+    """
+    Rebuild the user side of the recorded conversations from a cassette's turn records
+
+    Returns:
+        list: One list of user messages per conversation, in turn order
+    """
+    conversations = defaultdict(dict)
+    for record in turns:
+        conversations[record["conversation"]].setdefault(record["turn"], record["user_message"])
+    return [[messages[turn] for turn in sorted(messages)] for messages in conversations.values()]
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+class Command(BaseCommand):
+    help = "Replay the conversations of an LLM cassette through the chat view and report per-turn latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument("cassette", nargs="?", help="Cassette path (default: settings.CHATBOT_LLM_CASSETTE_PATH)")
+        parser.add_argument("--speed", type=float, default=1.0, help="Timing scale: 1 = as recorded, 2 = twice as fast, 0 = no delays")
+        parser.add_argument("--strict", action="store_true", help="Fail turns whose prompts are not in the cassette")
+        parser.add_argument("--limit", type=int, default=None, help="Replay at most this many conversations")
+        parser.add_argument("--url", default="/ask/")
+
+    def handle(self, *args, **options):
+        try:
+            backend = ReplayBackend(options["cassette"], speed=options["speed"], strict=options["strict"])
+        except FileNotFoundError as e:
+            raise CommandError(f"Cassette not found: {e.filename}")
+        conversations = recorded_conversations(backend.turns)[:options["limit"]]
+        if not conversations:
+            raise CommandError("The cassette has no chat turns to replay (record with CHATBOT_LLM_CASSETTE=record)")
+
+        previous_backend = get_llm_backend()
+        previous_store = get_conversation_store()
+        set_llm_backend(backend)
+        set_conversation_store(MemoryConversationStore())
+        latencies = []
+        response_bytes = []
+        errors = 0
+        started = time.perf_counter()
+        try:
+            for messages in conversations:
+                client = Client()
+                client.get("/")
+                for message in messages:
+                    turn_started = time.perf_counter()
+                    response = client.post(options["url"], json.dumps({"message": message}), content_type="application/json")
+                    latencies.append(time.perf_counter() - turn_started)
+                    response_bytes.append(len(response.content))
+                    if response.status_code != 200:
+                        errors += 1
+        finally:
+            set_llm_backend(previous_backend)
+            set_conversation_store(previous_store)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(f"Replayed {len(conversations)} conversations, {len(latencies)} turns in {elapsed:.2f}s (speed {options['speed']})")
+        self.stdout.write(f"Prompt matches: {backend.hits} exact / {backend.loose_hits} loose / {backend.misses} miss, {errors} failed turns")
+        self.stdout.write(
+            f"Turn latency ms: p50 {_percentile(latencies, 50) * 1000:.1f} | p95 {_percentile(latencies, 95) * 1000:.1f} "
+            f"| max {max(latencies) * 1000:.1f} | mean {statistics.mean(latencies) * 1000:.1f}"
+        )
+        self.stdout.write(f"Response bytes: p50 {_percentile(response_bytes, 50)} | max {max(response_bytes)}")
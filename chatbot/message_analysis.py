@@ -0,0 +1,105 @@
+# message_analysis.py
+# Per-turn analysis of the user message, computed once and shared by all agents
+
+from .agent_utils import detect_language_preference, detect_mental_health_concerns, detect_referral_request, detect_suicidal_keywords
+from .keywords import matched_categories
+
+# How many recent history messages to look at when the language is not known yet
+LANGUAGE_HISTORY_WINDOW = 5
+
+class MessageAnalysis:
+    """
+    Immutable keyword analysis of one user turn
+
+    `detected_language` comes from the message alone; `language` is the
+    conversation language resolved from the session, the message and recent
+    history. The per-message fields are memoized on the stored history entry
+    (see to_record) so old turns are never re-scanned.
+    """
+
+    __slots__ = ("language", "detected_language", "is_suicidal", "has_concern", "has_specific_plan", "wants_referral")
+
+    def __init__(self, language=None, detected_language=None, is_suicidal=False, has_concern=False,
+                 has_specific_plan=False, wants_referral=False):
+        object.__setattr__(self, "language", language)
+        object.__setattr__(self, "detected_language", detected_language)
+        object.__setattr__(self, "is_suicidal", is_suicidal)
+        object.__setattr__(self, "has_concern", has_concern)
+        object.__setattr__(self, "has_specific_plan", has_specific_plan)
+        object.__setattr__(self, "wants_referral", wants_referral)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MessageAnalysis is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("MessageAnalysis is immutable")
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"MessageAnalysis({fields})"
+
+    def to_record(self):
+        """Get the per-message fields for storing on the history entry"""
+        return {
+            "language": self.detected_language,
+            "suicidal": self.is_suicidal,
+            "concern": self.has_concern,
+            "plan": self.has_specific_plan,
+            "referral": self.wants_referral,
+        }
+
+def _message_analysis(message):
+    """Get the memoized analysis record of a history message, computing it for turns stored without one"""
+    record = message.get("analysis")
+    if record is None:
+        record = analyze_message(message.get("content", "")).to_record()
+    return record
+
+def is_crisis_message(message):
+    """Check whether a stored user message raised any risk flag (suicidal, concern or specific plan)"""
+    if message.get("role") != "user":
+        return False
+    record = _message_analysis(message)
+    return record["suicidal"] or record["concern"] or record["plan"]
+
+def history_language(conversation_history, window=LANGUAGE_HISTORY_WINDOW):
+    """Get the most recent language detected in the user's last messages"""
+    for message in reversed(conversation_history[-window:]):
+        if message.get("role") == "user":
+            language = _message_analysis(message)["language"]
+            if language:
+                return language
+    return None
+
+def analyze_message(text):
+    """Analyze a single message on its own, without conversation context"""
+    detected_language = detect_language_preference(text)
+    return MessageAnalysis(
+        language=detected_language,
+        detected_language=detected_language,
+        is_suicidal=detect_suicidal_keywords(text),
+        has_concern=detect_mental_health_concerns(text),
+        has_specific_plan="specific_plan" in matched_categories(text) if text else False,
+        wants_referral=detect_referral_request(text),
+    )
+
+def analyze_turn(user_message, user_content, conversation_history, session_data):
+    """
+    Analyze the current user turn once for every agent
+
+    Risk and referral flags come from the typed message; the specific-plan
+    check also covers the content sent to the model (e.g. image notes).
+
+    Returns:
+        MessageAnalysis: Analysis with the resolved conversation language
+    """
+    message = analyze_message(user_message)
+    language = session_data.get("language") or message.detected_language or history_language(conversation_history)
+    return MessageAnalysis(
+        language=language,
+        detected_language=message.detected_language,
+        is_suicidal=message.is_suicidal,
+        has_concern=message.has_concern,
+        has_specific_plan=message.has_specific_plan or (bool(user_content) and "specific_plan" in matched_categories(user_content)),
+        wants_referral=message.wants_referral,
+    )
@@ -0,0 +1,307 @@
+# metrics.py
+# In-process counters and histograms, served in the Prometheus text format
+
+import atexit
+import glob
+import json
+import math
+import os
+import threading
+import uuid
+
+from django.conf import settings
+
+# ===========================
+# REGISTRY
+# ===========================
+
+# Seconds a changed process snapshot may wait before it is written to CHATBOT_METRICS_DIR
+FLUSH_DELAY = 1.0
+
+# Model latency buckets in seconds, from a fast first token to a slow full reply
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+# PDF rendering buckets in seconds
+RENDER_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Prompt history sizes in estimated tokens
+TOKEN_BUCKETS = (250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000)
+
+class MetricsRegistry:
+    """
+    Counters and histograms of this process
+
+    Samples are kept per (metric, label values) under one lock; an update
+    is a dict lookup and an addition. With settings.CHATBOT_METRICS_DIR set,
+    each process also writes its samples to a file of its own in that
+    directory, and the metrics endpoint adds up the files of every worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._values = {}
+        self._flush_timer = None
+        self._snapshot_path = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+        atexit.register(self.flush)
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(self, name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, help_text, labels, buckets))
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def _add(self, name, labels, amount):
+        with self._lock:
+            key = (name, labels)
+            self._values[key] = self._values.get(key, 0.0) + amount
+        self._schedule_flush()
+
+    def _observe(self, name, labels, bucket_index, value):
+        with self._lock:
+            key = (name, labels)
+            sample = self._values.get(key)
+            if sample is None:
+                sample = self._values[key] = [0] * (len(self._metrics[name].buckets) + 1) + [0.0]
+            sample[bucket_index] += 1
+            sample[-1] += value
+        self._schedule_flush()
+
+    def snapshot(self):
+        """
+        Get this process's samples
+
+        Returns:
+            list: [name, label values, value] entries; histogram values are per-bucket counts then the sum
+        """
+        with self._lock:
+            return [
+                [name, list(labels), list(value) if isinstance(value, list) else value]
+                for (name, labels), value in self._values.items()
+            ]
+
+    def _reset_after_fork(self):
+        # A forked worker starts from zero; the parent's samples stay in the parent's file
+        self._lock = threading.Lock()
+        self._values = {}
+        self._flush_timer = None
+        self._snapshot_path = None
+
+    # ===========================
+    # MULTI-PROCESS SNAPSHOTS
+    # ===========================
+
+    def _schedule_flush(self):
+        if not settings.CHATBOT_METRICS_DIR or self._flush_timer is not None:
+            return
+        with self._lock:
+            if self._flush_timer is not None:
+                return
+            self._flush_timer = threading.Timer(FLUSH_DELAY, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """Write this process's samples to its file in settings.CHATBOT_METRICS_DIR"""
+        if not settings.CHATBOT_METRICS_DIR:
+            return
+        with self._lock:
+            self._flush_timer = None
+            if self._snapshot_path is None:
+                os.makedirs(settings.CHATBOT_METRICS_DIR, exist_ok=True)
+                # Unique per process start, so a recycled PID never overwrites a dead worker's counts
+                self._snapshot_path = os.path.join(settings.CHATBOT_METRICS_DIR, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+            path = self._snapshot_path
+        snapshot = self.snapshot()
+        temporary_path = f"{path}.tmp"
+        try:
+            with open(temporary_path, "w", encoding="utf-8") as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            print(f"⚠️ Could not write metrics snapshot: {e}")
+
+    def collect(self):
+        """
+        Get the samples of every worker, added up
+
+        Returns:
+            dict: {(name, label values): value}
+        """
+        if not settings.CHATBOT_METRICS_DIR:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            snapshots = []
+            for path in glob.glob(os.path.join(settings.CHATBOT_METRICS_DIR, "*.json")):
+                try:
+                    with open(path, encoding="utf-8") as snapshot_file:
+                        snapshots.append(json.load(snapshot_file))
+                except (OSError, ValueError):
+                    continue
+        totals = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot:
+                if name not in self._metrics:
+                    continue
+                key = (name, tuple(labels))
+                if isinstance(value, list):
+                    total = totals.setdefault(key, [0] * len(value))
+                    for index, part in enumerate(value):
+                        total[index] += part
+                else:
+                    totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    # ===========================
+    # PROMETHEUS TEXT FORMAT
+    # ===========================
+
+    def render(self):
+        """
+        Format the samples of every worker in the Prometheus text exposition format
+
+        Returns:
+            str: One HELP/TYPE block per metric, followed by its samples
+        """
+        by_metric = {}
+        for (name, labels), value in sorted(self.collect().items()):
+            by_metric.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in by_metric.get(name, []):
+                lines.extend(metric.sample_lines(labels, value))
+        return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels"""
+
+    kind = "counter"
+
+    def __init__(self, registry, name, help_text, labels):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+
+    def inc(self, amount=1, **labels):
+        self.registry._add(self.name, tuple(str(labels.get(name, "")) for name in self.labels), amount)
+
+    def sample_lines(self, labels, value):
+        return [f"{self.name}{_label_text(self.labels, labels)} {_number(value)}"]
+
+class Histogram:
+    """A distribution of observed values in fixed buckets, optionally split by labels"""
+
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labels, buckets):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.registry._observe(self.name, tuple(str(labels.get(name, "")) for name in self.labels), index, value)
+
+    def sample_lines(self, labels, value):
+        counts, total = value[:-1], value[-1]
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            le = (("le", _number(bound) if bound == math.inf else repr(float(bound))),)
+            lines.append(f"{self.name}_bucket{_label_text(self.labels, labels, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_label_text(self.labels, labels)} {_number(total)}")
+        lines.append(f"{self.name}_count{_label_text(self.labels, labels)} {cumulative}")
+        return lines
+
+METRICS = MetricsRegistry()
+
+# ===========================
+# CHATBOT METRICS
+# ===========================
+
+TURNS = METRICS.counter("chatbot_turns_total", "Chat turns handled, by the agent that answered", ["agent"])
+AGENT_SWITCHES = METRICS.counter(
+    "chatbot_agent_switches_total",
+    "Orchestrator to interview hand-offs, by trigger (keyword fast path, model referral marker, CRISIS/referral assessment, user consent)",
+    ["trigger"],
+)
+RISK_LEVELS = METRICS.counter("chatbot_risk_levels_total", "Risk levels parsed from agent replies ('none' when the reply had no assessment)", ["agent", "level"])
+CRISIS_TURNS = METRICS.counter("chatbot_crisis_turns_total", "Interview turns handled in crisis mode")
+REFUSAL_OVERRIDES = METRICS.counter("chatbot_refusal_overrides_total", "Crisis replies that refused or ended the conversation and were replaced")
+
+MODEL_CALLS = METRICS.counter(
+    "chatbot_model_calls_total",
+    "Model requests by outcome (ok, open_error, stream_error, abandoned, empty for a hedged leg that ended without text)",
+    ["model", "outcome"],
+)
+MODEL_FALLBACKS = METRICS.counter("chatbot_model_fallbacks_total", "Turns served by a model after an earlier model failed, by serving model", ["model"])
+MODEL_FIRST_TOKEN_SECONDS = METRICS.histogram("chatbot_model_first_token_seconds", "Time from request to first streamed token", ["model"])
+MODEL_STREAM_SECONDS = METRICS.histogram("chatbot_model_stream_seconds", "Time from request to the end of a completed stream", ["model"])
+MODEL_TOKENS = METRICS.counter(
+    "chatbot_model_tokens_total",
+    "Estimated prompt and completion tokens (text only, about 4 characters per Latin-script token)",
+    ["model", "kind"],
+)
+
+CONTEXT_TOKENS = METRICS.histogram(
+    "chatbot_context_tokens",
+    "Estimated history tokens an agent's prompt carries after budgeting, by agent",
+    ["agent"],
+    buckets=TOKEN_BUCKETS,
+)
+
+PDF_GENERATIONS = METRICS.counter("chatbot_pdf_generations_total", "Safety plan PDFs rendered")
+PDF_RENDER_SECONDS = METRICS.histogram("chatbot_pdf_render_seconds", "Time to render a safety plan PDF, including any wait for a pool worker", buckets=RENDER_BUCKETS)
+PDF_CACHE_LOOKUPS = METRICS.counter("chatbot_pdf_cache_lookups_total", "Safety plan PDF downloads by where the PDF came from (memory, disk, render)", ["result"])
+
+IMAGE_UPLOADS = METRICS.counter(
+    "chatbot_image_uploads_total",
+    "Image uploads by result (processed, duplicate, too_large, unsupported, invalid)",
+    ["result"],
+)
+
+ESCALATIONS = METRICS.counter(
+    "chatbot_escalations_total",
+    "Human escalations handed to the queue, by result (queued, coalesced into a waiting task, deduplicated, delivered directly, error)",
+    ["result"],
+)
+ESCALATION_DELIVERIES = METRICS.counter(
+    "chatbot_escalation_deliveries_total",
+    "Escalation delivery attempts by sink and outcome (delivered, retry, superseded, failed)",
+    ["sink", "outcome"],
+)
+
+RESPONSE_CACHE_LOOKUPS = METRICS.counter(
+    "chatbot_response_cache_lookups_total",
+    "Orchestrator turns by response cache result (hit, miss, bypass for turns that must reach the model)",
+    ["result"],
+)
+RESPONSE_CACHE_SAVED_SECONDS = METRICS.counter(
+    "chatbot_response_cache_saved_seconds_total",
+    "Model time saved by response cache hits (the recorded generation time of each reused reply)",
+)
@@ -0,0 +1,223 @@
+# model_router.py
+# Model routing - per-model circuit breakers, request deadlines and a cached model capability table
+
+import threading
+import time
+
+from django.conf import settings
+
+# ===========================
+# REQUEST DEADLINE
+# ===========================
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a turn runs out of time before a model could answer"""
+
+class Deadline:
+    """Time budget for one user turn, shared by every model call the turn makes"""
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds if seconds is not None else settings.CHATBOT_REQUEST_DEADLINE
+        self.expires_at = time.monotonic() + self.seconds
+
+    def remaining(self):
+        """Get the seconds left (never negative)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def call_timeout(self):
+        """Get the timeout for one model call: the per-call limit, capped by the time left"""
+        return min(settings.CHATBOT_MODEL_CALL_TIMEOUT, self.remaining())
+
+# ===========================
+# CIRCUIT BREAKER
+# ===========================
+
+class CircuitBreaker:
+    """
+    Failure tracking for one model
+
+    closed: calls go through; `failure_threshold` failures in a row open it.
+    open: calls are skipped until `cooldown` seconds have passed.
+    half-open: one probe call is let through (claimed with acquire);
+    success closes the breaker, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=3, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.successes = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_latency = None
+
+    def available(self, now):
+        """Check whether a call could go to the model now"""
+        if self.state == self.OPEN and now - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self.probe_in_flight = False
+        return self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self.probe_in_flight)
+
+    def acquire(self, now):
+        """Claim a call to the model; when half-open only the first caller gets the probe"""
+        if not self.available(now):
+            return False
+        if self.state == self.HALF_OPEN:
+            self.probe_in_flight = True
+        return True
+
+    def release(self):
+        """Give back a claimed call that ended without a result (e.g. a cancelled stream)"""
+        self.probe_in_flight = False
+
+    def record_success(self, latency):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        self.successes += 1
+        self.last_latency = latency
+
+    def record_failure(self, error, now):
+        self.consecutive_failures += 1
+        self.failures += 1
+        self.probe_in_flight = False
+        self.last_error = str(error)[:200]
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = now
+
+    def reopens_at(self):
+        return self.opened_at + self.cooldown if self.state == self.OPEN else 0.0
+
+# ===========================
+# MODEL ROUTER
+# ===========================
+
+# Error text meaning the model is gone for good rather than temporarily failing
+_DEAD_MODEL_ERRORS = ("model_not_found", "decommissioned", "does not exist")
+
+class ModelRouter:
+    """
+    Picks which models to try for a completion, in fallback order
+
+    Models whose breaker is open, or that the provider's model list says are
+    unavailable, are skipped without a network call. The model list is
+    cached and refreshed on a background thread every `table_ttl` seconds;
+    until the first refresh completes every model is assumed available.
+    """
+
+    def __init__(self, models, list_models=None, failure_threshold=3, cooldown=30.0, table_ttl=600.0):
+        self.models = list(models)
+        self.list_models = list_models
+        self.table_ttl = table_ttl
+        self._lock = threading.Lock()
+        self._breakers = {model: CircuitBreaker(failure_threshold, cooldown) for model in self.models}
+        self._capabilities = None
+        self._capabilities_at = None
+        self._dead = set()
+        self._refreshing = False
+
+    def candidates(self):
+        """
+        Get the models worth trying for one call, best first
+
+        Call acquire() right before calling each one; an empty list means
+        every model is known to be failing and the call should fail fast.
+        """
+        self._refresh_capabilities_if_stale()
+        now = time.monotonic()
+        with self._lock:
+            return [
+                model for model in self.models
+                if model not in self._dead and self._is_listed(model) and self._breakers[model].available(now)
+            ]
+
+    def acquire(self, model):
+        """Claim a call to a model (takes the probe slot of a half-open breaker)"""
+        with self._lock:
+            return self._breakers[model].acquire(time.monotonic())
+
+    def release(self, model):
+        """Give back a claimed call that ended without success or failure"""
+        with self._lock:
+            self._breakers[model].release()
+
+    def record_success(self, model, latency):
+        with self._lock:
+            self._breakers[model].record_success(latency)
+
+    def record_failure(self, model, error):
+        with self._lock:
+            self._breakers[model].record_failure(error, time.monotonic())
+            if any(marker in str(error).lower() for marker in _DEAD_MODEL_ERRORS):
+                # Skip until the next model list refresh says otherwise
+                self._dead.add(model)
+
+    def _is_listed(self, model):
+        return self._capabilities is None or model in self._capabilities
+
+    # ===========================
+    # CAPABILITY TABLE
+    # ===========================
+
+    def _refresh_capabilities_if_stale(self):
+        if self.list_models is None:
+            return
+        with self._lock:
+            fresh = self._capabilities_at is not None and time.monotonic() - self._capabilities_at < self.table_ttl
+            if fresh or self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh_capabilities, name="chatbot-model-table", daemon=True).start()
+
+    def refresh_capabilities(self):
+        """Reload the provider's model list (runs on a background thread)"""
+        try:
+            table = self.list_models()
+        except Exception as e:
+            print(f"⚠️ Could not refresh the model list: {e}")
+            table = None
+        with self._lock:
+            self._refreshing = False
+            self._capabilities_at = time.monotonic()
+            if table is not None:
+                self._capabilities = table
+                self._dead.clear()
+
+    # ===========================
+    # MONITORING
+    # ===========================
+
+    def snapshot(self):
+        """Get the router state for monitoring"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "models": [
+                    {
+                        "model": model,
+                        "state": breaker.state,
+                        "listed": self._is_listed(model),
+                        "dead": model in self._dead,
+                        "consecutive_failures": breaker.consecutive_failures,
+                        "successes": breaker.successes,
+                        "failures": breaker.failures,
+                        "last_error": breaker.last_error,
+                        "last_latency": breaker.last_latency,
+                        "reopens_in": round(max(0.0, breaker.reopens_at() - now), 1) if breaker.state == CircuitBreaker.OPEN else None,
+                        "context_window": (self._capabilities or {}).get(model, {}).get("context_window"),
+                    }
+                    for model, breaker in self._breakers.items()
+                ],
+                "capabilities_age": round(now - self._capabilities_at, 1) if self._capabilities_at is not None else None,
+            }
@@ -1,7 +1,17 @@
 # orchestrator_agent.py
 # Orchestrator Agent (Main Controller) - Handles general conversations and routing
 
-from .agent_utils import get_groq_client, detect_mental_health_concerns, detect_referral_request, detect_language_preference, detect_suicidal_keywords
+import time
+
+from .agent_utils import llm_configured, stream_chat_completion, astream_chat_completion, collect_stream, turn_index
+from .context_builder import build_history_window
+from .message_analysis import analyze_turn
+from .metrics import AGENT_SWITCHES, RISK_LEVELS
+from .prompts import PROMPT_REGISTRY, normalize_language
+from .response_cache import cached_response, remember_response, response_cache_key
+from .risk_assessment import NextStep, RiskLevel, RiskTrailerFilter, record_risk, split_risk_trailer
+from .summarizer import summary_message, summarized_until
+from .tracing import span
 
 # ===========================
 # ORCHESTRATOR AGENT CONFIGURATION
@@ -99,135 +109,204 @@ Remember: Your role is to be a first point of contact and to identify when speci
 **CRITICAL REMINDER**: On EVERY message, you MUST perform the language-aware risk assessment (LOW/MODERATE/HIGH/CRISIS) in the user's communication language. When in doubt, always classify as CRISIS and immediately refer to the interview agent. Safety first. However, for LOW risk users who are fine, engage naturally without being intrusive or repetitive.
 """
 
+def _build_system_instructions(language, crisis, plan):
+    """Assemble the orchestrator system instructions for one prompt variant (run once per variant)"""
+    system_instructions = ORCHESTRATOR_SYSTEM_INSTRUCTIONS
+    
+    # Add STRONG language preference to system instructions if set
+    if language:
+        if "urdu" in language.lower() or "hindi" in language.lower() or "اردو" in language or "हिंदी" in language:
+            system_instructions += f"\n\n🚨 CRITICAL LANGUAGE REQUIREMENT 🚨\n\nThe user has been communicating in Urdu/Hindi (including Roman Urdu - Urdu written in English letters). You MUST respond in the SAME language format the user is using:\n- If user writes in Roman Urdu (English letters like 'mein', 'aap', 'kaise', 'hai') → You MUST respond in Roman Urdu\n- If user writes in Urdu script (اردو) → You MUST respond in Urdu script\n- If user writes in Hindi script (हिंदी) → You MUST respond in Hindi script\nDO NOT switch to English. Match the user's language format exactly. Use phrases like 'Main aap ke saath hoon', 'Aap kaise hain?', 'Kya aapko koi pareshan hai?', 'Bataiye kya ho raha hai?' Continue the conversation in the SAME language and format the user is using to maintain connection and trust."
+        elif "spanish" in language.lower():
+            system_instructions += f"\n\n🚨 CRITICAL LANGUAGE REQUIREMENT 🚨\n\nThe user has been communicating in Spanish. You MUST respond in Spanish. DO NOT switch to English. Continue the conversation in Spanish to maintain connection and trust."
+        elif "french" in language.lower():
+            system_instructions += f"\n\n🚨 CRITICAL LANGUAGE REQUIREMENT 🚨\n\nThe user has been communicating in French. You MUST respond in French. DO NOT switch to English. Continue the conversation in French to maintain connection and trust."
+        elif "arabic" in language.lower():
+            system_instructions += f"\n\n🚨 CRITICAL LANGUAGE REQUIREMENT 🚨\n\nThe user has been communicating in Arabic. You MUST respond in Arabic. DO NOT switch to English. Continue the conversation in Arabic to maintain connection and trust."
+    
+    return system_instructions
+
+PROMPT_REGISTRY.register("orchestrator", _build_system_instructions)
+
 def get_welcome_message():
     """Get the orchestrator welcome message"""
     return ORCHESTRATOR_WELCOME_MESSAGE
 
-def process_message(user_message, user_content, conversation_history, session_data):
+def _prepare_turn(user_message, user_content, conversation_history, session_data, analysis):
     """
-    Process a message with the orchestrator agent
+    Build the prompt for one orchestrator turn from the turn analysis
     
     Returns:
-        tuple: (bot_response, should_switch_to_interview, updated_session_data)
+        dict: Turn state; "referral_message" is set when the turn is an immediate referral,
+              "cache_key" when the reply may come from the response cache
     """
-    client = get_groq_client()
-    if not client:
-        return "The AI model is not configured. Please check server logs.", False, session_data
-    
-    # Add language detection from user message if not set (needed for immediate referral message)
-    user_language = session_data.get("language")
-    if not user_language:
-        detected_language = detect_language_preference(user_message)
-        if detected_language:
-            user_language = detected_language
-            session_data["language"] = user_language
+    # Language resolved by the analysis stage (session, current message, then recent history)
+    user_language = analysis.language
+    if user_language and not session_data.get("language"):
+        session_data["language"] = user_language
     
     # CRITICAL: Check for suicidal keywords FIRST - immediate referral required
-    has_suicidal_keywords = detect_suicidal_keywords(user_message)
-    if has_suicidal_keywords:
+    if analysis.is_suicidal:
         # IMMEDIATE REFERRAL - Do not proceed with orchestrator, switch immediately
         session_data["referred_to_interview"] = True
+        AGENT_SWITCHES.inc(trigger="keyword")
         # Generate language-appropriate referral message
-        if user_language and ("urdu" in user_language.lower() or "hindi" in user_language.lower()):
+        if normalize_language(user_language) == "Urdu/Hindi":
             referral_message = "Main aapko psychiatric interview specialist se connect kar raha hoon. Woh aapki safety ka assessment karenge. Please stay with me."
         else:
             referral_message = "I'm connecting you with our psychiatric interview specialist now. They can conduct a safety assessment to better understand your situation. Please stay with me."
-        return referral_message, True, session_data
+        return {"referral_message": referral_message}
     
     # Check if we should switch to interview agent
-    has_mental_health_concern = detect_mental_health_concerns(user_message)
     referred_to_interview = session_data.get("referred_to_interview", False)
-    should_switch = False
-    
-    # Language detection already done above - continue if still not detected
-    if not user_language:
-        # If not detected from current message, check conversation history
-        for hist_msg in reversed(conversation_history[-3:]):  # Check last 3 messages
-            if hist_msg.get("role") == "user":
-                detected_language = detect_language_preference(hist_msg.get("content", ""))
-                if detected_language:
-                    user_language = detected_language
-                    session_data["language"] = user_language
-                    break
-    
-    # Prepare system instructions with language requirement
-    system_instructions = ORCHESTRATOR_SYSTEM_INSTRUCTIONS
-    
-    # Add STRONG language preference to system instructions if set
-    if user_language:
-        if "urdu" in user_language.lower() or "hindi" in user_language.lower() or "اردو" in user_language or "हिंदी" in user_language:
-            system_instructions += f"\n\n🚨 CRITICAL LANGUAGE REQUIREMENT 🚨\n\nThe user has been communicating in Urdu/Hindi (including Roman Urdu - Urdu written in English letters). You MUST respond in the SAME language format the user is using:\n- If user writes in Roman Urdu (English letters like 'mein', 'aap', 'kaise', 'hai') → You MUST respond in Roman Urdu\n- If user writes in Urdu script (اردو) → You MUST respond in Urdu script\n- If user writes in Hindi script (हिंदी) → You MUST respond in Hindi script\nDO NOT switch to English. Match the user's language format exactly. Use phrases like 'Main aap ke saath hoon', 'Aap kaise hain?', 'Kya aapko koi pareshan hai?', 'Bataiye kya ho raha hai?' Continue the conversation in the SAME language and format the user is using to maintain connection and trust."
-        elif "spanish" in user_language.lower():
-            system_instructions += f"\n\n🚨 CRITICAL LANGUAGE REQUIREMENT 🚨\n\nThe user has been communicating in Spanish. You MUST respond in Spanish. DO NOT switch to English. Continue the conversation in Spanish to maintain connection and trust."
-        elif "french" in user_language.lower():
-            system_instructions += f"\n\n🚨 CRITICAL LANGUAGE REQUIREMENT 🚨\n\nThe user has been communicating in French. You MUST respond in French. DO NOT switch to English. Continue the conversation in French to maintain connection and trust."
-        elif "arabic" in user_language.lower():
-            system_instructions += f"\n\n🚨 CRITICAL LANGUAGE REQUIREMENT 🚨\n\nThe user has been communicating in Arabic. You MUST respond in Arabic. DO NOT switch to English. Continue the conversation in Arabic to maintain connection and trust."
     
     # Build messages for orchestrator
-    messages = [{"role": "system", "content": system_instructions}]
+    messages = [PROMPT_REGISTRY.system_message("orchestrator", user_language)]
+    
+    # Older turns are represented by the rolling summary
+    summary = summary_message(session_data, conversation_history)
+    if summary:
+        messages.append(summary)
     
-    # Add conversation history (last 10 messages for context)
-    for hist_msg in conversation_history[-10:]:
-        messages.append(hist_msg)
+    # Add conversation history that fits the agent's token budget (crisis turns always kept)
+    context = build_history_window(conversation_history, "orchestrator", start=summarized_until(session_data, conversation_history))
+    messages.extend(context.messages)
     
     # Add current user message
     messages.append({"role": "user", "content": user_content})
     
-    # Call Groq API (Orchestrator Agent)
-    try:
-        completion = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=2048,
-            stream=True,
-        )
-    except Exception as model_error:
-        # Fallback to alternative model if primary fails
-        print(f"⚠️ Primary model failed, trying alternative: {model_error}")
-        try:
-            completion = client.chat.completions.create(
-                model="llama-3.1-70b-versatile",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=2048,
-                stream=True,
-            )
-        except Exception as fallback_error:
-            # Final fallback
-            print(f"⚠️ Fallback model failed, trying fallback: {fallback_error}")
-            completion = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=2048,
-                stream=True,
-            )
-    
-    # Collect streamed response
-    bot_response = ""
-    try:
-        for chunk in completion:
-            if chunk.choices and len(chunk.choices) > 0:
-                if chunk.choices[0].delta and chunk.choices[0].delta.content:
-                    bot_response += chunk.choices[0].delta.content
-    except Exception as stream_error:
-        print(f"⚠️ Error during streaming: {stream_error}")
+    return {
+        "referral_message": None,
+        "messages": messages,
+        "analysis": analysis,
+        "referred_to_interview": referred_to_interview,
+        "context": context,
+        "turn_index": turn_index(session_data, conversation_history),
+        "cache_key": response_cache_key(
+            "orchestrator", user_message, user_content, messages, conversation_history, session_data, analysis
+        ),
+    }
+
+def _finish_turn(turn, bot_response, session_data):
+    """
+    Post-process the model reply and decide whether to switch agents
+    
+    The risk trailer and the referral marker are cut from the reply (the
+    marker may sit inside the trailer's "Next Step" line) and the assessment
+    is recorded in the session's risk timeline. A CRISIS assessment or a
+    referral next step hands over like the marker does.
     
+    Returns:
+        tuple: (bot_response without the trailer, should_switch_to_interview)
+    """
+    bot_response, assessment = split_risk_trailer(bot_response)
     if not bot_response:
         bot_response = "I'm here to listen. Could you tell me more about what you're experiencing?"
     
+    should_switch = False
+    record_risk(session_data, turn["turn_index"], "orchestrator", assessment)
+    RISK_LEVELS.inc(agent="orchestrator", level=assessment.level.name if assessment.level else "none")
+    
     # Check if orchestrator response contains referral marker (AI decided to refer)
-    if "[REFER_TO_INTERVIEW_AGENT]" in bot_response:
-        bot_response = bot_response.replace("[REFER_TO_INTERVIEW_AGENT]", "").strip()
+    if assessment.refer:
         should_switch = True
+        AGENT_SWITCHES.inc(trigger="marker")
+    # The model assessed a crisis or named a referral as the next step without the marker
+    elif assessment.level == RiskLevel.CRISIS or assessment.next_step in (NextStep.REFER, NextStep.ESCALATE):
+        should_switch = True
+        AGENT_SWITCHES.inc(trigger="assessment")
     # If orchestrator previously suggested interview and user agrees, switch now
-    elif referred_to_interview and detect_referral_request(user_message):
+    elif turn["referred_to_interview"] and turn["analysis"].wants_referral:
         should_switch = True
+        AGENT_SWITCHES.inc(trigger="consent")
         bot_response += "\n\nI'm connecting you with our psychiatric interview specialist now. They can conduct a more detailed assessment to better understand your situation."
     # If severe mental health concern detected, mark for referral (orchestrator will offer next)
-    elif has_mental_health_concern:
+    elif turn["analysis"].has_concern or assessment.level >= RiskLevel.HIGH:
         session_data["referred_to_interview"] = True
     
+    return bot_response, should_switch
+
+def process_message(user_message, user_content, conversation_history, session_data, analysis=None, deadline=None):
+    """
+    Process a message with the orchestrator agent
+    
+    Returns:
+        tuple: (bot_response, should_switch_to_interview, updated_session_data)
+    """
+    return collect_stream(stream_message(user_message, user_content, conversation_history, session_data, analysis, deadline))
+
+def stream_message(user_message, user_content, conversation_history, session_data, analysis=None, deadline=None):
+    """
+    Process a message with the orchestrator agent, streaming the reply
+    
+    Yields:
+        str: Text deltas of the reply as the model produces them
+    
+    Returns:
+        tuple: (bot_response, should_switch_to_interview, updated_session_data)
+    """
+    if not llm_configured():
+        message = "The AI model is not configured. Please check server logs."
+        yield message
+        return message, False, session_data
+    
+    if analysis is None:
+        analysis = analyze_turn(user_message, user_content, conversation_history, session_data)
+    with span("prompt"):
+        turn = _prepare_turn(user_message, user_content, conversation_history, session_data, analysis)
+    if turn["referral_message"]:
+        yield turn["referral_message"]
+        return turn["referral_message"], True, session_data
+    
+    cached = cached_response(turn["cache_key"])
+    if cached is not None:
+        bot_response, should_switch = _finish_turn(turn, cached, session_data)
+        yield bot_response
+        return bot_response, should_switch, session_data
+    
+    # Call the LLM backend (Orchestrator Agent), forwarding deltas as they arrive (without the risk trailer)
+    started = time.monotonic()
+    trailer_filter = RiskTrailerFilter()
+    for delta in stream_chat_completion(turn["messages"], temperature=0.7, deadline=deadline):
+        visible = trailer_filter.feed(delta)
+        if visible:
+            yield visible
+    visible = trailer_filter.finish()
+    if visible:
+        yield visible
+    
+    bot_response, should_switch = _finish_turn(turn, trailer_filter.text, session_data)
+    remember_response(turn["cache_key"], trailer_filter.text, should_switch, time.monotonic() - started)
+    return bot_response, should_switch, session_data
+
+async def aprocess_message(user_message, user_content, conversation_history, session_data, analysis=None, deadline=None):
+    """
+    Async variant of process_message for the ASGI request path
+    
+    Returns:
+        tuple: (bot_response, should_switch_to_interview, updated_session_data)
+    """
+    if not llm_configured():
+        return "The AI model is not configured. Please check server logs.", False, session_data
+    
+    if analysis is None:
+        analysis = analyze_turn(user_message, user_content, conversation_history, session_data)
+    with span("prompt"):
+        turn = _prepare_turn(user_message, user_content, conversation_history, session_data, analysis)
+    if turn["referral_message"]:
+        return turn["referral_message"], True, session_data
+    
+    cached = cached_response(turn["cache_key"])
+    if cached is not None:
+        bot_response, should_switch = _finish_turn(turn, cached, session_data)
+        return bot_response, should_switch, session_data
+    
+    started = time.monotonic()
+    bot_response = ""
+    async for delta in astream_chat_completion(turn["messages"], temperature=0.7, deadline=deadline):
+        bot_response += delta
+    
+    raw_response = bot_response
+    bot_response, should_switch = _finish_turn(turn, raw_response, session_data)
+    remember_response(turn["cache_key"], raw_response, should_switch, time.monotonic() - started)
     return bot_response, should_switch, session_data
@@ -0,0 +1,170 @@
+# pdf_cache.py
+# Content-addressed cache of rendered safety plan PDFs (in-memory LRU plus an optional disk tier)
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .metrics import PDF_CACHE_LOOKUPS, PDF_GENERATIONS, PDF_RENDER_SECONDS
+from .pdf_renderer import get_pdf_renderer
+
+# ===========================
+# CONTENT ADDRESS
+# ===========================
+
+def pdf_plan(plan_content):
+    """
+    Get the part of a safety plan that ends up in its PDF
+
+    The PDF shows the day the plan was made rather than the second, so the
+    many identical plans (the text depends only on language and risk
+    level) share one rendering per day.
+
+    Returns:
+        dict: Plan content to render and hash
+    """
+    return {
+        "created_at": str(plan_content.get("created_at", "N/A"))[:10],
+        "language": plan_content.get("language") or "English",
+        "risk_level": plan_content.get("risk_level", "HIGH"),
+        "sections": plan_content.get("sections", {}),
+    }
+
+def plan_pdf_key(plan):
+    """Get the content hash a rendered plan is cached under (also its ETag)"""
+    canonical = json.dumps(plan, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+# ===========================
+# CACHE
+# ===========================
+
+class PDFCache:
+    """
+    Rendered PDFs by content hash
+
+    The most recently used `max_items` PDFs are kept in memory. With a
+    `directory`, every rendering is also written there, where other worker
+    processes and later restarts find it. Concurrent requests for the same
+    uncached plan wait for one rendering instead of each running their own.
+    """
+
+    def __init__(self, max_items=64, directory=""):
+        self.max_items = max_items
+        self.directory = directory
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._renderings = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _remember(self, key, pdf_bytes):
+        with self._lock:
+            self._memory[key] = pdf_bytes
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+    def _from_memory(self, key):
+        with self._lock:
+            pdf_bytes = self._memory.get(key)
+            if pdf_bytes is not None:
+                self._memory.move_to_end(key)
+            return pdf_bytes
+
+    def disk_path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf") if self.directory else None
+
+    def _from_disk(self, key):
+        path = self.disk_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as pdf_file:
+                return pdf_file.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key, pdf_bytes):
+        path = self.disk_path(key)
+        if path is None:
+            return
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "wb") as pdf_file:
+                pdf_file.write(pdf_bytes)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            print(f"⚠️ Could not write safety plan PDF to the disk cache: {e}")
+
+    def get(self, key, render):
+        """
+        Get a cached PDF, rendering and storing it on a miss
+
+        Args:
+            render: Callable () -> bytes, run only when no tier has the PDF
+
+        Returns:
+            bytes: PDF file content
+        """
+        pdf_bytes = self._from_memory(key)
+        if pdf_bytes is not None:
+            PDF_CACHE_LOOKUPS.inc(result="memory")
+            return pdf_bytes
+
+        with self._lock:
+            rendering = self._renderings.setdefault(key, threading.Lock())
+        try:
+            with rendering:
+                # Another request may have rendered it while this one waited
+                pdf_bytes = self._from_memory(key)
+                if pdf_bytes is not None:
+                    PDF_CACHE_LOOKUPS.inc(result="memory")
+                    return pdf_bytes
+                pdf_bytes = self._from_disk(key)
+                if pdf_bytes is not None:
+                    PDF_CACHE_LOOKUPS.inc(result="disk")
+                else:
+                    PDF_CACHE_LOOKUPS.inc(result="render")
+                    pdf_bytes = render()
+                    self._write_disk(key, pdf_bytes)
+                self._remember(key, pdf_bytes)
+            return pdf_bytes
+        finally:
+            # Drop the per-key lock even when the render raised
+            with self._lock:
+                self._renderings.pop(key, None)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_pdf_cache():
+    """Get the process-wide PDF cache (settings.CHATBOT_PDF_CACHE_SIZE, CHATBOT_PDF_CACHE_DIR)"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PDFCache(settings.CHATBOT_PDF_CACHE_SIZE, settings.CHATBOT_PDF_CACHE_DIR)
+    return _cache
+
+def _render(plan):
+    """Render a plan in the PDF process pool"""
+    started = time.perf_counter()
+    pdf_bytes = get_pdf_renderer().render(plan)
+    PDF_GENERATIONS.inc()
+    PDF_RENDER_SECONDS.observe(time.perf_counter() - started)
+    return pdf_bytes
+
+def safety_plan_pdf(plan):
+    """
+    Get the PDF of a plan from pdf_plan, rendering it only if no cache tier has it
+
+    Returns:
+        bytes: PDF file content
+    """
+    return get_pdf_cache().get(plan_pdf_key(plan), lambda: _render(plan))
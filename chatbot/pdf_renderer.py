@@ -0,0 +1,353 @@
+# pdf_renderer.py
+# Safety plan PDF rendering - fonts and styles set up once per process, layout in a bounded process pool
+#
+# Kept free of Django imports so pool workers can start without the project settings.
+
+import functools
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# ===========================
+# FONTS
+# ===========================
+
+# Fonts with both Latin and Arabic-script glyphs, so English and Urdu share a
+# paragraph: (regular, bold) paths, tried in order
+FONT_CANDIDATES = [
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"),
+    ("/usr/share/fonts/dejavu/DejaVuSans.ttf", "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf"),
+    ("/usr/share/fonts/TTF/DejaVuSans.ttf", "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf"),
+    ("C:/Windows/Fonts/arial.ttf", "C:/Windows/Fonts/arialbd.ttf"),
+    ("/Library/Fonts/Arial Unicode.ttf", None),
+    ("/System/Library/Fonts/Supplemental/Arial Unicode.ttf", None),
+]
+
+FONT_NAME = "SafetyPlanSans"
+BOLD_FONT_NAME = "SafetyPlanSans-Bold"
+
+def find_fonts(font_path="", bold_font_path=""):
+    """
+    Pick the font files for the PDF: the configured ones, else the first installed candidate
+
+    Returns:
+        tuple: (regular path or None, bold path or None)
+    """
+    if font_path:
+        return font_path, bold_font_path or None
+    for regular, bold in FONT_CANDIDATES:
+        if os.path.exists(regular):
+            return regular, bold if bold and os.path.exists(bold) else None
+    return None, None
+
+@functools.lru_cache(maxsize=None)
+def register_fonts(font_path="", bold_font_path=""):
+    """
+    Register the Unicode font with ReportLab, once per process
+
+    Without one, the PDF falls back to Helvetica, which has no Urdu glyphs.
+    Arabic-script text is shaped (joined letters, right-to-left runs) when
+    the optional uharfbuzz package is installed.
+
+    Returns:
+        tuple: (regular font name, bold font name)
+    """
+    from reportlab.lib.fonts import addMapping
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    regular, bold = find_fonts(font_path, bold_font_path)
+    if regular is None:
+        print("⚠️ No Unicode font found for safety plan PDFs (set CHATBOT_PDF_FONT) - Urdu text will not render")
+        return "Helvetica", "Helvetica-Bold"
+    pdfmetrics.registerFont(TTFont(FONT_NAME, regular))
+    bold_name = FONT_NAME
+    if bold:
+        pdfmetrics.registerFont(TTFont(BOLD_FONT_NAME, bold))
+        bold_name = BOLD_FONT_NAME
+    # <b> inside paragraphs switches to the bold face
+    addMapping(FONT_NAME, 0, 0, FONT_NAME)
+    addMapping(FONT_NAME, 1, 0, bold_name)
+    addMapping(FONT_NAME, 0, 1, FONT_NAME)
+    addMapping(FONT_NAME, 1, 1, bold_name)
+    return FONT_NAME, bold_name
+
+def shaping_available():
+    """Check whether ReportLab can shape Arabic-script text (optional uharfbuzz package)"""
+    try:
+        import uharfbuzz  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+# ===========================
+# STYLES
+# ===========================
+
+@functools.lru_cache(maxsize=None)
+def build_styles(font_path="", bold_font_path=""):
+    """
+    Build the paragraph styles of the safety plan PDF, once per process
+
+    Returns:
+        dict: title, heading and normal ParagraphStyles
+    """
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+
+    regular, bold = register_fonts(font_path, bold_font_path)
+    shaping = 1 if regular != "Helvetica" and shaping_available() else 0
+    sample = getSampleStyleSheet()
+    return {
+        "title": ParagraphStyle(
+            'CustomTitle',
+            parent=sample['Heading1'],
+            fontName=bold,
+            fontSize=24,
+            leading=30,
+            spaceAfter=30,
+            alignment=1,  # Center alignment
+            textColor=(0.2, 0.3, 0.6),
+            shaping=shaping,
+        ),
+        "heading": ParagraphStyle(
+            'CustomHeading',
+            parent=sample['Heading2'],
+            fontName=bold,
+            fontSize=16,
+            leading=22,
+            spaceAfter=12,
+            spaceBefore=12,
+            textColor=(0.3, 0.5, 0.8),
+            shaping=shaping,
+        ),
+        "normal": ParagraphStyle('PlanNormal', parent=sample['Normal'], fontName=regular, shaping=shaping),
+    }
+
+# ===========================
+# LAYOUT
+# ===========================
+
+def _is_urdu(user_language):
+    return bool(user_language) and ("urdu" in user_language.lower() or "hindi" in user_language.lower())
+
+def render_pdf(plan_content, font_path="", bold_font_path=""):
+    """
+    Lay out a safety plan as a PDF in this process
+
+    Returns:
+        bytes: PDF file content
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+    styles = build_styles(font_path, bold_font_path)
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
+
+    # Container for PDF elements
+    story = []
+
+    # Title
+    user_language = plan_content.get("language") or "English"
+    if _is_urdu(user_language):
+        title_text = "Personalized Safety Plan<br/>شخصی حفاظتی منصوبہ"
+    else:
+        title_text = "Personalized Safety Plan"
+
+    story.append(Paragraph(title_text, styles["title"]))
+    story.append(Spacer(1, 0.2*inch))
+
+    # Date
+    date_text = f"Generated: {plan_content.get('created_at', 'N/A')}"
+    story.append(Paragraph(date_text, styles["normal"]))
+    story.append(Spacer(1, 0.3*inch))
+
+    # Risk Level
+    risk_level = plan_content.get("risk_level", "HIGH")
+    risk_text = f"<b>Risk Level: {risk_level}</b>"
+    story.append(Paragraph(risk_text, styles["normal"]))
+    story.append(Spacer(1, 0.3*inch))
+
+    # Sections
+    sections = plan_content.get("sections", {})
+
+    if _is_urdu(user_language):
+        section_titles = {
+            "immediate_safety": "Immediate Safety Steps<br/>فوری حفاظتی اقدامات",
+            "coping_strategies": "Coping Strategies<br/>نمٹنے کی حکمت عملی",
+            "support_resources": "Support Resources<br/>مدد کے وسائل",
+            "emergency_contacts": "Emergency Contacts<br/>ایمرجنسی رابطے"
+        }
+    else:
+        section_titles = {
+            "immediate_safety": "Immediate Safety Steps",
+            "coping_strategies": "Coping Strategies",
+            "support_resources": "Support Resources",
+            "emergency_contacts": "Emergency Contacts"
+        }
+
+    for section_key, items in sections.items():
+        if items:
+            story.append(Paragraph(section_titles.get(section_key, section_key.title()), styles["heading"]))
+            for item in items:
+                story.append(Paragraph(f"• {item}", styles["normal"]))
+                story.append(Spacer(1, 0.1*inch))
+            story.append(Spacer(1, 0.2*inch))
+
+    # Build PDF
+    doc.build(story)
+    return buffer.getvalue()
+
+def render_pdf_batch(plans, font_path="", bold_font_path=""):
+    """Lay out several plans in this process (one pool task per chunk of a batch)"""
+    return [render_pdf(plan, font_path, bold_font_path) for plan in plans]
+
+def _pool_context():
+    """
+    Start workers from a clean process rather than forking the web server
+
+    Forking would copy the server's threads' state and the loaded Django
+    project into every worker; workers only need this module.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def _warm_worker(font_path, bold_font_path):
+    """Pool initializer: register fonts and build styles before the first task arrives"""
+    build_styles(font_path, bold_font_path)
+
+# ===========================
+# RENDERING SERVICE
+# ===========================
+
+class PDFRenderService:
+    """
+    Renders PDFs in a pool of `workers` processes
+
+    ReportLab layout is pure-Python CPU work; in a pool it runs in parallel
+    and never holds a request thread's GIL. At most `max_pending` renderings
+    are submitted at once, so a burst of downloads queues in the request
+    threads instead of piling work into the pool. With `workers` at 0, or
+    when a pool cannot be started (e.g. serverless hosts without
+    /dev/shm), PDFs are rendered in the calling thread.
+    """
+
+    def __init__(self, workers=2, max_pending=8, timeout=30.0, font_path="", bold_font_path=""):
+        self.workers = workers
+        self.timeout = timeout
+        self.font_path = font_path
+        self.bold_font_path = bold_font_path
+        self._pending = threading.BoundedSemaphore(max(1, max_pending))
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._inline = workers <= 0
+
+    def _get_pool(self):
+        if self._pool is None and not self._inline:
+            with self._pool_lock:
+                if self._pool is None and not self._inline:
+                    try:
+                        self._pool = ProcessPoolExecutor(
+                            max_workers=self.workers, mp_context=_pool_context(), initializer=_warm_worker,
+                            initargs=(self.font_path, self.bold_font_path),
+                        )
+                    except (OSError, NotImplementedError) as e:
+                        print(f"⚠️ PDF process pool unavailable, rendering in-process: {e}")
+                        self._inline = True
+        return self._pool
+
+    def _reset_pool(self, pool):
+        """Drop a pool whose worker died, so the next rendering starts a new one"""
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, plan_content):
+        """
+        Render one plan
+
+        Returns:
+            bytes: PDF file content
+        """
+        pool = self._get_pool()
+        if pool is None:
+            return render_pdf(plan_content, self.font_path, self.bold_font_path)
+        if not self._pending.acquire(timeout=self.timeout):
+            raise TimeoutError("PDF rendering queue is full")
+        try:
+            future = pool.submit(render_pdf, plan_content, self.font_path, self.bold_font_path)
+            return future.result(timeout=self.timeout)
+        except BrokenProcessPool:
+            self._reset_pool(pool)
+            raise
+        finally:
+            self._pending.release()
+
+    def render_batch(self, plans, chunk_size=None):
+        """
+        Render many plans (e.g. an export), spread over the workers in chunks
+
+        Chunks amortise the per-task cost of sending plans to the workers and
+        PDFs back.
+
+        Returns:
+            list: PDF bytes in the order of `plans`
+        """
+        plans = list(plans)
+        pool = self._get_pool()
+        if pool is None or not plans:
+            return render_pdf_batch(plans, self.font_path, self.bold_font_path)
+        chunk_size = chunk_size or max(1, -(-len(plans) // (self.workers * 4)))
+        chunks = [plans[start:start + chunk_size] for start in range(0, len(plans), chunk_size)]
+        try:
+            futures = [pool.submit(render_pdf_batch, chunk, self.font_path, self.bold_font_path) for chunk in chunks]
+            return [pdf for future in futures for pdf in future.result(timeout=self.timeout * len(chunks))]
+        except BrokenProcessPool:
+            self._reset_pool(pool)
+            raise
+
+    def warm_up(self):
+        """Start the pool and its workers' fonts and styles ahead of the first download"""
+        pool = self._get_pool()
+        if pool is None:
+            build_styles(self.font_path, self.bold_font_path)
+            return
+        started = time.perf_counter()
+        list(pool.map(_warm_worker, [self.font_path] * self.workers, [self.bold_font_path] * self.workers))
+        print(f"🖨️ PDF render pool ready: {self.workers} workers in {time.perf_counter() - started:.2f}s")
+
+    def shutdown(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+def get_pdf_renderer():
+    """Get the process-wide PDF render service (settings.CHATBOT_PDF_WORKERS, CHATBOT_PDF_FONT, ...)"""
+    global _renderer
+    if _renderer is None:
+        from django.conf import settings
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = PDFRenderService(
+                    workers=settings.CHATBOT_PDF_WORKERS,
+                    max_pending=settings.CHATBOT_PDF_MAX_PENDING,
+                    timeout=settings.CHATBOT_PDF_RENDER_TIMEOUT,
+                    font_path=settings.CHATBOT_PDF_FONT,
+                    bold_font_path=settings.CHATBOT_PDF_FONT_BOLD,
+                )
+    return _renderer
+
+def set_pdf_renderer(renderer):
+    """Replace the process-wide PDF render service (e.g. an in-process one for benchmarks)"""
+    global _renderer
+    _renderer = renderer
@@ -0,0 +1,106 @@
+# prompts.py
+# Prompt registry - every system instruction variant is built once at import time
+
+import hashlib
+from collections import namedtuple
+
+from .agent_utils import estimate_tokens
+
+# ===========================
+# LANGUAGE NORMALIZATION
+# ===========================
+
+# Languages detect_language_preference can report; one prompt variant is prebuilt per language
+PROMPT_LANGUAGES = (None, "Urdu/Hindi", "Spanish", "French", "Arabic", "English")
+
+def normalize_language(language):
+    """
+    Map a stored language value onto one of PROMPT_LANGUAGES
+
+    Returns:
+        str or None: Canonical language name, or the stripped value if it is not a known language
+    """
+    if not language:
+        return None
+    lowered = language.lower()
+    if "urdu" in lowered or "hindi" in lowered or "اردو" in language or "हिंदी" in language:
+        return "Urdu/Hindi"
+    for canonical in ("Spanish", "French", "Arabic", "English"):
+        if canonical.lower() in lowered:
+            return canonical
+    return language.strip()
+
+# ===========================
+# PROMPT REGISTRY
+# ===========================
+
+PromptVariant = namedtuple("PromptVariant", ["agent", "language", "crisis", "plan", "content", "token_count", "content_hash"])
+
+def _variant(agent, language, crisis, plan, content):
+    return PromptVariant(
+        agent, language, crisis, plan, content,
+        estimate_tokens(content),
+        hashlib.sha256(content.encode("utf-8")).hexdigest(),
+    )
+
+class PromptRegistry:
+    """
+    Prebuilt system prompts keyed by (agent, language, crisis mode, specific-plan mode)
+
+    Each agent registers a builder that assembles its system instructions for
+    one key; the registry runs it for every known language and mode up front,
+    so a turn only does a dict lookup and always gets the same bytes for the
+    same key (which keeps provider-side prompt caching effective). A language
+    outside PROMPT_LANGUAGES is built on first use and kept as well.
+    """
+
+    def __init__(self):
+        self._builders = {}
+        self._variants = {}
+
+    def register(self, agent, builder, modes=((False, False),)):
+        """
+        Register an agent prompt builder and prebuild all of its variants
+
+        Args:
+            agent: Agent name used for lookups
+            builder: Callable (language, crisis, plan) -> system instructions
+            modes: The (crisis, plan) combinations the agent distinguishes
+        """
+        self._builders[agent] = (builder, tuple(modes))
+        for language in PROMPT_LANGUAGES:
+            for crisis, plan in modes:
+                self._variants[(agent, language, crisis, plan)] = _variant(agent, language, crisis, plan, builder(language, crisis, plan))
+
+    def get(self, agent, language=None, crisis=False, plan=False):
+        """
+        Get the prebuilt prompt variant for a turn
+
+        Modes the agent does not distinguish fall back to the closest
+        registered one (e.g. the plan flag is ignored outside crisis mode).
+
+        Returns:
+            PromptVariant: Content, token count and content hash
+        """
+        language = normalize_language(language)
+        builder, modes = self._builders[agent]
+        if (crisis, plan) not in modes:
+            plan = False
+            if (crisis, plan) not in modes:
+                crisis = False
+        key = (agent, language, crisis, plan)
+        variant = self._variants.get(key)
+        if variant is None:
+            variant = _variant(agent, language, crisis, plan, builder(language, crisis, plan))
+            self._variants[key] = variant
+        return variant
+
+    def system_message(self, agent, language=None, crisis=False, plan=False):
+        """Get the system message dict for a turn"""
+        return {"role": "system", "content": self.get(agent, language, crisis, plan).content}
+
+    def variants(self):
+        """Get all built variants, e.g. for inspection or budgeting"""
+        return list(self._variants.values())
+
+PROMPT_REGISTRY = PromptRegistry()
@@ -0,0 +1,174 @@
+# response_cache.py
+# Opt-in exact-match cache of orchestrator replies to low-risk opening turns ("hi", "salam", "I speak Urdu")
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .keywords import matched_categories
+from .message_analysis import is_crisis_message
+from .metrics import RESPONSE_CACHE_LOOKUPS, RESPONSE_CACHE_SAVED_SECONDS
+from .prompts import normalize_language
+from .risk_assessment import RiskLevel, peak_risk, split_risk_trailer
+from .tracing import tag_trace
+
+# ===========================
+# CACHE KEY
+# ===========================
+
+# Keyword categories that make a turn ineligible, however harmless the rest looks
+RISK_CATEGORIES = frozenset({"suicidal", "concern_urdu", "hopelessness", "crisis", "specific_plan"})
+
+_TRAILING_PUNCTUATION = re.compile(r"[\s.!?,;:،۔؟]+$")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_message(message):
+    """Normalize a user message for exact matching: case, spacing and trailing punctuation"""
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", message.strip().lower()))
+
+def history_fingerprint(prompt_history):
+    """
+    Get a fingerprint of the history part of a prompt (summary and history window)
+
+    Returns:
+        str: "" for no history, otherwise a short content hash
+    """
+    if not prompt_history:
+        return ""
+    canonical = json.dumps([[message["role"], message["content"]] for message in prompt_history], ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:24]
+
+def response_cache_key(agent, user_message, user_content, messages, conversation_history, session_data, analysis):
+    """
+    Get the cache key of a turn, or None when the turn must go to the model
+
+    A turn is only eligible when it is plain text (no attachment note), no
+    risk, concern or referral signal is in the message, the analysis or
+    any earlier user message, no earlier reply was assessed above LOW
+    risk, and no referral offer is pending (the next reply depends on it).
+
+    Args:
+        messages: The prompt built for the turn (system, history, user)
+
+    Returns:
+        str: Key from (agent, language, normalized message, history fingerprint), or None
+    """
+    if not settings.CHATBOT_RESPONSE_CACHE or user_content != user_message:
+        return None
+    if analysis.is_suicidal or analysis.has_concern or analysis.has_specific_plan or analysis.wants_referral:
+        return None
+    if session_data.get("referred_to_interview") or matched_categories(user_message) & RISK_CATEGORIES:
+        return None
+    if peak_risk(session_data) > RiskLevel.LOW:
+        return None
+    if any(is_crisis_message(message) for message in conversation_history):
+        return None
+    parts = [
+        agent,
+        normalize_language(analysis.language) or "",
+        normalize_message(user_message),
+        history_fingerprint(messages[1:-1]),
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def cacheable_response(bot_response, should_switch):
+    """Check whether a finished reply (with its risk trailer) may be reused: a complete reply that assessed the turn as LOW risk"""
+    return not should_switch and split_risk_trailer(bot_response)[1].level == RiskLevel.LOW
+
+# ===========================
+# CACHE
+# ===========================
+
+class ResponseCache:
+    """
+    Replies by turn key, most recently used first
+
+    Holds at most `max_items` replies, each for `ttl` seconds. Every entry
+    remembers how long the model took to produce it, which a hit reports as
+    time saved.
+    """
+
+    def __init__(self, max_items=256, ttl=3600.0):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a live entry
+
+        Returns:
+            tuple: (reply, seconds the model took), or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[2] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def put(self, key, bot_response, model_seconds):
+        with self._lock:
+            self._entries[key] = (bot_response, model_seconds, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """Get the process-wide response cache (settings.CHATBOT_RESPONSE_CACHE_SIZE, CHATBOT_RESPONSE_CACHE_TTL)"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(settings.CHATBOT_RESPONSE_CACHE_SIZE, settings.CHATBOT_RESPONSE_CACHE_TTL)
+    return _cache
+
+# ===========================
+# TURN HELPERS
+# ===========================
+
+def cached_response(key):
+    """
+    Look up a turn, recording the outcome
+
+    Returns:
+        str: Cached reply, or None on a miss or for an ineligible turn (key None)
+    """
+    if key is None:
+        if settings.CHATBOT_RESPONSE_CACHE:
+            RESPONSE_CACHE_LOOKUPS.inc(result="bypass")
+        return None
+    entry = get_response_cache().get(key)
+    if entry is None:
+        RESPONSE_CACHE_LOOKUPS.inc(result="miss")
+        tag_trace(response_cache="miss")
+        return None
+    bot_response, model_seconds = entry
+    RESPONSE_CACHE_LOOKUPS.inc(result="hit")
+    RESPONSE_CACHE_SAVED_SECONDS.inc(model_seconds)
+    tag_trace(response_cache="hit")
+    return bot_response
+
+def remember_response(key, bot_response, should_switch, model_seconds):
+    """Store a finished reply under its turn key if the reply may be reused"""
+    if key is not None and cacheable_response(bot_response, should_switch):
+        get_response_cache().put(key, bot_response, model_seconds)
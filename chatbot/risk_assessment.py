@@ -0,0 +1,294 @@
+# risk_assessment.py
+# The risk trailer agents end each reply with - parsed into compact codes, stripped from what users see,
+# and kept per session in a small ring buffer
+
+import re
+from collections import namedtuple
+from enum import IntEnum
+
+# ===========================
+# RISK CODES
+# ===========================
+
+class RiskLevel(IntEnum):
+    """Risk level from an agent's assessment, ordered by severity (NONE = the reply had no assessment)"""
+
+    NONE = 0
+    LOW = 1
+    MODERATE = 2
+    HIGH = 3
+    CRISIS = 4
+
+class NextStep(IntEnum):
+    """The kind of next step an agent named in its assessment"""
+
+    UNKNOWN = 0
+    CONTINUE = 1
+    MONITOR = 2
+    SAFETY_PLAN = 3
+    REFER = 4
+    ESCALATE = 5
+
+# Checked in order against the lowercased "Next Step" text; the first match wins
+NEXT_STEP_KEYWORDS = (
+    (NextStep.ESCALATE, ("human escalation", "coordinate human", "helpline", "emergency")),
+    (NextStep.REFER, ("refer", "interview agent")),
+    (NextStep.SAFETY_PLAN, ("safety plan", "professional support")),
+    (NextStep.MONITOR, ("monitor", "coping")),
+    (NextStep.CONTINUE, ("continue",)),
+)
+
+# How an assessment is written back into prompts, in the format the agents are asked for
+NEXT_STEP_TEXT = {
+    NextStep.UNKNOWN: "Continue supportive conversation",
+    NextStep.CONTINUE: "Continue supportive conversation",
+    NextStep.MONITOR: "Continue supportive conversation, monitor closely",
+    NextStep.SAFETY_PLAN: "Continue safety assessment, generate personalized safety plan",
+    NextStep.REFER: "Refer to interview agent for detailed assessment",
+    NextStep.ESCALATE: "IMMEDIATE safety assessment, coordinate human escalation",
+}
+
+# refer: the reply carried the orchestrator's referral marker
+RiskAssessment = namedtuple("RiskAssessment", ["level", "next_step", "refer"], defaults=(False,))
+
+NO_ASSESSMENT = RiskAssessment(RiskLevel.NONE, NextStep.UNKNOWN)
+
+def classify_next_step(text):
+    """Map free "Next Step" text onto a NextStep code"""
+    lowered = (text or "").lower()
+    if not lowered.strip():
+        return NextStep.UNKNOWN
+    for step, keywords in NEXT_STEP_KEYWORDS:
+        if any(keyword in lowered for keyword in keywords):
+            return step
+    return NextStep.CONTINUE
+
+# ===========================
+# TRAILER PARSING
+# ===========================
+
+# Control marker the orchestrator adds when it hands the user to the interview agent (never shown to users)
+REFER_MARKER = "[REFER_TO_INTERVIEW_AGENT]"
+
+# The "Risk Level: ..." line both agents are told to end every reply with
+RISK_LEVEL_PATTERN = re.compile(r"Risk Level\W*(LOW|MODERATE|HIGH|CRISIS)", re.IGNORECASE)
+
+_LEVEL = r"\[?[^\S\n]*(LOW|MODERATE|HIGH|CRISIS)[^\S\n]*\]?"
+_HEADER = r"\(?\**[^\S\n]*LANGUAGE-AWARE RISK ASSESSMENT\**[^\S\n]*:?[^\S\n]*\**[^\S\n]*(?:" + _LEVEL + r")?[^\S\n]*\**[^\S\n]*\)?"
+_RISK_LINE = r"\**[^\S\n]*Risk Level[^\S\n]*\**[^\S\n]*:?[^\S\n]*\**[^\S\n]*" + _LEVEL + r"[^\S\n]*\**[^\S\n]*\.?"
+_NEXT_LINE = r"\**[^\S\n]*Next Step[^\S\n]*\**[^\S\n]*:?[^\S\n]*\**[^\S\n]*([^\n]*?)[^\S\n]*\**[^\S\n]*(?=\n|\Z)"
+
+# A trailer anywhere in a reply: optional "(LANGUAGE-AWARE RISK ASSESSMENT: X)" header, the "Risk Level: X"
+# line and an optional "Next Step: ..." line, each optionally in markdown bold
+TRAILER_PATTERN = re.compile(
+    r"\s*(?:" + _HEADER + r"\s*)?" + _RISK_LINE + r"(?:\s*" + _NEXT_LINE + r")?",
+    re.IGNORECASE,
+)
+
+# The same without a "Risk Level" line, when the header carries the level
+HEADER_TRAILER_PATTERN = re.compile(
+    r"\s*" + _HEADER.replace(r"(?:" + _LEVEL + r")?", _LEVEL) + r"(?:\s*" + _NEXT_LINE + r")?",
+    re.IGNORECASE,
+)
+
+def parse_risk_level(response):
+    """
+    Get the risk level an agent reported in its reply
+
+    Returns:
+        str: LOW, MODERATE, HIGH or CRISIS, or None when the reply has no assessment
+    """
+    matches = RISK_LEVEL_PATTERN.findall(response or "")
+    return matches[-1].upper() if matches else None
+
+def _last_trailer(text):
+    """Find the last trailer in the text (a "Risk Level" line preferred over a bare header)"""
+    for pattern in (TRAILER_PATTERN, HEADER_TRAILER_PATTERN):
+        found = None
+        for found in pattern.finditer(text):
+            pass
+        if found is not None:
+            return found
+    return None
+
+def split_risk_trailer(response):
+    """
+    Separate the reply the user should see from its risk trailer
+
+    The last trailer is cut wherever it is - models sometimes add a closing
+    line or the referral marker after it, which stays visible (the marker
+    never does). The referral marker is reported in the assessment.
+
+    Returns:
+        tuple: (visible text, RiskAssessment)
+    """
+    response = response or ""
+    refer = REFER_MARKER in response
+    text = response.replace(REFER_MARKER, "")
+    found = _last_trailer(text)
+    if found is None:
+        return text.strip(), NO_ASSESSMENT._replace(refer=refer)
+    groups = [group for group in found.groups()]
+    next_step = groups[-1]
+    level = next(group for group in groups[:-1] if group)
+    before, after = text[:found.start()].rstrip(), text[found.end():].strip()
+    visible = f"{before}\n\n{after}" if before and after else before or after
+    return visible, RiskAssessment(RiskLevel[level.upper()], classify_next_step(next_step), refer)
+
+def format_risk_trailer(assessment):
+    """Write an assessment back as the trailer the agents produce (for replaying history into prompts)"""
+    level = assessment.level.name
+    return f"\n\n(LANGUAGE-AWARE RISK ASSESSMENT: {level})\nRisk Level: {level}\nNext Step: {NEXT_STEP_TEXT[assessment.next_step]}"
+
+# Lowercase text that starts a trailer; streamed text is held back from the first one on
+TRAILER_MARKERS = ("language-aware risk assessment", "risk level")
+
+def _partial_marker_length(text, marker):
+    """Get the length of the longest ending of `text` that could be the start of `marker`"""
+    for length in range(min(len(marker) - 1, len(text)), 0, -1):
+        if marker.startswith(text[-length:]):
+            return length
+    return 0
+
+class RiskTrailerFilter:
+    """
+    Remove the risk trailer and the referral marker from a reply while it streams
+
+    feed() returns the part of the text that is certainly not trailer: the
+    referral marker is dropped as soon as it is complete (a possible start
+    of it is held back), and once a trailer marker appears, everything from
+    it is held back, as is any ending that could be the start of one.
+    finish() releases what was held if it turned out not to be trailer.
+    Costs no more than the held-back tail per delta.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pending = ""
+        self._clean = ""
+        self._lowered = ""
+        self._sent = 0
+        self._trailer_start = None
+        self._longest_marker = max(len(marker) for marker in TRAILER_MARKERS)
+
+    def feed(self, delta):
+        self.text += delta
+        self._pending = (self._pending + delta).replace(REFER_MARKER, "")
+        held = _partial_marker_length(self._pending, REFER_MARKER)
+        ready = self._pending[:len(self._pending) - held]
+        self._pending = self._pending[len(self._pending) - held:]
+        return self._feed_clean(ready)
+
+    def _feed_clean(self, ready):
+        self._clean += ready
+        self._lowered += ready.lower()
+        if self._trailer_start is not None:
+            return ""
+        search_from = max(self._sent - self._longest_marker, 0)
+        positions = [self._lowered.find(marker, search_from) for marker in TRAILER_MARKERS]
+        positions = [position for position in positions if position >= 0]
+        if positions:
+            start = min(positions)
+            while start > self._sent and self._clean[start - 1] in " \t\r\n(*[":
+                start -= 1
+            self._trailer_start = start
+            return self._release(start)
+        end = len(self._clean)
+        for length in range(min(self._longest_marker, end), 0, -1):
+            tail = self._lowered[end - length:]
+            if any(marker.startswith(tail) for marker in TRAILER_MARKERS):
+                end -= length
+                break
+        while end > self._sent and self._clean[end - 1] in " \t\r\n(*[":
+            end -= 1
+        return self._release(end)
+
+    def _release(self, end):
+        if end <= self._sent:
+            return ""
+        piece = self._clean[self._sent:end]
+        self._sent = end
+        return piece
+
+    def finish(self):
+        """
+        Release the held-back text that is not part of a trailer
+
+        Returns:
+            str: Remaining visible text
+        """
+        self._clean += self._pending
+        self._pending = ""
+        visible, _ = split_risk_trailer(self._clean)
+        sent = self._clean[:self._sent]
+        if not visible.startswith(sent):
+            # Already sent text was reshaped (should not happen); the final reply replaces the deltas anyway
+            return ""
+        self._sent = len(self._clean)
+        return visible[len(sent):]
+
+# ===========================
+# PER-SESSION RISK TIMELINE
+# ===========================
+
+# Assessments kept per conversation; older ones are overwritten
+RISK_TIMELINE_SIZE = 16
+
+# Agent codes stored in the timeline
+AGENT_CODES = {"orchestrator": "o", "interview": "i"}
+
+RiskEntry = namedtuple("RiskEntry", ["turn", "agent", "level", "next_step"])
+
+def record_risk(session_data, turn, agent, assessment):
+    """
+    Store a turn's assessment in the session's ring buffer
+
+    The buffer is {"next": write count, "entries": [[turn, agent code, level, next step], ...]},
+    small enough to travel with the session state.
+    """
+    timeline = session_data.get("risk_timeline") or {"next": 0, "entries": []}
+    entry = [turn, AGENT_CODES.get(agent, agent[:1]), int(assessment.level), int(assessment.next_step)]
+    slot = timeline["next"] % RISK_TIMELINE_SIZE
+    if slot < len(timeline["entries"]):
+        timeline["entries"][slot] = entry
+    else:
+        timeline["entries"].append(entry)
+    timeline["next"] += 1
+    session_data["risk_timeline"] = timeline
+
+def risk_timeline(session_data):
+    """
+    Get the session's stored assessments, oldest first
+
+    Returns:
+        list: RiskEntry tuples (level and next_step as RiskLevel/NextStep)
+    """
+    timeline = session_data.get("risk_timeline")
+    if not timeline:
+        return []
+    entries = timeline["entries"]
+    if len(entries) == RISK_TIMELINE_SIZE:
+        slot = timeline["next"] % RISK_TIMELINE_SIZE
+        entries = entries[slot:] + entries[:slot]
+    agents = {code: agent for agent, code in AGENT_CODES.items()}
+    return [RiskEntry(turn, agents.get(agent, agent), RiskLevel(level), NextStep(step)) for turn, agent, level, step in entries]
+
+def latest_risk(session_data):
+    """Get the most recent assessment of the session, or None"""
+    timeline = risk_timeline(session_data)
+    return timeline[-1] if timeline else None
+
+def peak_risk(session_data, last=None):
+    """
+    Get the highest risk level among the session's assessments
+
+    Args:
+        last: Only look at this many of the most recent assessments
+
+    Returns:
+        RiskLevel: NONE when nothing was assessed
+    """
+    timeline = risk_timeline(session_data)
+    if last is not None:
+        timeline = timeline[-last:]
+    return max((entry.level for entry in timeline), default=RiskLevel.NONE)
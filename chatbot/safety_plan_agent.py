@@ -2,16 +2,16 @@
 # Safety Plan Agent - Generates personalized safety plans, handles escalation, and provides support
 
 import os
-import io
+import json
+import hashlib
 from datetime import datetime
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from django.conf import settings
 from django.http import HttpResponse
-from .agent_utils import get_groq_client, detect_mental_health_concerns, detect_suicidal_keywords
+from .agent_utils import get_groq_client
+from .escalation_queue import enqueue_escalation
+from .message_analysis import analyze_message
+from .pdf_renderer import render_pdf
+from .risk_assessment import RiskLevel, peak_risk
 
 # ===========================
 # SAFETY PLAN AGENT CONFIGURATION
@@ -19,21 +19,37 @@ from .agent_utils import get_groq_client, detect_mental_health_concerns, detect_
 
 SAFETY_PLAN_AGENT_NAME = "Safety Plan Coordinator"
 
-def generate_safety_plan_content(user_message, conversation_history, session_data):
+# Assessments (from the session's risk timeline) the plan and escalations look back on - one calmer reply doesn't lower them
+RECENT_RISK_TURNS = 3
+
+def generate_safety_plan_content(user_message, conversation_history, session_data, analysis=None):
     """
     Generate personalized safety plan content based on conversation
     
+    The risk level is CRISIS when the message itself signals a crisis,
+    otherwise the highest recent assessment from the session's risk
+    timeline (HIGH when nothing was assessed).
+    
     Returns:
         dict: Safety plan content with sections
     """
+    if analysis is None:
+        analysis = analyze_message(user_message)
     user_language = session_data.get("language") or "English"
-    has_crisis = detect_suicidal_keywords(user_message) or detect_mental_health_concerns(user_message)
+    has_crisis = analysis.is_suicidal or analysis.has_concern
+    assessed = peak_risk(session_data, last=RECENT_RISK_TURNS)
+    if has_crisis:
+        risk_level = "CRISIS"
+    elif assessed != RiskLevel.NONE:
+        risk_level = assessed.name
+    else:
+        risk_level = "HIGH"
     
     # Extract key information from conversation
     plan_content = {
         "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "language": user_language,
-        "risk_level": "CRISIS" if has_crisis else "HIGH",
+        "risk_level": risk_level,
         "sections": {
             "immediate_safety": [],
             "coping_strategies": [],
@@ -82,27 +98,43 @@ def generate_safety_plan_content(user_message, conversation_history, session_dat
     
     return plan_content
 
-def trigger_human_escalation(user_message, session_data):
+def safety_plan_version(plan_content):
+    """
+    Get the version of a safety plan: a hash of what it says, ignoring when it was made
+    
+    Returns:
+        str: Short content hash
+    """
+    versioned = {key: plan_content.get(key) for key in ("language", "risk_level", "sections")}
+    canonical = json.dumps(versioned, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+def trigger_human_escalation(user_message, session_data, analysis=None, conversation_id=None):
     """
     Trigger human escalation (doctor/moderator/helpline)
     
+    The escalation is queued (chatbot.escalation_queue) and delivered to the
+    on-call doctor, moderator and helpline sinks in the background, so the
+    reply never waits on them. Repeats within one conversation are folded
+    into a single notification. The escalation is URGENT when the message
+    signals a crisis or a recent assessment in the session's risk timeline
+    was HIGH or above.
+    
     Returns:
-        dict: Escalation information
+        dict: Escalation information, with "dispatch" telling how the queue took it
     """
-    has_crisis = detect_suicidal_keywords(user_message) or detect_mental_health_concerns(user_message)
+    if analysis is None:
+        analysis = analyze_message(user_message)
+    has_crisis = analysis.is_suicidal or analysis.has_concern
+    risk_level = peak_risk(session_data, last=RECENT_RISK_TURNS)
     
     escalation = {
         "triggered": has_crisis,
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "priority": "URGENT" if has_crisis else "HIGH",
-        "notified": True  # In real implementation, this would notify actual professionals
+        "priority": "URGENT" if has_crisis or risk_level >= RiskLevel.HIGH else "HIGH",
+        "risk_level": risk_level.name,
     }
-    
-    # In production, this would:
-    # 1. Notify on-call doctor/psychiatrist
-    # 2. Alert moderator/admin
-    # 3. Trigger helpline callback
-    # 4. Log to emergency response system
+    escalation["dispatch"] = enqueue_escalation(conversation_id, escalation)
     
     return escalation
 
@@ -166,110 +198,43 @@ def format_safety_plan_html(plan_content):
 
 def generate_pdf(plan_content, user_id=None):
     """
-    Generate PDF from safety plan content
+    Generate PDF from safety plan content in this process
+    
+    Downloads go through chatbot.pdf_cache, which renders in the PDF
+    process pool; this is the in-process layout for scripts and benchmarks.
     
     Returns:
         bytes: PDF file content
     """
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-    
-    # Container for PDF elements
-    story = []
-    
-    # Define styles
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        spaceAfter=30,
-        alignment=1,  # Center alignment
-        textColor=(0.2, 0.3, 0.6)
-    )
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=16,
-        spaceAfter=12,
-        spaceBefore=12,
-        textColor=(0.3, 0.5, 0.8)
-    )
-    
-    # Title
-    user_language = plan_content.get("language") or "English"
-    if user_language and ("urdu" in user_language.lower() or "hindi" in user_language.lower()):
-        title_text = "Personalized Safety Plan<br/>شخصی حفاظتی منصوبہ"
-    else:
-        title_text = "Personalized Safety Plan"
-    
-    story.append(Paragraph(title_text, title_style))
-    story.append(Spacer(1, 0.2*inch))
-    
-    # Date
-    date_text = f"Generated: {plan_content.get('created_at', 'N/A')}"
-    story.append(Paragraph(date_text, styles['Normal']))
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Risk Level
-    risk_level = plan_content.get("risk_level", "HIGH")
-    risk_text = f"<b>Risk Level: {risk_level}</b>"
-    story.append(Paragraph(risk_text, styles['Normal']))
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Sections
-    sections = plan_content.get("sections", {})
-    
-    if user_language and ("urdu" in user_language.lower() or "hindi" in user_language.lower()):
-        section_titles = {
-            "immediate_safety": "Immediate Safety Steps<br/>فوری حفاظتی اقدامات",
-            "coping_strategies": "Coping Strategies<br/>نمٹنے کی حکمت عملی",
-            "support_resources": "Support Resources<br/>مدد کے وسائل",
-            "emergency_contacts": "Emergency Contacts<br/>ایمرجنسی رابطے"
-        }
-    else:
-        section_titles = {
-            "immediate_safety": "Immediate Safety Steps",
-            "coping_strategies": "Coping Strategies",
-            "support_resources": "Support Resources",
-            "emergency_contacts": "Emergency Contacts"
-        }
-    
-    for section_key, items in sections.items():
-        if items:
-            story.append(Paragraph(section_titles.get(section_key, section_key.title()), heading_style))
-            for item in items:
-                story.append(Paragraph(f"• {item}", styles['Normal']))
-                story.append(Spacer(1, 0.1*inch))
-            story.append(Spacer(1, 0.2*inch))
-    
-    # Build PDF
-    doc.build(story)
-    buffer.seek(0)
-    return buffer.getvalue()
+    return render_pdf(plan_content, settings.CHATBOT_PDF_FONT, settings.CHATBOT_PDF_FONT_BOLD)
 
-def process_safety_plan(user_message, conversation_history, session_data, user_id=None):
+def process_safety_plan(user_message, conversation_history, session_data, user_id=None, analysis=None, previous_version=None, conversation_id=None):
     """
     Process safety plan generation and escalation
     
+    The HTML is only formatted when the plan differs from `previous_version`
+    (the version the user already has); otherwise "safety_plan_html" is None.
+    
     Returns:
-        dict: Safety plan data, escalation info, support message, and HTML formatted plan
+        dict: Safety plan data, version, escalation info, support message, and HTML formatted plan
     """
     # Generate safety plan content
-    plan_content = generate_safety_plan_content(user_message, conversation_history, session_data)
+    plan_content = generate_safety_plan_content(user_message, conversation_history, session_data, analysis)
+    version = safety_plan_version(plan_content)
     
     # Trigger human escalation
-    escalation = trigger_human_escalation(user_message, session_data)
+    escalation = trigger_human_escalation(user_message, session_data, analysis, conversation_id)
     
     # Get support message
     user_language = session_data.get("language") or "English"
     support_message = get_support_message(user_language)
     
     # Format safety plan as HTML for chat display
-    safety_plan_html = format_safety_plan_html(plan_content)
+    safety_plan_html = format_safety_plan_html(plan_content) if version != previous_version else None
     
     return {
         "plan_content": plan_content,
+        "version": version,
         "escalation": escalation,
         "support_message": support_message,
         "safety_plan_html": safety_plan_html
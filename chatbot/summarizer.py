@@ -0,0 +1,166 @@
+# summarizer.py
+# Rolling summary of older conversation turns, updated incrementally off the request path
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils.html import strip_tags
+
+from .agent_utils import stream_chat_completion
+from .context_builder import truncate_to_tokens
+from .conversation_store import get_conversation_store
+
+# ===========================
+# CONFIGURATION
+# ===========================
+
+# Most recent messages never summarized, so the agents always see them verbatim
+SUMMARY_KEEP_RECENT = 10
+
+# Summarize only once this many messages have fallen out of the recent window
+SUMMARY_BATCH = 10
+
+# Longest summary the model may write, and the most of one message it reads
+SUMMARY_MAX_TOKENS = 350
+SUMMARY_MESSAGE_TOKENS = 300
+
+SUMMARY_SYSTEM_INSTRUCTIONS = """You maintain a running clinical summary of a mental health support conversation.
+
+Update the existing summary with the new turns and return only the updated summary.
+Always keep, with the user's own details:
+- Suicidal thoughts, self-harm, plans, means, timeline and the latest risk level
+- Main stressors, symptoms and how long they have lasted
+- Protective factors, support people and whether the user is alone
+- Preferred language, referrals made and safety plan status
+Drop greetings and small talk. Never invent facts. Write in English, in short plain sentences, at most 200 words."""
+
+SUMMARY_PREFIX = "Summary of the earlier conversation (older turns are not shown):\n"
+
+# ===========================
+# SUMMARY UPDATE
+# ===========================
+
+def summarized_until(session_data, conversation_history):
+    """Get how many history messages the summary covers (0 after a conversation reset)"""
+    covered = session_data.get("summarized_until", 0)
+    return covered if covered <= len(conversation_history) else 0
+
+def summary_message(session_data, conversation_history):
+    """Get the system message carrying the rolling summary, or None before the first summary"""
+    summary = session_data.get("summary")
+    if not summary or not summarized_until(session_data, conversation_history):
+        return None
+    return {"role": "system", "content": SUMMARY_PREFIX + summary}
+
+def pending_messages(session_data, conversation_history):
+    """Get the older messages that are not in the summary yet"""
+    return conversation_history[summarized_until(session_data, conversation_history):len(conversation_history) - SUMMARY_KEEP_RECENT]
+
+def needs_summary(session_data, conversation_history):
+    """Check whether enough messages have accumulated for a summary update"""
+    return len(pending_messages(session_data, conversation_history)) >= SUMMARY_BATCH
+
+def _complete(messages):
+    """
+    Run a summary completion through the model fallback chain
+
+    Raises when the stream breaks part-way - a truncated summary must never
+    replace the stored one.
+    """
+    return "".join(stream_chat_completion(messages, temperature=0.2, max_tokens=SUMMARY_MAX_TOKENS, raise_errors=True))
+
+def update_summary(session_data, conversation_history, complete=None):
+    """
+    Fold the pending older messages into the rolling summary
+
+    Only the new messages and the previous summary are sent to the model,
+    never the whole conversation.
+
+    Args:
+        complete: Callable (messages) -> text; defaults to the Groq model
+                  chain, and can be replaced with a stub for tests
+
+    Returns:
+        tuple: (summary, summarized_until), or None if there is nothing to do
+    """
+    pending = pending_messages(session_data, conversation_history)
+    if not pending:
+        return None
+
+    lines = []
+    for message in pending:
+        speaker = "User" if message.get("role") == "user" else "Assistant"
+        text = truncate_to_tokens(strip_tags(message.get("content", "")).strip(), SUMMARY_MESSAGE_TOKENS)
+        lines.append(f"{speaker}: {text}")
+    previous = session_data.get("summary") if summarized_until(session_data, conversation_history) else None
+
+    summary = (complete or _complete)([
+        {"role": "system", "content": SUMMARY_SYSTEM_INSTRUCTIONS},
+        {"role": "user", "content": f"Existing summary:\n{previous or 'None yet.'}\n\nNew turns:\n" + "\n".join(lines)},
+    ]).strip()
+    if not summary:
+        return None
+    return summary, summarized_until(session_data, conversation_history) + len(pending)
+
+# ===========================
+# SCHEDULING
+# ===========================
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chatbot-summary")
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+def summarize_conversation(conversation_id, complete=None):
+    """
+    Update the stored summary of a conversation
+
+    The summary is written with a compare-and-set on its coverage, so
+    concurrent updates cannot overwrite each other and request saves in the
+    meantime never touch it.
+
+    Returns:
+        bool: True if a new summary was saved
+    """
+    store = get_conversation_store()
+    loaded = store.load(conversation_id)
+    if loaded is None:
+        return False
+    state, history = loaded
+    try:
+        result = update_summary(state, history, complete=complete)
+    except Exception as e:
+        print(f"⚠️ Summary update failed for {conversation_id}: {e}")
+        return False
+    if result is None:
+        return False
+
+    summary, covered = result
+    return store.save_summary(conversation_id, summary, covered, summarized_until(state, history))
+
+def _run_scheduled(conversation_id):
+    try:
+        summarize_conversation(conversation_id)
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(conversation_id)
+
+def schedule_summary(conversation_id, session_data):
+    """
+    Start a summary update after a turn is saved, if one is due
+
+    settings.CHATBOT_SUMMARY_MODE selects 'background' (a worker thread, off
+    the request path), 'inline' (before the response returns, e.g. on
+    serverless hosts that freeze after responding) or 'off'.
+    """
+    mode = settings.CHATBOT_SUMMARY_MODE
+    if mode == "off" or not needs_summary(session_data, session_data.get("conversation_history", [])):
+        return
+    if mode == "inline":
+        summarize_conversation(conversation_id)
+        return
+    with _in_flight_lock:
+        if conversation_id in _in_flight:
+            return
+        _in_flight.add(conversation_id)
+    _executor.submit(_run_scheduled, conversation_id)
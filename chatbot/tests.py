@@ -1,2 +1,740 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from unittest import mock
 
+from django.test import TestCase, override_settings
+from django.urls import include, path
+
+from . import views
+from .agent_utils import (
+    detect_language_preference,
+    detect_mental_health_concerns,
+    set_llm_backend,
+    stream_chat_completion,
+    turn_index,
+)
+from .conversation_store import (
+    CompactSQLiteConversationStore,
+    MemoryConversationStore,
+    SessionConversationStore,
+    SQLiteConversationStore,
+    get_conversation_store,
+    set_conversation_store,
+)
+from .escalation_queue import (
+    DirectEscalationDispatch,
+    EscalationQueue,
+    EscalationSink,
+    get_escalation_queue,
+    set_escalation_queue,
+)
+from .hedging import ahedged_chat_completion, hedged_chat_completion
+from .history_codec import COMPRESSIONS, CompactHistory, resolve_compression
+from .keywords import KEYWORD_TABLE, KeywordMatcher, ahocorasick
+from .llm_backends import AsyncDeltaStream, DeltaStream, LLMBackend, StubBackend
+from .model_router import CircuitBreaker, ModelRouter
+from .pdf_cache import PDFCache, pdf_plan, plan_pdf_key
+from .risk_assessment import NextStep, RiskLevel, RiskTrailerFilter, split_risk_trailer
+from .summarizer import SUMMARY_BATCH, SUMMARY_KEEP_RECENT, summarize_conversation
+
+CRISIS_TRAILER = (
+    "\n\n(LANGUAGE-AWARE RISK ASSESSMENT: CRISIS)\nRisk Level: CRISIS\n"
+    "Next Step: IMMEDIATE referral to interview agent - CRISIS situation detected"
+)
+
+class StubBackendTestCase(TestCase):
+    """Runs views and agents against a scripted StubBackend and an in-memory conversation store"""
+
+    script = None
+
+    def setUp(self):
+        self.backend = StubBackend(script=self.script, ttft=0, token_delay=0, failure_rate=0, record_calls=True)
+        set_llm_backend(self.backend)
+        set_conversation_store(MemoryConversationStore())
+
+    def tearDown(self):
+        # Back to the configured backend and store, created again on first use
+        set_llm_backend(None)
+        set_conversation_store(None)
+
+    def ask(self, message, url="/ask/"):
+        return self.client.post(url, json.dumps({"message": message}), content_type="application/json")
+
+# ===========================
+# RISK TRAILERS
+# ===========================
+
+class SplitRiskTrailerTests(TestCase):
+    def test_trailer_at_end(self):
+        visible, assessment = split_risk_trailer("I hear you." + CRISIS_TRAILER)
+        self.assertEqual(visible, "I hear you.")
+        self.assertEqual(assessment.level, RiskLevel.CRISIS)
+        self.assertEqual(assessment.next_step, NextStep.REFER)
+        self.assertFalse(assessment.refer)
+
+    def test_marker_inside_next_step_line(self):
+        visible, assessment = split_risk_trailer("Stay with me." + CRISIS_TRAILER + " [REFER_TO_INTERVIEW_AGENT]")
+        self.assertEqual(visible, "Stay with me.")
+        self.assertTrue(assessment.refer)
+
+    def test_marker_on_its_own_line_after_trailer(self):
+        visible, assessment = split_risk_trailer("Stay with me." + CRISIS_TRAILER + "\n[REFER_TO_INTERVIEW_AGENT]\n")
+        self.assertEqual(visible, "Stay with me.")
+        self.assertEqual(assessment.level, RiskLevel.CRISIS)
+        self.assertTrue(assessment.refer)
+
+    def test_closing_line_after_trailer_stays_visible(self):
+        visible, assessment = split_risk_trailer("Stay with me." + CRISIS_TRAILER + "\n\nI'm right here.")
+        self.assertEqual(visible, "Stay with me.\n\nI'm right here.")
+        self.assertEqual(assessment.level, RiskLevel.CRISIS)
+
+    def test_bold_markdown_trailer(self):
+        visible, assessment = split_risk_trailer("Hi\n\n**Risk Level:** HIGH\n**Next Step:** Refer to interview agent")
+        self.assertEqual(visible, "Hi")
+        self.assertEqual(assessment.level, RiskLevel.HIGH)
+
+    def test_no_trailer(self):
+        visible, assessment = split_risk_trailer("Just a reply")
+        self.assertEqual(visible, "Just a reply")
+        self.assertEqual(assessment.level, RiskLevel.NONE)
+
+    def test_streaming_filter_matches_split(self):
+        replies = [
+            "Stay with me." + CRISIS_TRAILER + "\n[REFER_TO_INTERVIEW_AGENT]",
+            "Stay with me. [REFER_TO_INTERVIEW_AGENT]" + CRISIS_TRAILER + "\n\nI'm right here.",
+            "My risk of missing the bus is high, honestly.",
+        ]
+        for reply in replies:
+            for size in (1, 3, 7):
+                trailer_filter = RiskTrailerFilter()
+                streamed = "".join(trailer_filter.feed(reply[i:i + size]) for i in range(0, len(reply), size))
+                streamed += trailer_filter.finish()
+                self.assertEqual(streamed, split_risk_trailer(reply)[0], (reply, size))
+
+@override_settings(CHATBOT_TRACING=False, CHATBOT_RESPONSE_CACHE=False)
+class OrchestratorHandoffTests(StubBackendTestCase):
+    """The model's referral must hand the user to the interview agent, wherever the marker sits"""
+
+    def _assert_hands_over(self, reply):
+        self.backend.script = [reply]
+        self.client.get("/")
+        payload = self.ask("I don't really know how to explain it, everything is too much").json()
+        self.assertEqual(payload["current_agent"], "interview")
+        self.assertNotIn("[REFER_TO_INTERVIEW_AGENT]", payload["response"])
+        self.assertNotIn("Risk Level", payload["response"])
+
+    def test_marker_in_next_step_line(self):
+        self._assert_hands_over("I'm so sorry you're feeling this way." + CRISIS_TRAILER + " [REFER_TO_INTERVIEW_AGENT]")
+
+    def test_marker_after_trailer(self):
+        self._assert_hands_over("I'm so sorry you're feeling this way." + CRISIS_TRAILER + "\n[REFER_TO_INTERVIEW_AGENT]")
+
+    def test_crisis_assessment_without_marker(self):
+        self._assert_hands_over("I'm so sorry you're feeling this way." + CRISIS_TRAILER)
+
+    def test_low_risk_stays_with_orchestrator(self):
+        self.backend.script = ["Nice to meet you!\n\n(LANGUAGE-AWARE RISK ASSESSMENT: LOW)\nRisk Level: LOW\nNext Step: Continue natural conversation"]
+        self.client.get("/")
+        payload = self.ask("hello there").json()
+        self.assertEqual(payload["current_agent"], "orchestrator")
+        self.assertEqual(payload["response"], "Nice to meet you!")
+
+    def test_stream_never_sends_control_text(self):
+        self.backend.script = ["I'm here with you. [REFER_TO_INTERVIEW_AGENT] Let me connect you with a specialist." + CRISIS_TRAILER]
+        self.client.get("/")
+        response = self.ask("I don't really know how to explain it, everything is too much", url="/ask/stream/")
+        events = b"".join(response.streaming_content).decode("utf-8").split("\n\n")
+        deltas = "".join(json.loads(event.split("data: ", 1)[1])["text"] for event in events if event.startswith("event: delta"))
+        self.assertNotIn("REFER_TO", deltas)
+        self.assertNotIn("Risk Level", deltas)
+        self.assertEqual(deltas, "I'm here with you.  Let me connect you with a specialist.")
+
+# ===========================
+# CONVERSATION STORES
+# ===========================
+
+def _turn(index):
+    return [
+        {"role": "user", "content": f"message {index}", "analysis": {"language": None, "suicidal": False}, "tokens": 3},
+        {"role": "assistant", "content": "I'm here with you.", "risk": [1, 1]},
+    ]
+
+class ConversationStoreTests(TestCase):
+    """The same behaviour from every store backend"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def stores(self, ttl=None):
+        yield MemoryConversationStore(ttl=ttl)
+        yield SQLiteConversationStore(os.path.join(self.directory.name, "rows.sqlite3"), ttl=ttl)
+        yield CompactSQLiteConversationStore(os.path.join(self.directory.name, "compact.sqlite3"), ttl=ttl)
+
+    def test_append_and_load(self):
+        for store in self.stores():
+            history = _turn(0)
+            store.save("c1", {"current_agent": "orchestrator"}, history)
+            history = history + _turn(1)
+            store.save("c1", {"current_agent": "interview"}, history)
+            state, loaded = store.load("c1")
+            self.assertEqual(state, {"current_agent": "interview"}, store)
+            self.assertEqual(loaded, history, store)
+            self.assertIsNone(store.load("missing"), store)
+
+    def test_shorter_history_resets_log_and_summary(self):
+        for store in self.stores():
+            store.save("c1", {}, _turn(0) + _turn(1))
+            self.assertTrue(store.save_summary("c1", "earlier turns", 2, 0), store)
+            store.save("c1", {}, _turn(5))
+            state, loaded = store.load("c1")
+            self.assertEqual(loaded, _turn(5), store)
+            self.assertNotIn("summary", state, store)
+
+    def test_expired_conversations_are_gone(self):
+        for store in self.stores(ttl=-1):
+            store.save("c1", {}, _turn(0))
+            self.assertEqual(store.evict_expired(), 1, store)
+            self.assertIsNone(store.load("c1"), store)
+            store.save("c2", {}, _turn(0))
+            self.assertIsNone(store.load("c2"), store)
+
+    def test_save_summary_is_compare_and_set(self):
+        for store in self.stores():
+            store.save("c1", {}, _turn(0) + _turn(1))
+            self.assertTrue(store.save_summary("c1", "first", 2, 0), store)
+            # A second update computed from the old coverage lost the race
+            self.assertFalse(store.save_summary("c1", "stale", 2, 0), store)
+            # Covering more messages than exist is refused
+            self.assertFalse(store.save_summary("c1", "too far", 10, 2), store)
+            state, _ = store.load("c1")
+            self.assertEqual((state["summary"], state["summarized_until"]), ("first", 2), store)
+
+    def test_compact_store_reads_row_store_conversations(self):
+        path = os.path.join(self.directory.name, "shared.sqlite3")
+        SQLiteConversationStore(path).save("c1", {"language": "English"}, _turn(0))
+        compact = CompactSQLiteConversationStore(path)
+        self.assertEqual(compact.load("c1"), ({"language": "English"}, _turn(0)))
+        compact.save("c1", {"language": "English"}, _turn(0) + _turn(1))
+        self.assertEqual(compact.load("c1")[1], _turn(0) + _turn(1))
+
+@override_settings(CHATBOT_TRACING=False, CHATBOT_RESPONSE_CACHE=False)
+class SessionConversationStoreTests(StubBackendTestCase):
+    script = ["Nice to meet you!\n\n(LANGUAGE-AWARE RISK ASSESSMENT: LOW)\nRisk Level: LOW\nNext Step: Continue natural conversation"]
+
+    def setUp(self):
+        super().setUp()
+        set_conversation_store(SessionConversationStore(max_messages=4))
+
+    def test_keeps_the_latest_turns(self):
+        store = SessionConversationStore(max_messages=4)
+        session = {}
+        store.save_session(session, {"current_agent": "interview"}, _turn(0) + _turn(1) + _turn(2))
+        state, loaded = store.load_session(session)
+        self.assertEqual(state["trimmed_messages"], 2)
+        self.assertEqual([message["content"] for message in loaded], [message["content"] for message in _turn(1) + _turn(2)])
+        self.assertNotIn("analysis", loaded[0])
+        store.save_session(session, state, loaded + _turn(3))
+        state, loaded = store.load_session(session)
+        self.assertEqual((state["trimmed_messages"], turn_index(state, loaded)), (4, 4))
+        self.assertIsNone(store.load("c1"))
+
+    def test_conversation_travels_in_the_session_cookie(self):
+        self.client.get("/")
+        for message in ("hello there", "how are you", "tell me something nice", "and another thing"):
+            self.assertEqual(self.ask(message).json()["response"], "Nice to meet you!")
+        # Four messages are kept: the two turns before the current one
+        prompt = [message["content"] for message in self.backend.calls[-1]["messages"]]
+        self.assertIn("how are you", prompt)
+        self.assertNotIn("hello there", prompt)
+        self.assertEqual(self.ask("hi again", url="/ask/stream/").status_code, 400)
+
+class CompactHistoryTests(TestCase):
+    def test_round_trip_with_every_compression(self):
+        history = _turn(0) + _turn(1) + [{"role": "tool", "content": "اردو میں بات کریں"}]
+        for compression in COMPRESSIONS:
+            if resolve_compression(compression) != compression:
+                continue
+            blob = CompactHistory.from_messages(history).encode(compression)
+            self.assertEqual(CompactHistory.decode(blob).to_messages(), history, compression)
+
+    def test_repeated_strings_are_stored_once(self):
+        compact = CompactHistory.from_messages(_turn(0) + _turn(0))
+        self.assertEqual(len(compact), 4)
+        self.assertEqual(len(compact.strings), 4)
+
+    def test_rejects_foreign_bytes(self):
+        with self.assertRaises(ValueError):
+            CompactHistory.decode(b'[{"role": "user"}]')
+
+# ===========================
+# KEYWORD MATCHING
+# ===========================
+
+KEYWORD_SAMPLES = (
+    "",
+    "I want to die, there is no point anymore",
+    "Kisi se baat karni hai, mujhe bohat pareshani hai",
+    "I SPEAK URDU and sometimes Hindi",
+    "میں آپ سے بات کرنا چاہتا ہوں",
+    "मुझे मदद चाहिए, मैं ठीक नहीं हूँ",
+    "ok yes please connect me with the interview specialist",
+    "The 8th floor balcony, the bridge, the train",
+    "Is there anything else I can help you with? Please seek help from a mental health professional.",
+    "skill kitchen kite: prefixes and overlaps inside words",
+    "KISI SE BAAT KARNI HAI",
+    "Thanks for listening",
+) + tuple(" ".join(entry.keywords) for entry in KEYWORD_TABLE.values())
+
+def _contains(text, keyword, casefold):
+    return keyword.lower() in text.lower() if casefold else keyword in text
+
+class KeywordMatcherTests(TestCase):
+    """The one-pass matcher must find exactly what the old per-keyword `in` loops found"""
+
+    def engines(self):
+        yield KeywordMatcher(KEYWORD_TABLE, use_automaton=False)
+        if ahocorasick is not None:
+            yield KeywordMatcher(KEYWORD_TABLE)
+
+    def test_categories_match_substring_loops(self):
+        for matcher in self.engines():
+            for text in KEYWORD_SAMPLES:
+                expected = {
+                    category for category, entry in KEYWORD_TABLE.items()
+                    if any(_contains(text, keyword, entry.casefold) for keyword in entry.keywords)
+                }
+                self.assertEqual(set(matcher.categories(text)), expected, (matcher.engine, text))
+
+    def test_matched_keywords_match_substring_loops(self):
+        for matcher in self.engines():
+            for text in KEYWORD_SAMPLES:
+                expected = {
+                    (category, keyword.lower() if entry.casefold else keyword) for category, entry in KEYWORD_TABLE.items()
+                    for keyword in entry.keywords if _contains(text, keyword, entry.casefold)
+                }
+                found = {(match.category, match.keyword) for match in matcher.scan(text)}
+                self.assertEqual(found, expected, (matcher.engine, text))
+
+    def test_offsets_point_at_the_keyword(self):
+        text = "Mujhe KISI se baat karni hai"
+        for matcher in self.engines():
+            for match in matcher.scan(text):
+                scanned = text.lower() if KEYWORD_TABLE[match.category].casefold else text
+                self.assertEqual(scanned[match.start:match.end], match.keyword)
+
+    def test_urdu_hindi_text_is_case_sensitive(self):
+        self.assertIsNone(detect_language_preference("Thanks for listening"))
+        self.assertIsNone(detect_language_preference("KISI SE BAAT KARNI HAI"))
+        self.assertEqual(detect_language_preference("kisi se baat karni hai"), "Urdu/Hindi")
+        # Other categories still ignore case
+        self.assertTrue(detect_mental_health_concerns("KISI SE BAAT KARNI HAI"))
+
+# ===========================
+# MODEL ROUTING
+# ===========================
+
+class CircuitBreakerTests(TestCase):
+    def test_opens_after_threshold_and_probes_after_cooldown(self):
+        breaker = CircuitBreaker(failure_threshold=2, cooldown=10)
+        breaker.record_failure("boom", now=0)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure("boom", now=1)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.available(5))
+        # Cooldown over: exactly one probe is let through
+        self.assertTrue(breaker.acquire(11))
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.acquire(11))
+        breaker.record_success(0.1)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.consecutive_failures, 0)
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=3, cooldown=10)
+        for now in range(3):
+            breaker.record_failure("boom", now=now)
+        self.assertTrue(breaker.acquire(20))
+        breaker.record_failure("still down", now=20)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.reopens_at(), 30)
+
+    def test_released_probe_can_be_taken_again(self):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=10)
+        breaker.record_failure("boom", now=0)
+        self.assertTrue(breaker.acquire(10))
+        breaker.release()
+        self.assertTrue(breaker.acquire(10))
+
+class ModelRouterTests(TestCase):
+    def setUp(self):
+        self.router = ModelRouter(["model-a", "model-b"], failure_threshold=1, cooldown=60)
+        patcher = mock.patch("chatbot.agent_utils.MODEL_ROUTER", self.router)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(set_llm_backend, None)
+
+    def test_falls_back_to_the_next_model(self):
+        backend = StubBackend(script=["fine"], ttft=0, token_delay=0, failure_rate=0, fail_models={"model-a"}, record_calls=True)
+        set_llm_backend(backend)
+        self.assertEqual("".join(stream_chat_completion([{"role": "user", "content": "hi"}])), "fine")
+        self.assertEqual([call["model"] for call in backend.calls], ["model-a", "model-b"])
+        self.assertEqual(self.router.candidates(), ["model-b"])
+
+    def test_fails_fast_when_every_breaker_is_open(self):
+        backend = StubBackend(
+            script=["never"], ttft=0, token_delay=0, failure_rate=0, fail_models={"model-a", "model-b"}, record_calls=True
+        )
+        set_llm_backend(backend)
+        with self.assertRaises(Exception):
+            list(stream_chat_completion([{"role": "user", "content": "hi"}]))
+        calls = len(backend.calls)
+        with self.assertRaisesMessage(RuntimeError, "circuit breakers open"):
+            list(stream_chat_completion([{"role": "user", "content": "hi"}]))
+        self.assertEqual(len(backend.calls), calls)
+
+    def test_calls_are_only_recorded_on_request(self):
+        backend = StubBackend(script=["fine"], ttft=0, token_delay=0, failure_rate=0)
+        set_llm_backend(backend)
+        self.assertEqual("".join(stream_chat_completion([{"role": "user", "content": "hi"}])), "fine")
+        self.assertEqual(backend.calls, [])
+
+    def test_dead_model_is_skipped(self):
+        self.router = ModelRouter(["model-a", "model-b"], failure_threshold=5)
+        self.router.record_failure("model-a", "Error code: 404 - model_not_found")
+        self.assertEqual(self.router.candidates(), ["model-b"])
+
+class PerModelBackend(LLMBackend):
+    """Backend with a fixed reply and first-token delay per model"""
+
+    def __init__(self, replies, delays=None):
+        self.replies = replies
+        self.delays = delays or {}
+
+    def is_configured(self):
+        return True
+
+    def open_stream(self, model, messages, temperature, max_tokens, timeout):
+        def deltas():
+            time.sleep(self.delays.get(model, 0))
+            yield from re.findall(r"\S+\s*", self.replies[model])
+
+        return DeltaStream(deltas())
+
+    async def aopen_stream(self, model, messages, temperature, max_tokens, timeout):
+        async def deltas():
+            await asyncio.sleep(self.delays.get(model, 0))
+            for word in re.findall(r"\S+\s*", self.replies[model]):
+                yield word
+
+        stream = deltas()
+        return AsyncDeltaStream(stream, stream.aclose)
+
+@override_settings(CHATBOT_HEDGE_CRISIS=True, CHATBOT_HEDGE_DELAY=0.05)
+class HedgingTests(TestCase):
+    """Only a leg that produced text may win a hedged crisis turn"""
+
+    def setUp(self):
+        router = ModelRouter(["model-a", "model-b", "model-c"], failure_threshold=5)
+        for target in ("chatbot.agent_utils.MODEL_ROUTER", "chatbot.hedging.MODEL_ROUTER"):
+            patcher = mock.patch(target, router)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(set_llm_backend, None)
+
+    def complete(self, replies, delays=None):
+        set_llm_backend(PerModelBackend(replies, delays))
+        messages = [{"role": "user", "content": "I can't go on"}]
+        sync_reply = "".join(hedged_chat_completion(messages, crisis=True))
+
+        async def collect():
+            return "".join([delta async for delta in ahedged_chat_completion(messages, crisis=True)])
+
+        self.assertEqual(asyncio.run(collect()), sync_reply)
+        return sync_reply
+
+    def test_empty_primary_falls_back(self):
+        self.assertEqual(self.complete({"model-a": "", "model-b": "I am here"}), "I am here")
+
+    def test_empty_alternate_does_not_beat_slow_primary(self):
+        reply = self.complete({"model-a": "Stay with me", "model-b": "", "model-c": ""}, delays={"model-a": 0.2})
+        self.assertEqual(reply, "Stay with me")
+
+    def test_every_leg_empty_raises(self):
+        with self.assertRaises(RuntimeError):
+            self.complete({"model-a": "", "model-b": "", "model-c": ""})
+
+# ===========================
+# ROLLING SUMMARY
+# ===========================
+
+def _long_history():
+    history = []
+    for index in range((SUMMARY_KEEP_RECENT + SUMMARY_BATCH) // 2):
+        history += _turn(index)
+    return history
+
+class SummarizerTests(StubBackendTestCase):
+    script = ["User reports poor sleep and work stress; risk LOW."]
+
+    def setUp(self):
+        super().setUp()
+        self.store = get_conversation_store()
+        self.store.save("c1", {"current_agent": "interview"}, _long_history())
+
+    def test_folds_older_turns_into_the_summary(self):
+        self.assertTrue(summarize_conversation("c1"))
+        state, _ = self.store.load("c1")
+        self.assertEqual(state["summary"], self.script[0])
+        self.assertEqual(state["summarized_until"], SUMMARY_BATCH)
+        prompt = self.backend.calls[-1]["messages"][-1]["content"]
+        self.assertIn("message 0", prompt)
+        self.assertNotIn(f"message {SUMMARY_BATCH // 2}", prompt)
+
+    def test_concurrent_update_wins(self):
+        def complete(messages):
+            # Another worker saves its summary while this one waits for the model
+            self.store.save_summary("c1", "newer summary", SUMMARY_BATCH, 0)
+            return "".join(stream_chat_completion(messages))
+
+        self.assertFalse(summarize_conversation("c1", complete=complete))
+        state, _ = self.store.load("c1")
+        self.assertEqual(state["summary"], "newer summary")
+
+    @mock.patch("chatbot.agent_utils.MODEL_ROUTER", ModelRouter(["model-a"]))
+    def test_broken_stream_keeps_the_stored_summary(self):
+        self.store.save_summary("c1", "good summary", 2, 0)
+        self.backend.fail_after_tokens = 3
+        self.assertFalse(summarize_conversation("c1"))
+        state, _ = self.store.load("c1")
+        self.assertEqual((state["summary"], state["summarized_until"]), ("good summary", 2))
+
+    def test_empty_completion_keeps_the_stored_summary(self):
+        self.store.save_summary("c1", "good summary", 2, 0)
+        self.backend.script = ["   "]
+        self.assertFalse(summarize_conversation("c1"))
+        state, _ = self.store.load("c1")
+        self.assertEqual((state["summary"], state["summarized_until"]), ("good summary", 2))
+
+    def test_nothing_to_summarize(self):
+        self.store.save("c2", {}, _turn(0))
+        self.assertFalse(summarize_conversation("c2"))
+        self.assertEqual(self.backend.calls, [])
+
+# ===========================
+# ESCALATION QUEUE
+# ===========================
+
+class RecordingSink(EscalationSink):
+    name = "recording"
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.delivered = []
+
+    def deliver(self, escalation):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("sink unreachable")
+        self.delivered.append(escalation)
+
+def _escalation(priority="HIGH", risk_level="HIGH", timestamp="2026-01-01T10:00:00"):
+    return {"priority": priority, "triggered": True, "risk_level": risk_level, "timestamp": timestamp}
+
+@override_settings(CHATBOT_ESCALATION_RETRY_BASE=0, CHATBOT_ESCALATION_RETRY_CAP=0)
+class EscalationQueueTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "escalations.sqlite3")
+
+    def queue(self, sink, max_attempts=3):
+        return EscalationQueue(self.path, sinks={sink.name: sink}, dedupe_window=60, max_attempts=max_attempts)
+
+    def test_repeats_coalesce_into_the_waiting_task(self):
+        sink = RecordingSink()
+        queue = self.queue(sink)
+        self.assertEqual(queue.enqueue("c1", _escalation()), "queued")
+        self.assertEqual(queue.enqueue("c1", _escalation("URGENT", "CRISIS", "2026-01-01T10:01:00")), "coalesced")
+        self.assertEqual(queue.drain(), 1)
+        delivered = sink.delivered[0]
+        self.assertEqual(delivered["occurrences"], 2)
+        self.assertEqual((delivered["priority"], delivered["risk_level"]), ("URGENT", "CRISIS"))
+        self.assertEqual((delivered["first_seen"], delivered["last_seen"]), ("2026-01-01T10:00:00", "2026-01-01T10:01:00"))
+
+    def test_recent_delivery_deduplicates(self):
+        sink = RecordingSink()
+        queue = self.queue(sink)
+        queue.enqueue("c1", _escalation("URGENT"))
+        queue.drain()
+        self.assertEqual(queue.enqueue("c1", _escalation("HIGH")), "deduplicated")
+        # A higher priority than the one delivered is never swallowed
+        queue.enqueue("c2", _escalation("HIGH"))
+        queue.drain()
+        self.assertEqual(queue.enqueue("c2", _escalation("URGENT")), "queued")
+        self.assertEqual(queue.enqueue("c3", _escalation()), "queued")
+
+    def test_failed_delivery_is_retried(self):
+        sink = RecordingSink(failures=1)
+        queue = self.queue(sink)
+        queue.enqueue("c1", _escalation())
+        self.assertTrue(queue.run_once())
+        self.assertEqual(queue.counts(), {"pending": 1})
+        queue.drain()
+        self.assertEqual(queue.counts(), {"delivered": 1})
+        self.assertEqual(sink.delivered[0]["attempt"], 2)
+
+    def test_gives_up_after_max_attempts(self):
+        queue = self.queue(RecordingSink(failures=10), max_attempts=3)
+        queue.enqueue("c1", _escalation())
+        self.assertEqual(queue.drain(), 3)
+        self.assertEqual(queue.counts(), {"failed": 1})
+
+    def test_no_sinks(self):
+        self.assertEqual(EscalationQueue(self.path, sinks={}).enqueue("c1", _escalation()), "no_sinks")
+
+class DirectEscalationDispatchTests(TestCase):
+    def test_delivers_in_the_request_and_deduplicates(self):
+        sink = RecordingSink()
+        dispatch = DirectEscalationDispatch(sinks={sink.name: sink}, dedupe_window=60)
+        self.assertEqual(dispatch.enqueue("c1", _escalation()), "delivered")
+        self.assertEqual((sink.delivered[0]["conversation_id"], sink.delivered[0]["attempt"]), ("c1", 1))
+        self.assertEqual(dispatch.enqueue("c1", _escalation()), "deduplicated")
+        self.assertEqual(dispatch.enqueue("c1", _escalation("URGENT")), "delivered")
+        self.assertEqual(len(sink.delivered), 2)
+
+    def test_failed_delivery_is_not_remembered(self):
+        sink = RecordingSink(failures=1)
+        dispatch = DirectEscalationDispatch(sinks={sink.name: sink}, dedupe_window=60)
+        self.assertEqual(dispatch.enqueue("c1", _escalation()), "error")
+        self.assertEqual(dispatch.enqueue("c1", _escalation()), "delivered")
+
+    @override_settings(CHATBOT_ESCALATION_MODE="direct", CHATBOT_ESCALATION_SINKS=["chatbot.escalation_queue.LogSink"])
+    def test_direct_mode_has_no_queue(self):
+        set_escalation_queue(None)
+        self.addCleanup(set_escalation_queue, None)
+        self.assertIsInstance(get_escalation_queue(), DirectEscalationDispatch)
+
+# ===========================
+# SAFETY PLAN PDF
+# ===========================
+
+SAFETY_PLAN = {
+    "created_at": "2026-01-01T10:00:00",
+    "language": "English",
+    "risk_level": "HIGH",
+    "sections": {"warning_signs": ["Not sleeping"], "contacts": ["Umang helpline"]},
+}
+
+class PDFCacheTests(TestCase):
+    def test_renders_once_per_content(self):
+        cache = PDFCache(max_items=2)
+        render = mock.Mock(return_value=b"%PDF-1")
+        key = plan_pdf_key(pdf_plan(SAFETY_PLAN))
+        self.assertEqual(cache.get(key, render), b"%PDF-1")
+        self.assertEqual(cache.get(key, render), b"%PDF-1")
+        render.assert_called_once()
+
+    def test_plans_from_the_same_day_share_a_key(self):
+        later = dict(SAFETY_PLAN, created_at="2026-01-01T18:30:00")
+        self.assertEqual(plan_pdf_key(pdf_plan(SAFETY_PLAN)), plan_pdf_key(pdf_plan(later)))
+        other_level = dict(SAFETY_PLAN, risk_level="CRISIS")
+        self.assertNotEqual(plan_pdf_key(pdf_plan(SAFETY_PLAN)), plan_pdf_key(pdf_plan(other_level)))
+
+    def test_disk_tier_is_shared(self):
+        with tempfile.TemporaryDirectory() as directory:
+            PDFCache(directory=directory).get("key", lambda: b"%PDF-disk")
+            render = mock.Mock()
+            self.assertEqual(PDFCache(directory=directory).get("key", render), b"%PDF-disk")
+            render.assert_not_called()
+
+    def test_failed_render_releases_its_lock(self):
+        cache = PDFCache()
+        with self.assertRaises(RuntimeError):
+            cache.get("key", mock.Mock(side_effect=RuntimeError("render failed")))
+        self.assertEqual(cache._renderings, {})
+        self.assertEqual(cache.get("key", lambda: b"%PDF-retry"), b"%PDF-retry")
+
+@override_settings(CHATBOT_TRACING=False)
+class SafetyPlanDownloadTests(StubBackendTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.get("/")
+        conversation_id = self.client.session["chatbot_conversation_id"]
+        get_conversation_store().save(conversation_id, {"current_agent": "interview", "safety_plan": SAFETY_PLAN}, [])
+
+    @mock.patch("chatbot.views.safety_plan_pdf", return_value=b"%PDF-1")
+    def test_etag_and_not_modified(self, safety_plan_pdf):
+        response = self.client.get("/download-safety-plan/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1")
+        etag = response["ETag"]
+        self.assertEqual(etag, f'"{plan_pdf_key(pdf_plan(SAFETY_PLAN))}"')
+
+        response = self.client.get("/download-safety-plan/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        safety_plan_pdf.assert_called_once()
+
+    def test_missing_plan(self):
+        set_conversation_store(MemoryConversationStore())
+        self.assertEqual(self.client.get("/download-safety-plan/").status_code, 404)
+
+# ===========================
+# ASYNC CHAT VIEW
+# ===========================
+
+# The async view is only routed with CHATBOT_ASYNC; these tests reach it under its own path
+urlpatterns = [
+    path("ask-async/", views.ask_gemini_async_view),
+    path("", include("chatbot.urls")),
+]
+
+@override_settings(ROOT_URLCONF="chatbot.tests", CHATBOT_TRACING=False, CHATBOT_RESPONSE_CACHE=False)
+class AsyncAskViewTests(StubBackendTestCase):
+    script = ["Thank you for telling me. Are you safe right now?" + CRISIS_TRAILER]
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.sink = RecordingSink()
+        set_escalation_queue(EscalationQueue(os.path.join(directory.name, "escalations.sqlite3"), sinks={self.sink.name: self.sink}))
+        self.addCleanup(set_escalation_queue, None)
+
+    def test_interview_turn_work_runs_off_the_event_loop(self):
+        loop_threads = []
+        complete_interview_turn = views._complete_interview_turn
+
+        def record_thread(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                loop_threads.append(threading.current_thread().name)
+            except RuntimeError:
+                pass
+            return complete_interview_turn(*args, **kwargs)
+
+        self.client.get("/")
+        first = self.ask("everything is too much, I want to end it all", url="/ask-async/").json()
+        self.assertEqual(first["current_agent"], "interview")
+        with mock.patch("chatbot.views._complete_interview_turn", side_effect=record_thread) as completed:
+            second = self.ask("I'm alone at home", url="/ask-async/").json()
+        completed.assert_called_once()
+        self.assertEqual(loop_threads, [])
+        self.assertEqual(second["response"], "Thank you for telling me. Are you safe right now?")
+        self.assertTrue(second["safety_plan_available"])
+        self.assertIn("safety_plan", second)
+
+    def test_matches_the_sync_view(self):
+        payloads = []
+        for url in ("/ask-async/", "/ask/"):
+            self.client.get("/")
+            payloads.append([
+                self.ask("everything is too much, I want to end it all", url=url).json(),
+                self.ask("I'm alone at home", url=url).json(),
+            ])
+        self.assertEqual(payloads[0], payloads[1])
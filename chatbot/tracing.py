@@ -0,0 +1,227 @@
+# tracing.py
+# Per-turn latency spans, reported as a Server-Timing header and a structured trace record
+
+import contextvars
+import functools
+import inspect
+import json
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+# ===========================
+# TRACE
+# ===========================
+
+# Trace of the request being handled by the current thread or task (None when tracing is off)
+_current_trace = contextvars.ContextVar("chatbot_trace", default=None)
+
+# Incoming X-Request-ID values accepted as the trace ID
+_TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{8,64}$")
+
+class Trace:
+    """
+    Timings of one chat request
+
+    Durations of the same stage add up (e.g. several failed models under
+    "fallback"), and tags carry context such as the agent and model.
+    """
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.counts = {}
+        self.tags = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        """Add time spent in a stage"""
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Format the stages as a Server-Timing header value, ending with the total"""
+        with self._lock:
+            entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.durations.items()]
+        entries.append(f"total;dur={self.total() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def record(self, **fields):
+        """
+        Get the structured record of the request
+
+        Returns:
+            dict: trace_id, total_ms, per-stage ms and counts, tags and any extra fields
+        """
+        with self._lock:
+            stages = {name: round(seconds * 1000, 2) for name, seconds in self.durations.items()}
+            counts = {name: count for name, count in self.counts.items() if count > 1}
+        record = {
+            "trace_id": self.trace_id,
+            "ts": round(time.time(), 3),
+            "total_ms": round(self.total() * 1000, 2),
+            "stages_ms": stages,
+            **fields,
+            **self.tags,
+        }
+        if counts:
+            record["stage_counts"] = counts
+        return record
+
+def current_trace():
+    """Get the trace of the current request, or None"""
+    return _current_trace.get()
+
+class _Span:
+    __slots__ = ("trace", "name", "started")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.add(self.name, time.perf_counter() - self.started)
+        return False
+
+class _NoSpan:
+    """Span used outside a traced request - does nothing"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(name):
+    """
+    Time a block as one stage of the current request's trace
+
+    Outside a traced request (tracing off, background threads) this
+    returns a shared no-op context manager, so spans can stay in hot paths.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name)
+
+def add_stage(name, seconds):
+    """Add a stage measured elsewhere (e.g. time to first token) to the current trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+def tag_trace(**tags):
+    """Attach context (agent, model, ...) to the current trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.tag(**tags)
+
+# ===========================
+# TRACE RECORDS
+# ===========================
+
+_log_lock = threading.Lock()
+
+def emit_record(record):
+    """Write a trace record to settings.CHATBOT_TRACE_LOG (JSON lines), or print it"""
+    line = json.dumps(record, ensure_ascii=False)
+    if settings.CHATBOT_TRACE_LOG:
+        with _log_lock:
+            with open(settings.CHATBOT_TRACE_LOG, "a", encoding="utf-8") as log:
+                log.write(line + "\n")
+    else:
+        print(f"⏱️ {line}")
+
+# ===========================
+# VIEW INTEGRATION
+# ===========================
+
+def new_trace(request):
+    """Create the trace of a request, continuing the caller's X-Request-ID when it looks like one"""
+    incoming = request.headers.get("X-Request-ID", "")
+    return Trace(incoming if _TRACE_ID_PATTERN.match(incoming) else None)
+
+def activate_trace(trace):
+    """
+    Make a trace current for the spans of this thread or task
+
+    Returns:
+        Token: Context token for finish_trace
+    """
+    return _current_trace.set(trace)
+
+def start_trace(request):
+    """
+    Start a trace for a request and make it current
+
+    Returns:
+        tuple: (trace, context token for finish_trace)
+    """
+    trace = new_trace(request)
+    return trace, activate_trace(trace)
+
+def finish_trace(trace, token, request, response=None, **fields):
+    """Stop tracing a request: add the headers and emit its record"""
+    try:
+        _current_trace.reset(token)
+    except ValueError:
+        # Finished from another context (a streamed response driven by a different thread)
+        _current_trace.set(None)
+    if response is not None:
+        response["Server-Timing"] = trace.server_timing()
+        response["X-Trace-ID"] = trace.trace_id
+    fields.setdefault("status", getattr(response, "status_code", None))
+    emit_record(trace.record(path=request.path, **fields))
+
+def traced(view):
+    """
+    Trace a chat view when settings.CHATBOT_TRACING is on
+
+    The response gets Server-Timing and X-Trace-ID headers, and one
+    record per request is emitted. Works on sync and async views.
+    """
+    if inspect.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not settings.CHATBOT_TRACING:
+                return await view(request, *args, **kwargs)
+            trace, token = start_trace(request)
+            response = None
+            try:
+                response = await view(request, *args, **kwargs)
+                return response
+            finally:
+                finish_trace(trace, token, request, response)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.CHATBOT_TRACING:
+            return view(request, *args, **kwargs)
+        trace, token = start_trace(request)
+        response = None
+        try:
+            response = view(request, *args, **kwargs)
+            return response
+        finally:
+            finish_trace(trace, token, request, response)
+    return wrapper
@@ -1,8 +1,13 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
     path('', views.chatbot_view, name='chatbot'),
-    path('ask/', views.ask_gemini_view, name='ask_gemini'),
+    path('ask/', views.ask_gemini_async_view if settings.CHATBOT_ASYNC else views.ask_gemini_view, name='ask_gemini'),
+    path('ask/stream/', views.ask_stream_view, name='ask_stream'),
+    path('upload-image/', views.upload_image_view, name='upload_image'),
     path('download-safety-plan/', views.download_safety_plan, name='download_safety_plan'),
+    path('status/models/', views.model_status_view, name='model_status'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,15 +1,29 @@
+import hmac
 import json
-import base64
 import traceback
+import io
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse
+from django.http import FileResponse, JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from PIL import Image
-import io
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.cache import get_conditional_response, patch_cache_control
+from asgiref.sync import sync_to_async
 
-from .agent_utils import get_groq_client, get_user_session, save_user_session
-from .orchestrator_agent import get_welcome_message as get_orchestrator_welcome, process_message as process_orchestrator_message
-from .interview_agent import get_welcome_message as get_interview_welcome
+from .agent_utils import MODEL_ROUTER, llm_configured, get_user_session, save_user_session, collect_stream, estimate_tokens, to_prompt_message, turn_index
+from .conversation_store import get_conversation_store
+from .orchestrator_agent import get_welcome_message as get_orchestrator_welcome, stream_message as stream_orchestrator_message, aprocess_message as aprocess_orchestrator_message
+from .interview_agent import get_welcome_message as get_interview_welcome, stream_message as stream_interview_message, aprocess_message as aprocess_interview_message
+from .hedging import HEDGE_STATS
+from .image_uploads import UploadRejected, accept_image_upload, get_image_store, sniff_data_url
+from .llm_cassette import tag_turn
+from .message_analysis import analyze_turn
+from .metrics import METRICS, TURNS
+from .model_router import Deadline
+from .pdf_cache import pdf_plan, plan_pdf_key, safety_plan_pdf
+from .risk_assessment import latest_risk
+from .summarizer import schedule_summary
+from .tracing import activate_trace, finish_trace, new_trace, span, tag_trace, traced
 
 def chatbot_view(request):
     session_data = get_user_session(request)
@@ -17,18 +31,213 @@ def chatbot_view(request):
     session_data["language"] = None
     session_data["conversation_history"] = []
     session_data["referred_to_interview"] = False
+    session_data["safety_plan"] = None
+    session_data["risk_timeline"] = None
     save_user_session(request, session_data)
     
     return render(
         request,
         "chatbot/chatbot.html",
-        {"initial_bot_message": get_orchestrator_welcome()}
+        {
+            "initial_bot_message": get_orchestrator_welcome(),
+            # A session-kept conversation has to be saved before the response headers go out
+            "streaming_enabled": settings.CHATBOT_STREAMING and not get_conversation_store().in_session,
+        }
     )
 
+def _attached_image(data):
+    """
+    Get the format of the image attached to a chat request
+
+    Uploaded images are referenced by the image_id from upload_image_view;
+    a legacy base64 "image" data URL is sniffed from its first bytes only.
+
+    Returns:
+        str: Image format ("image" if the upload is no longer in the store), or None without an image
+    """
+    image_id = data.get("image_id")
+    if image_id:
+        image = get_image_store().get(str(image_id))
+        return image["format"] if image else "image"
+    if data.get("image"):
+        return sniff_data_url(str(data["image"]))
+    return None
+
+def _build_user_content(user_message, image_format):
+    """Build the user turn content, noting any attached image"""
+    user_content = user_message if user_message else "Hello"
+    if image_format:
+        user_content = f"{user_message}\n\n[Note: An image ({image_format}) was attached, but image analysis may be limited in this context.]"
+    return user_content
+
+def _complete_orchestrator_turn(session_data, conversation_history, bot_response, should_switch):
+    """
+    Apply an orchestrator reply, switching to the interview agent when requested
+    
+    Returns:
+        tuple: (bot_response, current_agent)
+    """
+    if not should_switch:
+        return bot_response, "orchestrator"
+    
+    session_data["current_agent"] = "interview"
+    session_data["referred_to_interview"] = True
+    interview_welcome = get_interview_welcome(
+        language=session_data.get("language"),
+        conversation_history=conversation_history
+    )
+    if "I'm a psychiatric interview specialist" not in bot_response:
+        bot_response += "\n\n" + interview_welcome
+    return bot_response, "interview"
+
+def _complete_interview_turn(user_message, conversation_history, session_data, user_id, analysis, conversation_id):
+    """
+    Update the safety plan after an interview reply
+    
+    The plan is a versioned artifact next to the conversation, not part of
+    the reply: the history keeps only the model's words, and the plan is
+    sent to the client only when its version changes. The plan content is
+    kept in the session for download_safety_plan, which renders the PDF only
+    when it is asked for.
+    
+    Returns:
+        dict: New plan for the client (version, html), or None when the client has the current one
+    """
+    from .safety_plan_agent import process_safety_plan
+    previous = session_data.get("safety_plan") or {}
+    with span("safety_plan"):
+        safety_plan_data = process_safety_plan(
+            user_message, conversation_history, session_data, user_id=user_id, analysis=analysis,
+            previous_version=previous.get("version"), conversation_id=conversation_id,
+        )
+    if safety_plan_data["version"] == previous.get("version"):
+        return None
+    
+    session_data["safety_plan"] = {**safety_plan_data["plan_content"], "version": safety_plan_data["version"]}
+    return {"version": safety_plan_data["version"], "html": safety_plan_data["safety_plan_html"]}
+
+def _record_turn(request, session_data, conversation_history, user_content, bot_response, current_agent, analysis, safety_plan=None):
+    """
+    Append the turn to the conversation history and save the session
+    
+    The user entry keeps its analysis record so later turns never re-scan it,
+    and both entries cache their token estimate for context budgeting. The
+    assistant entry keeps the turn's risk assessment as [level, next step]
+    codes; its text is what the user saw, without the trailer.
+    
+    Returns:
+        dict: Response payload (response, current_agent, language, risk_level, safety_plan_available,
+              safety_plan_version, and safety_plan when the plan changed this turn)
+    """
+    assessed = latest_risk(session_data)
+    if assessed is not None and assessed.turn != turn_index(session_data, conversation_history):
+        assessed = None
+    conversation_history.append({
+        "role": "user",
+        "content": user_content,
+        "analysis": analysis.to_record(),
+        "tokens": estimate_tokens(user_content),
+    })
+    assistant_entry = {"role": "assistant", "content": bot_response}
+    if assessed is not None:
+        assistant_entry["risk"] = [int(assessed.level), int(assessed.next_step)]
+    assistant_entry["tokens"] = estimate_tokens(to_prompt_message(assistant_entry)["content"])
+    conversation_history.append(assistant_entry)
+    session_data["conversation_history"] = conversation_history
+    session_data["language"] = session_data.get("language")
+    with span("session_save"):
+        save_user_session(request, session_data)
+    schedule_summary(request.session['chatbot_conversation_id'], session_data)
+    
+    payload = {
+        "response": bot_response,
+        "current_agent": current_agent,
+        "language": session_data.get("language"),
+        "risk_level": assessed.level.name if assessed is not None else None,
+        "safety_plan_available": bool(session_data.get("safety_plan")),
+        "safety_plan_version": (session_data.get("safety_plan") or {}).get("version"),
+    }
+    if safety_plan:
+        payload["safety_plan"] = safety_plan
+    return payload
+
+def _start_turn(request, user_message, user_content, session_data):
+    """
+    Analyze the user message and tag the turn with the agent answering it
+
+    Returns:
+        tuple: (current_agent, conversation_history, analysis)
+    """
+    current_agent = session_data.get("current_agent", "orchestrator")
+    conversation_history = session_data.get("conversation_history", [])
+    with span("detect"):
+        analysis = analyze_turn(user_message, user_content, conversation_history, session_data)
+    tag_trace(agent=current_agent)
+    TURNS.inc(agent=current_agent)
+    tag_turn(request.session['chatbot_conversation_id'], turn_index(session_data, conversation_history), user_message)
+    return current_agent, conversation_history, analysis
+
+def _finish_turn(request, user_message, user_content, conversation_history, session_data, analysis, current_agent, reply):
+    """
+    Apply the agent's reply (hand-off to the interview agent, or safety plan
+    update and escalation) and save the turn
+    
+    Blocking - the escalation is queued in SQLite and the session saved - so
+    the async view runs it in a thread.
+    
+    Args:
+        reply: What the agent returned: (bot_response, should_switch, session_data)
+               from the orchestrator, the reply text from the interview agent
+    
+    Returns:
+        dict: Response payload from _record_turn
+    """
+    safety_plan = None
+    if current_agent == "orchestrator":
+        bot_response, should_switch, session_data = reply
+        bot_response, current_agent = _complete_orchestrator_turn(
+            session_data, conversation_history, bot_response, should_switch
+        )
+    else:
+        bot_response = reply
+        safety_plan = _complete_interview_turn(
+            user_message, conversation_history, session_data, request.user.id, analysis,
+            request.session['chatbot_conversation_id'],
+        )
+    
+    return _record_turn(request, session_data, conversation_history, user_content, bot_response, current_agent, analysis, safety_plan)
+
+def _stream_turn(request, user_message, user_content):
+    """
+    Run one chat turn with the current agent and persist it to the session
+    
+    Yields:
+        str: Text deltas of the agent reply as they arrive
+    
+    Returns:
+        dict: Response payload from _record_turn
+    """
+    deadline = Deadline()
+    with span("session_load"):
+        session_data = get_user_session(request)
+    current_agent, conversation_history, analysis = _start_turn(request, user_message, user_content, session_data)
+
+    if current_agent == "orchestrator":
+        stream_agent_message = stream_orchestrator_message
+    else:
+        stream_agent_message = stream_interview_message
+    reply = yield from stream_agent_message(user_message, user_content, conversation_history, session_data, analysis, deadline)
+    
+    return _finish_turn(request, user_message, user_content, conversation_history, session_data, analysis, current_agent, reply)
+
+def _sse_event(event, data):
+    """Format a Server-Sent Events frame with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @csrf_exempt
+@traced
 def ask_gemini_view(request):
-    client = get_groq_client()
-    if not client:
+    if not llm_configured():
         return JsonResponse(
             {"error": "The AI model is not configured. Please check server logs."},
             status=500,
@@ -40,88 +249,212 @@ def ask_gemini_view(request):
     try:
         data = json.loads(request.body.decode("utf-8"))
         user_message = data.get("message", "").strip()
-        base64_image = data.get("image")
+        image_format = _attached_image(data)
 
-        if not user_message and not base64_image:
+        if not user_message and not image_format:
             return JsonResponse(
                 {"error": "Please provide a message."}, status=400
             )
 
-        session_data = get_user_session(request)
-        current_agent = session_data.get("current_agent", "orchestrator")
-        conversation_history = session_data.get("conversation_history", [])
-        user_language = session_data.get("language")
-
-        user_content = user_message if user_message else "Hello"
-        if base64_image:
-            try:
-                header, encoded = base64_image.split(";base64,")
-                image_bytes = base64.b64decode(encoded)
-                image = Image.open(io.BytesIO(image_bytes))
-                image_format = image.format or 'image'
-                user_content = f"{user_message}\n\n[Note: An image ({image_format}) was attached, but image analysis may be limited in this context.]"
-            except Exception as img_exc:
-                print("⚠️ Image decoding error:", img_exc)
+        user_content = _build_user_content(user_message, image_format)
+        return JsonResponse(collect_stream(_stream_turn(request, user_message, user_content)))
 
-        if current_agent == "orchestrator":
-            bot_response, should_switch, session_data = process_orchestrator_message(
-                user_message, user_content, conversation_history, session_data
+    except Exception as e:
+        print("\n🔴 EXCEPTION IN ask_gemini_view 🔴")
+        traceback.print_exc()
+        return JsonResponse(
+            {"error": f"An unexpected server error occurred: {str(e)}"},
+            status=500,
+        )
+
+@csrf_exempt
+@traced
+async def ask_gemini_async_view(request):
+    """
+    Async variant of ask_gemini_view for ASGI deployments (CHATBOT_ASYNC)
+    
+    The model round trips are awaited on the event loop instead of holding a
+    worker thread; session access and the rest of the turn (safety plan,
+    escalation, save) run in a thread via sync_to_async.
+    """
+    if not llm_configured():
+        return JsonResponse(
+            {"error": "The AI model is not configured. Please check server logs."},
+            status=500,
+        )
+
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    try:
+        data = json.loads(request.body.decode("utf-8"))
+        user_message = data.get("message", "").strip()
+        image_format = _attached_image(data)
+
+        if not user_message and not image_format:
+            return JsonResponse(
+                {"error": "Please provide a message."}, status=400
             )
-            
-            if should_switch:
-                current_agent = "interview"
-                session_data["current_agent"] = "interview"
-                session_data["referred_to_interview"] = True
-                interview_welcome = get_interview_welcome(
-                    language=session_data.get("language"),
-                    conversation_history=conversation_history
-                )
-                if "I'm a psychiatric interview specialist" not in bot_response:
-                    bot_response += "\n\n" + interview_welcome
+
+        deadline = Deadline()
+        user_content = _build_user_content(user_message, image_format)
+        with span("session_load"):
+            session_data = await sync_to_async(get_user_session)(request)
+        current_agent, conversation_history, analysis = _start_turn(request, user_message, user_content, session_data)
+
+        if current_agent == "orchestrator":
+            process_agent_message = aprocess_orchestrator_message
         else:
-            from .interview_agent import process_message as process_interview_message
-            bot_response = process_interview_message(
-                user_message, user_content, conversation_history, session_data
-            )
-            
-            from .safety_plan_agent import process_safety_plan
-            safety_plan_data = process_safety_plan(
-                user_message, conversation_history, session_data, user_id=request.user.id
-            )
-            
-            bot_response += "<br/><br/>" + safety_plan_data["safety_plan_html"]
-        
-        conversation_history.append({"role": "user", "content": user_content})
-        conversation_history.append({"role": "assistant", "content": bot_response})
-        session_data["conversation_history"] = conversation_history
-        session_data["language"] = session_data.get("language")
-        save_user_session(request, session_data)
+            process_agent_message = aprocess_interview_message
+        reply = await process_agent_message(user_message, user_content, conversation_history, session_data, analysis, deadline)
         
-        return JsonResponse({
-            "response": bot_response,
-            "current_agent": current_agent,
-            "language": session_data.get("language"),
-            "safety_plan_available": current_agent == "interview"
-        })
+        payload = await sync_to_async(_finish_turn)(
+            request, user_message, user_content, conversation_history, session_data, analysis, current_agent, reply
+        )
+        return JsonResponse(payload)
 
     except Exception as e:
-        print("\n🔴 EXCEPTION IN ask_gemini_view 🔴")
+        print("\n🔴 EXCEPTION IN ask_gemini_async_view 🔴")
         traceback.print_exc()
         return JsonResponse(
             {"error": f"An unexpected server error occurred: {str(e)}"},
             status=500,
         )
 
+@csrf_exempt
+def ask_stream_view(request):
+    """
+    Streaming variant of ask_gemini_view using Server-Sent Events
+    
+    Emits a "delta" event per chunk of reply text, then a "done" event carrying
+    the same payload as ask_gemini_view (the final text replaces the deltas).
+    The conversation is saved to the conversation store after the response
+    headers are sent; only its ID has to be in the session cookie up front,
+    so this view is refused with SessionConversationStore.
+    For the same reason the stage timings go to the trace record only - the
+    X-Trace-ID header links the response to it.
+    """
+    if not llm_configured():
+        return JsonResponse(
+            {"error": "The AI model is not configured. Please check server logs."},
+            status=500,
+        )
+
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    if get_conversation_store().in_session:
+        return JsonResponse({"error": "Streaming needs a server-side conversation store; use /ask/."}, status=400)
+
+    try:
+        data = json.loads(request.body.decode("utf-8"))
+    except ValueError:
+        return JsonResponse({"error": "Invalid request body"}, status=400)
+    user_message = data.get("message", "").strip()
+    image_format = _attached_image(data)
+
+    if not user_message and not image_format:
+        return JsonResponse(
+            {"error": "Please provide a message."}, status=400
+        )
+
+    # Make sure the session cookie goes out with the headers
+    get_user_session(request)
+
+    trace = new_trace(request) if settings.CHATBOT_TRACING else None
+
+    def event_stream():
+        # Runs when the server iterates the response, possibly on another thread
+        token = activate_trace(trace) if trace is not None else None
+        status = 200
+        try:
+            user_content = _build_user_content(user_message, image_format)
+            turn = _stream_turn(request, user_message, user_content)
+            while True:
+                try:
+                    delta = next(turn)
+                except StopIteration as stop:
+                    payload = stop.value
+                    break
+                yield _sse_event("delta", {"text": delta})
+            yield _sse_event("done", payload)
+        except Exception as e:
+            print("\n🔴 EXCEPTION IN ask_stream_view 🔴")
+            traceback.print_exc()
+            status = 500
+            yield _sse_event("error", {"error": f"An unexpected server error occurred: {str(e)}"})
+        finally:
+            if trace is not None:
+                finish_trace(trace, token, request, status=status, streamed=True)
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    if trace is not None:
+        response["X-Trace-ID"] = trace.trace_id
+    return response
+
+@csrf_exempt
+def upload_image_view(request):
+    """
+    Accept an image attachment as a multipart upload (field "image")
+
+    The body is streamed through ImageUploadHandler, so oversized or
+    non-image uploads are refused without being read in full. The chat
+    request then refers to the image by the returned image_id.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    try:
+        with span("image_upload"):
+            return JsonResponse(accept_image_upload(request))
+    except UploadRejected as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+
 def download_safety_plan(request):
+    """
+    Download the session's latest safety plan as a PDF
+    
+    The PDF is rendered on the first request for its content and then served
+    from the PDF cache. Its content hash is the ETag, so a client that has
+    it already gets a 304.
+    """
     session_data = get_user_session(request)
-    pdf_base64 = session_data.get("safety_plan_pdf")
+    plan_content = session_data.get("safety_plan")
     
-    if not pdf_base64:
+    if not plan_content:
         return JsonResponse({"error": "Safety plan not available"}, status=404)
     
-    import base64
-    pdf_bytes = base64.b64decode(pdf_base64)
+    plan = pdf_plan(plan_content)
+    etag = f'"{plan_pdf_key(plan)}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
     
-    response = HttpResponse(pdf_bytes, content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="safety_plan.pdf"'
+    response = FileResponse(io.BytesIO(safety_plan_pdf(plan)), as_attachment=True, filename="safety_plan.pdf", content_type="application/pdf")
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
     return response
+
+@staff_member_required
+def model_status_view(request):
+    """Model router state (circuit breakers, model list age) and crisis hedging stats for monitoring"""
+    status = MODEL_ROUTER.snapshot()
+    status["hedging"] = HEDGE_STATS.snapshot()
+    return JsonResponse(status)
+
+def metrics_view(request):
+    """
+    Counters and histograms of every worker in the Prometheus text format
+    
+    Scrapers authenticate with "Authorization: Bearer <CHATBOT_METRICS_TOKEN>";
+    without a token configured, only staff sessions can read the metrics.
+    """
+    if settings.CHATBOT_METRICS_TOKEN:
+        authorized = hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {settings.CHATBOT_METRICS_TOKEN}")
+    else:
+        authorized = request.user.is_active and request.user.is_staff
+    if not authorized:
+        return HttpResponse("Forbidden", status=403, content_type="text/plain")
+    return HttpResponse(METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
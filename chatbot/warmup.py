@@ -0,0 +1,64 @@
+# warmup.py
+# Optional warm-up of a fresh process - loads the URLconf and views and opens the LLM connection
+
+import threading
+import time
+from importlib import import_module
+
+from django.conf import settings
+
+# ===========================
+# WARM-UP
+# ===========================
+
+def warm_up():
+    """
+    Do the first-request work of a fresh process ahead of the first request
+
+    Imports the URLconf (and with it the views, agents and keyword tables),
+    creates the LLM backend, and fetches the provider's model list, which
+    opens the pooled HTTPS connection and fills the router's capability
+    table.
+
+    Returns:
+        dict: Milliseconds spent per step
+    """
+    from .agent_utils import MODEL_ROUTER, get_llm_backend
+
+    timings = {}
+    started = time.perf_counter()
+    import_module(settings.ROOT_URLCONF)
+    timings["urls"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    backend = get_llm_backend()
+    timings["backend"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    if backend.is_configured():
+        MODEL_ROUTER.refresh_capabilities()
+    timings["connection"] = (time.perf_counter() - started) * 1000
+
+    print("🔥 Warm-up done: " + ", ".join(f"{step} {ms:.0f} ms" for step, ms in timings.items()))
+    return timings
+
+def _warm_up_safely():
+    try:
+        warm_up()
+    except Exception as e:
+        print(f"⚠️ Warm-up failed (the first request will do the work instead): {e}")
+
+def start_warm_up():
+    """
+    Warm up the process according to settings.CHATBOT_WARM_UP
+
+    'inline' warms up before returning (the server's init phase pays for it,
+    not the first user), 'background' warms up on a daemon thread while the
+    process starts taking requests, and 'off' leaves everything to the first
+    request.
+    """
+    mode = settings.CHATBOT_WARM_UP
+    if mode == "inline":
+        _warm_up_safely()
+    elif mode == "background":
+        threading.Thread(target=_warm_up_safely, name="chatbot-warm-up", daemon=True).start()
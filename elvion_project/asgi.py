@@ -5,3 +5,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "elvion_project.settings")
 
 application = get_asgi_application()
+
+from chatbot.warmup import start_warm_up
+
+start_warm_up()
@@ -1,8 +1,15 @@
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Vercel sets VERCEL=1 in its functions. Their filesystem is read-only apart
+# from a /tmp private to each instance, so no file (such as a SQLite
+# database) is shared between the requests of a conversation there.
+SERVERLESS = bool(os.environ.get('VERCEL'))
+
 
 
 SECRET_KEY = os.environ.get('SECRET_KEY', 'django-insecure-y-nh96c1ncur+fkquj#howq067m81+c(p4o4)%znhj1&86$d7r')
@@ -99,9 +106,178 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-# Use signed cookies for sessions to avoid database writes on serverless (Vercel)
+# Use signed cookies for sessions to avoid database writes on serverless (Vercel).
+# The cookie only holds a conversation ID; history lives in the conversation store.
 SESSION_ENGINE = "django.contrib.sessions.backends.signed_cookies"
 
+# Server-side conversation store (chatbot.conversation_store). The SQLite
+# stores need a database file that every server process can write, so on
+# serverless hosts the conversation is kept in the session cookie instead
+# (SessionConversationStore: the last CHATBOT_SESSION_HISTORY_MESSAGES
+# messages, no rolling summary, no /ask/stream/).
+CHATBOT_CONVERSATION_STORE = os.environ.get(
+    'CHATBOT_CONVERSATION_STORE',
+    'chatbot.conversation_store.SessionConversationStore' if SERVERLESS else 'chatbot.conversation_store.SQLiteConversationStore',
+)
+CHATBOT_CONVERSATION_DB = os.environ.get('CHATBOT_CONVERSATION_DB', str(BASE_DIR / 'conversations.sqlite3'))
+CHATBOT_CONVERSATION_TTL = int(os.environ.get('CHATBOT_CONVERSATION_TTL', 60 * 60 * 24))
+CHATBOT_SESSION_HISTORY_MESSAGES = int(os.environ.get('CHATBOT_SESSION_HISTORY_MESSAGES', 6))
+if SERVERLESS and CHATBOT_CONVERSATION_STORE.endswith('SQLiteConversationStore'):
+    raise ImproperlyConfigured(
+        f"CHATBOT_CONVERSATION_STORE={CHATBOT_CONVERSATION_STORE} keeps conversations in a local SQLite file, which "
+        "serverless instances cannot share. Unset it to use chatbot.conversation_store.SessionConversationStore."
+    )
+
+# Compression of encoded histories (chatbot.history_codec), used by
+# chatbot.conversation_store.CompactSQLiteConversationStore: 'none', 'zlib' or
+# 'zstd' (needs the zstandard package; falls back to zlib without it).
+# 'none' is fastest per request; zlib makes the stored history ~9x smaller
+# than JSON (see the bench_history_codec command).
+CHATBOT_HISTORY_COMPRESSION = os.environ.get('CHATBOT_HISTORY_COMPRESSION', 'zlib')
+
+# Token budgets for the conversation history sent with each prompt
+# (chatbot.context_builder). Crisis turns are always kept on top of the budget.
+CHATBOT_ORCHESTRATOR_HISTORY_TOKENS = int(os.environ.get('CHATBOT_ORCHESTRATOR_HISTORY_TOKENS', 1500))
+CHATBOT_INTERVIEW_HISTORY_TOKENS = int(os.environ.get('CHATBOT_INTERVIEW_HISTORY_TOKENS', 3000))
+
+# When to fold older turns into the rolling conversation summary
+# (chatbot.summarizer): 'background' (worker thread after the response is
+# saved), 'inline' (before responding - use on hosts that freeze idle
+# processes, such as Vercel) or 'off'.
+CHATBOT_SUMMARY_MODE = os.environ.get('CHATBOT_SUMMARY_MODE', 'background')
+
+# Warm-up of fresh server processes (chatbot.warmup), run from the WSGI entry
+# points: 'inline' loads the views and opens the LLM connection before the
+# first request (use on Vercel, where it runs in the init phase), 'background'
+# does it on a thread while requests are already served, 'off' leaves it to
+# the first request.
+CHATBOT_WARM_UP = os.environ.get('CHATBOT_WARM_UP', 'off')
+
+# Exact-match cache of orchestrator replies (chatbot.response_cache), off by
+# default. Only plain-text turns without any risk, concern or referral signal
+# in the message or history are looked up, and only complete replies assessed
+# as LOW risk are stored: at most CHATBOT_RESPONSE_CACHE_SIZE per process,
+# each for CHATBOT_RESPONSE_CACHE_TTL seconds.
+CHATBOT_RESPONSE_CACHE = os.environ.get('CHATBOT_RESPONSE_CACHE', 'False') == 'True'
+CHATBOT_RESPONSE_CACHE_SIZE = int(os.environ.get('CHATBOT_RESPONSE_CACHE_SIZE', 256))
+CHATBOT_RESPONSE_CACHE_TTL = float(os.environ.get('CHATBOT_RESPONSE_CACHE_TTL', 60 * 60))
+
+# LLM backend (chatbot.llm_backends): GroqBackend (GROQ_API_KEY),
+# OpenAICompatibleBackend (any /v1/chat/completions server at
+# CHATBOT_LLM_BASE_URL) or StubBackend (in-process, for load tests and
+# offline work). CHATBOT_LLM_MODELS overrides the fallback model list,
+# e.g. with the model names a local server serves.
+CHATBOT_LLM_BACKEND = os.environ.get('CHATBOT_LLM_BACKEND', 'chatbot.llm_backends.GroqBackend')
+CHATBOT_LLM_BASE_URL = os.environ.get('CHATBOT_LLM_BASE_URL', 'http://localhost:8000/v1')
+CHATBOT_LLM_API_KEY = os.environ.get('CHATBOT_LLM_API_KEY', '')
+CHATBOT_LLM_MODELS = [model.strip() for model in os.environ.get('CHATBOT_LLM_MODELS', '').split(',') if model.strip()]
+
+# StubBackend latency and failure injection
+CHATBOT_STUB_TTFT = float(os.environ.get('CHATBOT_STUB_TTFT', 0.25))
+CHATBOT_STUB_TOKEN_DELAY = float(os.environ.get('CHATBOT_STUB_TOKEN_DELAY', 0.02))
+CHATBOT_STUB_FAILURE_RATE = float(os.environ.get('CHATBOT_STUB_FAILURE_RATE', 0))
+CHATBOT_STUB_SEED = int(os.environ.get('CHATBOT_STUB_SEED', 0))
+
+# Record/replay LLM traffic (chatbot.llm_cassette): 'record' appends every
+# completion of the configured backend to the cassette, 'replay' serves the
+# cassette instead of a model (CHATBOT_REPLAY_SPEED 1 = recorded timing,
+# 0 = no delays). Cassettes hold users' messages - keep them out of git and
+# only record test or consented traffic.
+CHATBOT_LLM_CASSETTE = os.environ.get('CHATBOT_LLM_CASSETTE', '')
+CHATBOT_LLM_CASSETTE_PATH = os.environ.get('CHATBOT_LLM_CASSETTE_PATH', str(BASE_DIR / 'llm_cassette.jsonl'))
+CHATBOT_REPLAY_SPEED = float(os.environ.get('CHATBOT_REPLAY_SPEED', 1))
+CHATBOT_REPLAY_STRICT = os.environ.get('CHATBOT_REPLAY_STRICT', 'False') == 'True'
+
+# Per-stage latency of chat turns (chatbot.tracing): a Server-Timing header on
+# JSON responses and one JSON record per request, appended to
+# CHATBOT_TRACE_LOG or printed to the server log when that is empty.
+CHATBOT_TRACING = os.environ.get('CHATBOT_TRACING', 'True') == 'True'
+CHATBOT_TRACE_LOG = os.environ.get('CHATBOT_TRACE_LOG', '')
+
+# Prometheus metrics at /metrics/ (chatbot.metrics). With several worker
+# processes, point CHATBOT_METRICS_DIR at a directory they share: each writes
+# its counts there and the endpoint adds them up. Empty the directory when
+# deploying. Scrapers send "Authorization: Bearer <CHATBOT_METRICS_TOKEN>";
+# without a token only staff sessions can read the endpoint.
+CHATBOT_METRICS_DIR = os.environ.get('CHATBOT_METRICS_DIR', '')
+CHATBOT_METRICS_TOKEN = os.environ.get('CHATBOT_METRICS_TOKEN', '')
+
+# Rendered safety plan PDFs, cached by content hash (chatbot.pdf_cache): the
+# most recent CHATBOT_PDF_CACHE_SIZE in memory per process, plus an optional
+# directory shared by workers and kept across restarts.
+CHATBOT_PDF_CACHE_SIZE = int(os.environ.get('CHATBOT_PDF_CACHE_SIZE', 64))
+CHATBOT_PDF_CACHE_DIR = os.environ.get('CHATBOT_PDF_CACHE_DIR', '')
+
+# Safety plan PDF rendering (chatbot.pdf_renderer): a pool of
+# CHATBOT_PDF_WORKERS processes (0 = render in the request thread) taking at
+# most CHATBOT_PDF_MAX_PENDING renderings at once. CHATBOT_PDF_FONT is a TTF
+# with Latin and Urdu glyphs; by default DejaVu Sans or Arial is looked up.
+# Install uharfbuzz to shape Urdu text (joined letters, right-to-left).
+CHATBOT_PDF_WORKERS = int(os.environ.get('CHATBOT_PDF_WORKERS', 2))
+CHATBOT_PDF_MAX_PENDING = int(os.environ.get('CHATBOT_PDF_MAX_PENDING', 8))
+CHATBOT_PDF_RENDER_TIMEOUT = float(os.environ.get('CHATBOT_PDF_RENDER_TIMEOUT', 30))
+CHATBOT_PDF_FONT = os.environ.get('CHATBOT_PDF_FONT', '')
+CHATBOT_PDF_FONT_BOLD = os.environ.get('CHATBOT_PDF_FONT_BOLD', '')
+
+# Human escalation dispatch (chatbot.escalation_queue): escalations are queued
+# in the SQLite database CHATBOT_ESCALATION_DB and delivered to each sink in
+# CHATBOT_ESCALATION_SINKS by CHATBOT_ESCALATION_WORKERS threads per process
+# (0 = run `manage.py escalation_worker` instead). Repeats for a conversation
+# within CHATBOT_ESCALATION_DEDUPE_WINDOW seconds are folded into one
+# delivery; failed deliveries are retried with exponential backoff up to
+# CHATBOT_ESCALATION_MAX_ATTEMPTS times. WebhookSink posts JSON to
+# CHATBOT_ESCALATION_WEBHOOK_URL (`manage.py escalation_webhook` runs a local
+# stand-in receiver). Serverless hosts can neither share the database nor
+# keep worker threads running, so CHATBOT_ESCALATION_MODE defaults to
+# 'direct' there: one delivery attempt per sink within the request, with
+# repeats deduplicated per instance ('queue' is refused at startup).
+CHATBOT_ESCALATION_MODE = os.environ.get('CHATBOT_ESCALATION_MODE', 'direct' if SERVERLESS else 'queue')
+if SERVERLESS and CHATBOT_ESCALATION_MODE == 'queue':
+    raise ImproperlyConfigured(
+        "CHATBOT_ESCALATION_MODE=queue keeps escalations in a local SQLite file (CHATBOT_ESCALATION_DB) delivered by "
+        "worker threads, which serverless instances can neither share nor keep running. Unset it to deliver directly."
+    )
+CHATBOT_ESCALATION_DB = os.environ.get('CHATBOT_ESCALATION_DB', str(BASE_DIR / 'escalations.sqlite3'))
+CHATBOT_ESCALATION_SINKS = [sink.strip() for sink in os.environ.get('CHATBOT_ESCALATION_SINKS', 'chatbot.escalation_queue.LogSink').split(',') if sink.strip()]
+CHATBOT_ESCALATION_WORKERS = int(os.environ.get('CHATBOT_ESCALATION_WORKERS', 1))
+CHATBOT_ESCALATION_DEDUPE_WINDOW = float(os.environ.get('CHATBOT_ESCALATION_DEDUPE_WINDOW', 15 * 60))
+CHATBOT_ESCALATION_MAX_ATTEMPTS = int(os.environ.get('CHATBOT_ESCALATION_MAX_ATTEMPTS', 8))
+CHATBOT_ESCALATION_RETRY_BASE = float(os.environ.get('CHATBOT_ESCALATION_RETRY_BASE', 2))
+CHATBOT_ESCALATION_RETRY_CAP = float(os.environ.get('CHATBOT_ESCALATION_RETRY_CAP', 300))
+CHATBOT_ESCALATION_WEBHOOK_URL = os.environ.get('CHATBOT_ESCALATION_WEBHOOK_URL', '')
+CHATBOT_ESCALATION_WEBHOOK_TOKEN = os.environ.get('CHATBOT_ESCALATION_WEBHOOK_TOKEN', '')
+CHATBOT_ESCALATION_WEBHOOK_TIMEOUT = float(os.environ.get('CHATBOT_ESCALATION_WEBHOOK_TIMEOUT', 5))
+
+# Image attachments (chatbot.image_uploads): uploads over
+# CHATBOT_IMAGE_MAX_BYTES or CHATBOT_IMAGE_MAX_PIXELS are refused; the rest
+# are downscaled to CHATBOT_IMAGE_MAX_DIMENSION pixels on the long side by
+# CHATBOT_IMAGE_WORKERS threads. The last CHATBOT_IMAGE_CACHE_ITEMS processed
+# images are kept by content hash, so repeated uploads are processed once.
+CHATBOT_IMAGE_MAX_BYTES = int(os.environ.get('CHATBOT_IMAGE_MAX_BYTES', 8 * 1024 * 1024))
+CHATBOT_IMAGE_MAX_PIXELS = int(os.environ.get('CHATBOT_IMAGE_MAX_PIXELS', 40_000_000))
+CHATBOT_IMAGE_MAX_DIMENSION = int(os.environ.get('CHATBOT_IMAGE_MAX_DIMENSION', 1280))
+CHATBOT_IMAGE_WORKERS = int(os.environ.get('CHATBOT_IMAGE_WORKERS', 2))
+CHATBOT_IMAGE_CACHE_ITEMS = int(os.environ.get('CHATBOT_IMAGE_CACHE_ITEMS', 128))
+
+# Time budget for one chat turn across all model attempts, and the most a
+# single model call may take of it (chatbot.model_router).
+CHATBOT_REQUEST_DEADLINE = float(os.environ.get('CHATBOT_REQUEST_DEADLINE', 45))
+CHATBOT_MODEL_CALL_TIMEOUT = float(os.environ.get('CHATBOT_MODEL_CALL_TIMEOUT', 20))
+
+# Hedge crisis turns of the interview agent: if the first token has not
+# arrived after CHATBOT_HEDGE_DELAY seconds, race a second model and keep
+# whichever streams first (chatbot.hedging). Costs extra tokens when it fires.
+CHATBOT_HEDGE_CRISIS = os.environ.get('CHATBOT_HEDGE_CRISIS', 'False') == 'True'
+CHATBOT_HEDGE_DELAY = float(os.environ.get('CHATBOT_HEDGE_DELAY', 1.5))
+
+# Stream chat replies token by token over Server-Sent Events (/ask/stream/).
+CHATBOT_STREAMING = os.environ.get('CHATBOT_STREAMING', 'True') == 'True'
+
+# Serve /ask/ with the native async view and async Groq client. Only enable
+# when running under ASGI (elvion_project.asgi, e.g. `uvicorn
+# elvion_project.asgi:application`); the sync view stays the WSGI default.
+CHATBOT_ASYNC = os.environ.get('CHATBOT_ASYNC', 'False') == 'True'
+
 
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
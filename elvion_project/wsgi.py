@@ -5,3 +5,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "elvion_project.settings")
 
 application = get_wsgi_application()
+
+from chatbot.warmup import start_warm_up
+
+start_warm_up()